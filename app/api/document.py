@@ -1,27 +1,40 @@
+from collections.abc import Iterator
 import json
 import os
 import uuid
-from io import BytesIO
-from typing import Annotated
+import zipfile
+from typing import Annotated, BinaryIO
 from uuid import UUID
 
 from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
 from google.cloud import pubsub_v1
-from langchain_qdrant import QdrantVectorStore
 from minio import Minio
 from sqlalchemy.orm import Session
 
-from app.core.config import S3Settings, get_pubsub_settings, get_s3_settings
+from app.core.config import (
+    IngestionSettings,
+    S3Settings,
+    get_ingestion_settings,
+    get_pubsub_settings,
+    get_s3_settings,
+)
 from app.db.database import get_db
-from app.dependencies import get_qdrant_vector_store, get_s3_client, get_user
+from app.dependencies import get_s3_client, get_user
 from app.exceptions.document import DocumentNotFoundException
+from app.exceptions.ingestion import IngestionJobNotFoundException
 from app.exceptions.user import UserNotFoundException
+from app.models.document import FileType
 from app.models.user import User
-from app.schemas.document import CreateDocument, GetDocumentDetail
-from app.services.chunk import service as chunk_service
+from app.schemas.document import CreateDocument, GetDocumentDetail, UpdateDocument
+from app.schemas.ingestion import (
+    BulkUploadResponse,
+    BulkUploadResult,
+    EnqueuedDocument,
+    GetIngestionJob,
+)
 from app.services.document import service
+from app.services.ingestion import service as ingestion_service
 from app.services.s3 import service as s3_service
-from app.services.vector import service as vector_service
 
 router = APIRouter(
     prefix="/users/{user_id}/documents",
@@ -37,6 +50,49 @@ topic_path = publisher.topic_path(
 )
 
 
+def get_upload_filename_and_type(upload_file: UploadFile) -> tuple[str, FileType]:
+    if not upload_file.filename:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Your submitted file must have a filename",
+        )
+    file_extension = os.path.splitext(upload_file.filename)[1]
+    file_type = service.extension_to_filetype(file_extension)
+    if not file_type:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This type of file cannot be uploaded as a document, please try a different one",
+        )
+    return upload_file.filename, file_type
+
+
+def iter_upload_entries(
+    upload_files: list[UploadFile],
+) -> Iterator[tuple[str, BinaryIO | None, int]]:
+    """Yields (filename, file, size) for every uploaded file and zip archive entry.
+
+    Archive entries are decompressed lazily while they are read, so an archive
+    is never extracted as a whole. The file is None for unreadable archives.
+    """
+    for upload_file in upload_files:
+        filename = upload_file.filename or ""
+        if os.path.splitext(filename)[1].lower() != ".zip":
+            yield filename, upload_file.file, upload_file.size if upload_file.size is not None else -1
+            continue
+        try:
+            archive = zipfile.ZipFile(upload_file.file)
+        except zipfile.BadZipFile:
+            yield filename, None, -1
+            continue
+        with archive:
+            for entry in archive.infolist():
+                entry_name = os.path.basename(entry.filename)
+                if entry.is_dir() or entry.filename.startswith("__MACOSX/") or not entry_name:
+                    continue
+                with archive.open(entry) as entry_file:
+                    yield entry_name, entry_file, entry.file_size
+
+
 @router.get("/", response_model=list[GetDocumentDetail], status_code=status.HTTP_200_OK)
 @router.get("", response_model=list[GetDocumentDetail], status_code=status.HTTP_200_OK)
 def get_user_documents(
@@ -58,9 +114,8 @@ def get_user_documents(
         )
 
 
-@router.post("/", status_code=status.HTTP_201_CREATED)
-@router.post("", status_code=status.HTTP_201_CREATED) 
-
+@router.post("/", response_model=EnqueuedDocument, status_code=status.HTTP_202_ACCEPTED)
+@router.post("", response_model=EnqueuedDocument, status_code=status.HTTP_202_ACCEPTED)
 def create_document(
     user_id: UUID,
     user: Annotated[User, Depends(get_user)],
@@ -68,53 +123,281 @@ def create_document(
     upload_file: Annotated[UploadFile, File(...)],
     s3_client: Annotated[Minio, Depends(get_s3_client)],
     s3_settings: Annotated[S3Settings, Depends(get_s3_settings)],
-    vector_store: Annotated[QdrantVectorStore, Depends(get_qdrant_vector_store)],
 ):
-    if not upload_file.filename:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Your submitted file must have a filename",
-        )
+    filename, file_type = get_upload_filename_and_type(upload_file)
     if user.id != user_id:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="You are not allowed to perform this action",
         )
 
-    file_extension = os.path.splitext(upload_file.filename)[1]
-    file_type = service.extension_to_filetype(file_extension)
-
-    if not file_type:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="This type of file cannot be uploaded as a document, please try a different one",
+    content_hash = service.compute_content_hash(upload_file.file)
+    duplicate_job = ingestion_service.find_duplicate_job(db, user_id, content_hash)
+    if duplicate_job:
+        return EnqueuedDocument(
+            document_id=duplicate_job.document_id,
+            job_id=duplicate_job.id,
+            deduplicated=True,
         )
-    file_bytes = BytesIO(upload_file.file.read())
 
+    # UploadFile is already spooled to disk by Starlette, stream it from there
     s3_location = s3_service.load_document_into_s3(
-        file_bytes,
+        upload_file.file,
+        upload_file.size if upload_file.size is not None else -1,
         user_id,
-        upload_file.filename,
+        filename,
         upload_file.content_type,
         s3_client,
         s3_settings,
     )
-    chunk_ids = vector_service.load_document_into_vector_database(
-        file_bytes, file_extension, vector_store
-    )
     document_id = uuid.uuid4()
     service.create_document_for_user(
         db,
         CreateDocument(
             id=document_id,
-            name=upload_file.filename,
+            name=filename,
             file_type=file_type,
             size=upload_file.size or -1,
             s3_location=s3_location,
             user_id=user_id,
+            content_hash=content_hash,
         ),
     )
-    chunk_service.create_chunks_into_document(db, chunk_ids, document_id)
+    job = ingestion_service.enqueue_document(db, document_id)
+    return EnqueuedDocument(document_id=document_id, job_id=job.id)
+
+
+@router.post(
+    "/bulk", response_model=BulkUploadResponse, status_code=status.HTTP_202_ACCEPTED
+)
+def create_documents(
+    user_id: UUID,
+    user: Annotated[User, Depends(get_user)],
+    db: Annotated[Session, Depends(get_db)],
+    upload_files: Annotated[list[UploadFile], File(...)],
+    s3_client: Annotated[Minio, Depends(get_s3_client)],
+    s3_settings: Annotated[S3Settings, Depends(get_s3_settings)],
+    ingestion_settings: Annotated[IngestionSettings, Depends(get_ingestion_settings)],
+):
+    """Uploads many files, or zip archives of files, as a single ingestion batch.
+
+    Every document and ingestion job is created in one transaction, and the
+    worker embeds the documents of a batch together. Files that cannot be
+    uploaded are reported in their own result instead of failing the request.
+    """
+    if user.id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="You are not allowed to perform this action",
+        )
+
+    batch_id = uuid.uuid4()
+    results: list[BulkUploadResult] = []
+    new_documents: list[CreateDocument] = []
+    uploaded_by_hash: dict[str, BulkUploadResult] = {}
+    uploaded_names: set[str] = set()
+    try:
+        for filename, file, size in iter_upload_entries(upload_files):
+            if len(results) == ingestion_settings.BULK_UPLOAD_MAX_FILES:
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"At most {ingestion_settings.BULK_UPLOAD_MAX_FILES} files can be uploaded at once",
+                )
+            if file is None:
+                results.append(
+                    BulkUploadResult(filename=filename, error="The archive could not be read")
+                )
+                continue
+            file_type = service.extension_to_filetype(os.path.splitext(filename)[1])
+            if not file_type:
+                results.append(
+                    BulkUploadResult(
+                        filename=filename,
+                        error="This type of file cannot be uploaded as a document",
+                    )
+                )
+                continue
+
+            content_hash = service.compute_content_hash(file)
+            duplicate = uploaded_by_hash.get(content_hash)
+            if not duplicate and filename in uploaded_names:
+                # Objects are keyed by user and filename, so it would overwrite the first one
+                results.append(
+                    BulkUploadResult(
+                        filename=filename,
+                        error="Another file with the same name was uploaded in this batch",
+                    )
+                )
+                continue
+            if duplicate:
+                results.append(
+                    duplicate.model_copy(update={"filename": filename, "deduplicated": True})
+                )
+                continue
+            duplicate_job = ingestion_service.find_duplicate_job(db, user_id, content_hash)
+            if duplicate_job:
+                results.append(
+                    BulkUploadResult(
+                        filename=filename,
+                        document_id=duplicate_job.document_id,
+                        job_id=duplicate_job.id,
+                        deduplicated=True,
+                    )
+                )
+                continue
+
+            try:
+                s3_location = s3_service.load_document_into_s3(
+                    file, size, user_id, filename, None, s3_client, s3_settings
+                )
+            except Exception:
+                # The upload error is already logged; the other files still go through
+                results.append(
+                    BulkUploadResult(filename=filename, error="The file could not be uploaded")
+                )
+                continue
+            document_id = uuid.uuid4()
+            new_documents.append(
+                CreateDocument(
+                    id=document_id,
+                    name=filename,
+                    file_type=file_type,
+                    size=size,
+                    s3_location=s3_location,
+                    user_id=user_id,
+                    content_hash=content_hash,
+                )
+            )
+            result = BulkUploadResult(filename=filename, document_id=document_id)
+            uploaded_by_hash[content_hash] = result
+            uploaded_names.add(filename)
+            results.append(result)
+
+        service.create_documents_for_user(db, new_documents)
+        jobs = ingestion_service.enqueue_documents(
+            db, [document.id for document in new_documents], batch_id=batch_id
+        )
+    except Exception:
+        db.rollback()
+        # Nothing was committed, so the objects already uploaded are orphans
+        for document in new_documents:
+            s3_service.delete_document_from_s3(document.s3_location, s3_client, s3_settings)
+        raise
+
+    job_ids = {job.document_id: job.id for job in jobs}
+    for result in results:
+        if result.document_id in job_ids and result.job_id is None:
+            result.job_id = job_ids[result.document_id]
+    return BulkUploadResponse(batch_id=batch_id, results=results)
+
+
+@router.put(
+    "/{document_id}",
+    response_model=EnqueuedDocument,
+    status_code=status.HTTP_202_ACCEPTED,
+)
+def replace_document(
+    user_id: UUID,
+    document_id: UUID,
+    user: Annotated[User, Depends(get_user)],
+    db: Annotated[Session, Depends(get_db)],
+    upload_file: Annotated[UploadFile, File(...)],
+    s3_client: Annotated[Minio, Depends(get_s3_client)],
+    s3_settings: Annotated[S3Settings, Depends(get_s3_settings)],
+):
+    filename, file_type = get_upload_filename_and_type(upload_file)
+    if user.id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="You are not allowed to perform this action",
+        )
+    try:
+        document = service.get_document(db, document_id)
+    except DocumentNotFoundException:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Could not find the document you are trying to replace",
+        )
+    if document.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Could not find the document you are trying to replace",  # Raise 404 to avoid leaking existance of resource
+        )
+    if ingestion_service.has_active_job(db, document_id):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="This document is still being processed, please try again once it is ready",
+        )
+
+    content_hash = service.compute_content_hash(upload_file.file)
+    if content_hash == document.content_hash:
+        job = ingestion_service.get_latest_job_for_document(db, document_id)
+        return EnqueuedDocument(document_id=document_id, job_id=job.id, deduplicated=True)
+
+    previous_s3_location = document.s3_location
+    s3_location = s3_service.load_document_into_s3(
+        upload_file.file,
+        upload_file.size if upload_file.size is not None else -1,
+        user_id,
+        filename,
+        upload_file.content_type,
+        s3_client,
+        s3_settings,
+    )
+    service.update_document(
+        db,
+        document_id,
+        UpdateDocument(
+            name=filename,
+            file_type=file_type,
+            size=upload_file.size or -1,
+            s3_location=s3_location,
+            content_hash=content_hash,
+        ),
+    )
+    if previous_s3_location != s3_location:
+        s3_service.delete_document_from_s3(previous_s3_location, s3_client, s3_settings)
+
+    # Only the chunks that changed are embedded again, see VectorService
+    job = ingestion_service.enqueue_document(db, document_id)
+    return EnqueuedDocument(document_id=document_id, job_id=job.id)
+
+
+@router.get(
+    "/{document_id}/status",
+    response_model=GetIngestionJob,
+    status_code=status.HTTP_200_OK,
+)
+def get_document_status(
+    user_id: UUID,
+    document_id: UUID,
+    user: Annotated[User, Depends(get_user)],
+    db: Annotated[Session, Depends(get_db)],
+):
+    if user.id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="You are not allowed to perform this action",
+        )
+    try:
+        document = service.get_document(db, document_id)
+    except DocumentNotFoundException:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Could not find the document you are looking for",
+        )
+    if document.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Could not find the document you are looking for",  # Raise 404 to avoid leaking existance of resource
+        )
+    try:
+        return ingestion_service.get_latest_job_for_document(db, document_id)
+    except IngestionJobNotFoundException:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="This document has no ingestion job",
+        )
 
 
 @router.delete("/{document_id}")
@@ -1,8 +1,33 @@
-from typing import Annotated
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+from collections.abc import AsyncIterator, Awaitable
+import json
+from typing import Annotated, TypeVar
+from uuid import UUID
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from qdrant_client import AsyncQdrantClient
+from sqlalchemy.orm import Session
+from app.core.config import get_retrieval_settings
+from app.core.metrics import record_error
+from app.core.timing import StageTimer
+from app.db.database import SessionLocal, get_db
+from app.exceptions.chat import ChatNotFoundException
 from app.models.user import User
-from app.dependencies import get_user, get_qdrant_vector_store
+from app.schemas.llm import BatchGenerateRequest, BatchGenerateResponse, BatchGenerateResult
+from app.schemas.message import CreateMessage
+from app.dependencies import get_async_qdrant_client, get_user, get_qdrant_vector_store
+from app.services.chat import service as chat_service
+from app.services.document import service as document_service
 from app.services.llm import service as llm_service
+from app.services.message import service as message_service
+from app.services.single_flight import service as single_flight_service
+
+retrieval_settings = get_retrieval_settings()
+
+T = TypeVar("T")
+
+DISCONNECT_POLL_SECONDS = 0.5
 
 router = APIRouter(
     prefix="/llm",
@@ -10,15 +35,216 @@ router = APIRouter(
     responses={404: {"detail": "Resource not found"}},
 )
 
+
+def get_chat_document_ids(
+    db: Session, user: User, chat_id: UUID | None
+) -> list[UUID] | None:
+    # Answers only use the user's own documents, restricted to the chat's
+    # documents when the chat has any attached
+    if chat_id is None:
+        return None
+    try:
+        chat = chat_service.get_chat(db, chat_id)
+    except ChatNotFoundException:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Could not find the chat you are looking for",
+        )
+    if chat.user_id != user.id:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Could not find the chat you are looking for",  # Raise 404 to avoid leaking existance of resource
+        )
+    return [document.id for document in chat.documents] or None
+
+
+async def run_until_disconnected(request: Request, awaitable: Awaitable[T]) -> T:
+    """Awaits `awaitable`, cancelling it as soon as the client disconnects."""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                # Nobody reads the response; 499 only shows up in the access log
+                raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        _ = task.cancel()
+
+
 @router.post("/generate")
 async def generate_response(
     
     query: str,
+    request: Request,
+    http_response: Response,
+    user: Annotated[User, Depends(get_user)],
+    db: Annotated[Session, Depends(get_db)],
     vector_store=Depends(get_qdrant_vector_store),
+    client: AsyncQdrantClient = Depends(get_async_qdrant_client),
+    chat_id: UUID | None = None,
+    cache_control: Annotated[str | None, Header()] = None,
 ):
     
     if not query:
         raise HTTPException(status_code=400, detail="Query is required.")
 
-    response = llm_service.generate_response(query, vector_store)
+    # The session is synchronous, so queries run in the threadpool
+    document_ids = await run_in_threadpool(get_chat_document_ids, db, user, chat_id)
+
+    # "Cache-Control: no-cache" forces a fresh answer, which then replaces the cached one
+    use_cache = "no-cache" not in (cache_control or "").lower()
+    corpus_version = await run_in_threadpool(
+        document_service.get_corpus_version, db, user.id, document_ids
+    )
+    timer = StageTimer()
+    # Identical questions asked at the same time share one generation
+    key = single_flight_service.key(query, user.id, document_ids, corpus_version, use_cache)
+    try:
+        response = await run_until_disconnected(
+            request,
+            asyncio.wait_for(
+                single_flight_service.run(
+                    key,
+                    lambda: llm_service.agenerate_response(
+                        query,
+                        vector_store,
+                        client,
+                        user.id,
+                        document_ids,
+                        corpus_version,
+                        use_cache,
+                        timer,
+                    ),
+                    timer,
+                ),
+                timeout=retrieval_settings.GENERATE_TIMEOUT_SECONDS,
+            ),
+        )
+    except TimeoutError as e:
+        record_error("generate", e)
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail="Timed out generating the response",
+        )
+    http_response.headers["Server-Timing"] = timer.server_timing()
     return {"response": response}
+
+
+def format_sse(event: str, data: object) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def persist_answer(chat_id: UUID, answer: str) -> UUID:
+    # The request's session may already be closed once the stream ends
+    with SessionLocal() as db:
+        message = message_service.create_message(
+            db, CreateMessage(content=answer, from_user=False), chat_id
+        )
+        return message.id
+
+
+@router.post("/generate/stream")
+async def stream_response(
+    query: str,
+    user: Annotated[User, Depends(get_user)],
+    db: Annotated[Session, Depends(get_db)],
+    vector_store=Depends(get_qdrant_vector_store),
+    client: AsyncQdrantClient = Depends(get_async_qdrant_client),
+    chat_id: UUID | None = None,
+    persist: bool = False,
+    cache_control: Annotated[str | None, Header()] = None,
+):
+    """Streams the answer as server-sent events: sources, tokens, then done.
+
+    With `persist`, the complete answer is stored as a message of the chat
+    and its id is added to the done event. The generation stops when the
+    client disconnects.
+    """
+    if not query:
+        raise HTTPException(status_code=400, detail="Query is required.")
+    if persist and chat_id is None:
+        raise HTTPException(status_code=400, detail="A chat is required to persist the answer.")
+
+    document_ids = await run_in_threadpool(get_chat_document_ids, db, user, chat_id)
+    use_cache = "no-cache" not in (cache_control or "").lower()
+    corpus_version = await run_in_threadpool(
+        document_service.get_corpus_version, db, user.id, document_ids
+    )
+
+    key = single_flight_service.key(query, user.id, document_ids, corpus_version, use_cache)
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            async for event, data in single_flight_service.stream(
+                key,
+                lambda: llm_service.astream_response(
+                    query, vector_store, client, user.id, document_ids, corpus_version, use_cache
+                ),
+            ):
+                if event == "done" and persist and chat_id is not None:
+                    # The event is shared with identical streams, so it is copied
+                    data = {
+                        **data,
+                        "message_id": await run_in_threadpool(
+                            persist_answer, chat_id, data["answer"]
+                        ),
+                    }
+                yield format_sse(event, data)
+        except Exception as e:
+            # The 200 response has already been sent, so the client learns of
+            # the failure through the stream
+            record_error("stream", e)
+            yield format_sse("error", {"detail": "Error al generar la respuesta."})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Proxies must not buffer the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/generate/batch", response_model=BatchGenerateResponse)
+def generate_batch_response(
+    request: BatchGenerateRequest,
+    user: Annotated[User, Depends(get_user)],
+    db: Annotated[Session, Depends(get_db)],
+    vector_store=Depends(get_qdrant_vector_store),
+    cache_control: Annotated[str | None, Header()] = None,
+):
+    if not request.queries:
+        raise HTTPException(status_code=400, detail="At least one query is required.")
+    if len(request.queries) > retrieval_settings.LLM_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {retrieval_settings.LLM_BATCH_MAX_QUERIES} queries can be sent at once",
+        )
+
+    document_ids = get_chat_document_ids(db, user, request.chat_id)
+    use_cache = "no-cache" not in (cache_control or "").lower()
+    corpus_version = document_service.get_corpus_version(db, user.id, document_ids)
+    queries = [query for query in request.queries if query]
+    answers = iter(
+        llm_service.generate_batch(
+            queries, vector_store, user.id, document_ids, corpus_version, use_cache
+        )
+        if queries
+        else []
+    )
+
+    results: list[BatchGenerateResult] = []
+    for query in request.queries:
+        if not query:
+            results.append(BatchGenerateResult(query=query, error="Query is required."))
+            continue
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            results.append(
+                BatchGenerateResult(query=query, error="Error al generar la respuesta.")
+            )
+        else:
+            results.append(BatchGenerateResult(query=query, response=answer))
+    return BatchGenerateResponse(results=results)
+
@@ -2,15 +2,22 @@ from typing import Annotated
 from uuid import UUID
 from fastapi import APIRouter, Depends, HTTPException, status
 from sqlalchemy.orm import Session
+from app.core.config import get_retrieval_settings
+from app.core.logger import get_logger
 from app.db.database import get_db
-from app.dependencies import get_user
+from app.dependencies import get_qdrant_vector_store, get_user
 from app.exceptions.chat import ChatNotFoundException
 from app.models.user import User
-from app.schemas.message import CreateMessage, GetMessage, GetMessageDetail
+from app.schemas.message import CreateMessage, GetMessageDetail, GetMessageExchange
 
 from app.services.chat import service as chat_service
+from app.services.llm import service as llm_service
 from app.services.message import service
 
+logger = get_logger(__name__)
+
+retrieval_settings = get_retrieval_settings()
+
 router = APIRouter(
     prefix="/chats/{chat_id}/messages",
     tags=["messages"],
@@ -41,14 +48,22 @@ def get_chat_messages(
     return chat.messages
 
 
-@router.post("/", response_model=GetMessage, status_code=status.HTTP_201_CREATED)
-@router.post("", response_model=GetMessage, status_code=status.HTTP_201_CREATED)
+@router.post("/", response_model=GetMessageExchange, status_code=status.HTTP_201_CREATED)
+@router.post("", response_model=GetMessageExchange, status_code=status.HTTP_201_CREATED)
 def send_message(
     chat_id: UUID,
     create_message: CreateMessage,
     user: Annotated[User, Depends(get_user)],
     db: Annotated[Session, Depends(get_db)],
+    vector_store=Depends(get_qdrant_vector_store),
 ):
+    """Stores the message and, for user messages, generates and stores the assistant's reply.
+
+    The reply sees between CHAT_HISTORY_MESSAGES and twice as many recent
+    messages verbatim, and the older ones through the chat's rolling summary.
+    Once the recent messages exceed twice the limit, the oldest are folded
+    into the summary in one call, so it is not rewritten on every message.
+    """
     try:
         chat = chat_service.get_chat(db, chat_id)
     except ChatNotFoundException:
@@ -61,4 +76,37 @@ def send_message(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="You are not allowed to perform this action",
         )
-    return service.create_message(db, create_message, chat_id)
+    history = service.get_messages_after(db, chat_id, chat.summarized_until_id)
+    user_message = service.create_message(db, create_message, chat_id)
+    if not create_message.from_user:
+        return {"user_message": user_message}
+
+    limit = retrieval_settings.CHAT_HISTORY_MESSAGES
+    if len(history) > 2 * limit:
+        overflow = len(history) - limit
+        try:
+            chat.summary = llm_service.summarize_conversation(chat.summary, history[:overflow])
+            chat.summarized_until_id = history[overflow - 1].id
+            db.commit()
+        except Exception as e:
+            # The older messages are left out of this reply and summarized next time
+            logger.warning(f"⚠️ Could not update the summary of chat {chat_id}: {e}")
+        history = history[overflow:]
+
+    document_ids = [document.id for document in chat.documents] or None
+    reply = llm_service.generate_response(
+        create_message.content,
+        vector_store,
+        user.id,
+        document_ids,
+        conversation=llm_service.format_conversation(chat.summary, history),
+    )
+    if isinstance(reply, str):
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY,
+            detail="Could not generate a reply, the message was stored",
+        )
+    assistant_message = service.create_message(
+        db, CreateMessage(content=reply.text(), from_user=False), chat_id
+    )
+    return {"user_message": user_message, "assistant_message": assistant_message}
@@ -1,7 +1,8 @@
 from functools import lru_cache
-from typing import ClassVar
+import os
+from typing import ClassVar, Literal
 
-from pydantic import ValidationError
+from pydantic import Field, ValidationError, field_validator, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 from app.core.logger import get_logger
@@ -34,6 +35,8 @@ class S3Settings(BaseSettings):
     S3_SECURE: bool
     S3_TYPE: str
     S3_DOCUMENT_BUCKET: str
+    S3_PART_SIZE: int = 10 * 1024 * 1024  # Multipart chunk size, S3 requires at least 5 MiB
+    S3_PARALLEL_UPLOADS: int = 3
 
     model_config: ClassVar[SettingsConfigDict] = SettingsConfigDict(
         env_file=(".env", ".env.dev"), extra="ignore"
@@ -43,14 +46,29 @@ class S3Settings(BaseSettings):
 class QdrantSettings(BaseSettings):
     """Optional Qdrant settings. If missing, Qdrant operations will be disabled."""
 
-    QDRANT_HOST: str
-    QDRANT_PORT: int
+    QDRANT_HOST: str | None = None
+    QDRANT_PORT: int = 6333
+    # Runs Qdrant in-process on this directory (or ":memory:") instead of connecting to QDRANT_HOST
+    QDRANT_PATH: str | None = None
     QDRANT_COLLECTION_NAME: str
+    QDRANT_QUANTIZATION: Literal["none", "scalar", "binary"] = "none"
+    QDRANT_QUANTIZATION_ALWAYS_RAM: bool = True
+    QDRANT_ON_DISK_VECTORS: bool = False
+    QDRANT_ON_DISK_PAYLOAD: bool = False
+    QDRANT_HNSW_M: int = 16
+    QDRANT_HNSW_EF_CONSTRUCT: int = 100
+    QDRANT_TIMEOUT_SECONDS: int = 10
 
     model_config: ClassVar[SettingsConfigDict] = SettingsConfigDict(
         env_file=(".env", ".env.dev"), extra="ignore"
     )
 
+    @model_validator(mode="after")
+    def validate_location(self):
+        if self.QDRANT_HOST is None and self.QDRANT_PATH is None:
+            raise ValueError("Either QDRANT_HOST or QDRANT_PATH must be set")
+        return self
+
 
 class PubSubSettings(BaseSettings):
     """Pub/Sub topic subscription configuration."""
@@ -63,6 +81,93 @@ class PubSubSettings(BaseSettings):
     )
 
 
+class IngestionSettings(BaseSettings):
+    """Background ingestion worker configuration."""
+
+    INGESTION_POLL_INTERVAL_SECONDS: float = 2.0
+    INGESTION_MAX_ATTEMPTS: int = 3
+    INGESTION_LOCK_TIMEOUT_SECONDS: int = 900
+    INGESTION_BATCH_MAX_JOBS: int = 32
+    INGESTION_INLINE_WORKER: bool = False
+    INGESTION_METRICS_PORT: int | None = None
+    BULK_UPLOAD_MAX_FILES: int = 500
+    PDF_PARSE_WORKERS: int = Field(default_factory=lambda: os.cpu_count() or 1)
+    PDF_PARALLEL_MIN_PAGES: int = 64
+    PDF_PAGES_PER_TASK: int = 32
+
+    model_config: ClassVar[SettingsConfigDict] = SettingsConfigDict(
+        env_file=(".env", ".env.dev"), extra="ignore"
+    )
+
+    @field_validator("INGESTION_METRICS_PORT", mode="before")
+    @classmethod
+    def disable_metrics_port(cls, value: object) -> object:
+        # An empty value or 0 turns the metrics server off
+        if value in ("", "0", 0):
+            return None
+        return value
+
+
+class EmbeddingSettings(BaseSettings):
+    """Embedding throughput and rate limiting configuration."""
+
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+    EMBEDDING_MAX_RETRIES: int = 6
+    EMBEDDING_BACKOFF_SECONDS: float = 1.0
+    EMBEDDING_MAX_BACKOFF_SECONDS: float = 60.0
+    QDRANT_UPSERT_CONCURRENCY: int = 2
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_MAX_ENTRIES: int = 1_000_000
+    QUERY_CACHE_ENABLED: bool = True
+    QUERY_CACHE_MAX_ENTRIES: int = 10_000
+    QUERY_CACHE_TTL_SECONDS: float = 3600.0
+    QUERY_CACHE_SHARED: bool = False
+    EMBEDDING_BACKEND: Literal["google", "fastembed"] = "google"
+    FASTEMBED_MODEL: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    FASTEMBED_THREADS: int | None = None
+    FASTEMBED_CACHE_DIR: str | None = None
+
+    model_config: ClassVar[SettingsConfigDict] = SettingsConfigDict(
+        env_file=(".env", ".env.dev"), extra="ignore"
+    )
+
+
+class RetrievalSettings(BaseSettings):
+    """Retrieval and answer generation configuration."""
+
+    RETRIEVAL_K: int = 8
+    HYBRID_SEARCH_ENABLED: bool = False
+    HYBRID_PREFETCH_LIMIT: int = 20
+    SPARSE_EMBEDDING_MODEL: str = "Qdrant/bm25"
+    QDRANT_HNSW_EF: int | None = None
+    QDRANT_QUANTIZATION_RESCORE: bool = True
+    QDRANT_QUANTIZATION_OVERSAMPLING: float = 2.0
+    RERANK_ENABLED: bool = False
+    RERANK_MODEL: str = "jinaai/jina-reranker-v2-base-multilingual"
+    RERANK_CANDIDATES: int = 30
+    RERANK_BATCH_SIZE: int = 16
+    RERANK_LATENCY_BUDGET_SECONDS: float = 0.5
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.95
+    ANSWER_CACHE_TTL_SECONDS: float = 7 * 24 * 3600
+    CONTEXT_MAX_TOKENS: int = 600
+    CONTEXT_MMR_LAMBDA: float = 0.7
+    CONTEXT_NEIGHBOUR_WINDOW: int = 1
+    CONTEXT_TOKENIZER: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+    CHAT_HISTORY_MESSAGES: int = 6
+    CHAT_SUMMARY_MAX_WORDS: int = 200
+    LLM_BATCH_MAX_QUERIES: int = 50
+    LLM_BATCH_CONCURRENCY: int = 8
+    LLM_TIMEOUT_SECONDS: float = 30.0
+    GENERATE_TIMEOUT_SECONDS: float = 60.0
+    SINGLE_FLIGHT_ENABLED: bool = True
+
+    model_config: ClassVar[SettingsConfigDict] = SettingsConfigDict(
+        env_file=(".env", ".env.dev"), extra="ignore"
+    )
+
+
 # Load core settings (mandatory, app crashes if missing)
 @lru_cache
 def get_core_settings() -> CoreSettings:
@@ -102,7 +207,37 @@ def get_pubsub_settings() -> PubSubSettings:
         raise SystemExit(1)  # ❌ Hard crash
 
 
+@lru_cache
+def get_ingestion_settings() -> IngestionSettings:
+    try:
+        return IngestionSettings.model_validate({})
+    except ValidationError as e:
+        logger.critical(f"❌ Invalid ingestion settings: {e}")
+        raise SystemExit(1)  # ❌ Hard crash
+
+
+@lru_cache
+def get_embedding_settings() -> EmbeddingSettings:
+    try:
+        return EmbeddingSettings.model_validate({})
+    except ValidationError as e:
+        logger.critical(f"❌ Invalid embedding settings: {e}")
+        raise SystemExit(1)  # ❌ Hard crash
+
+
+@lru_cache
+def get_retrieval_settings() -> RetrievalSettings:
+    try:
+        return RetrievalSettings.model_validate({})
+    except ValidationError as e:
+        logger.critical(f"❌ Invalid retrieval settings: {e}")
+        raise SystemExit(1)  # ❌ Hard crash
+
+
 _ = get_core_settings()
 _ = get_s3_settings()
 _ = get_qdrant_settings()
 _ = get_pubsub_settings()
+_ = get_ingestion_settings()
+_ = get_embedding_settings()
+_ = get_retrieval_settings()
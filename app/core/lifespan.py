@@ -1,17 +1,54 @@
+import asyncio
 from contextlib import asynccontextmanager
+import threading
 from fastapi import FastAPI
 from minio import Minio
 from qdrant_client import QdrantClient
-from qdrant_client.http.models import Distance, VectorParams
+from qdrant_client.http.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    CollectionParamsDiff,
+    Disabled,
+    Distance,
+    HnswConfigDiff,
+    KeywordIndexParams,
+    KeywordIndexType,
+    Modifier,
+    PayloadSchemaType,
+    QuantizationConfig,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SparseVectorParams,
+    VectorParams,
+    VectorParamsDiff,
+)
 from app.core.logger import get_logger
-from app.dependencies import get_s3_client, get_qdrant_client
-from app.core.config import S3Settings, get_s3_settings, QdrantSettings, get_qdrant_settings
+from app.dependencies import (
+    get_async_qdrant_client,
+    get_embedding_dimension,
+    get_s3_client,
+    get_qdrant_client,
+)
+from app.core.config import (
+    S3Settings,
+    get_s3_settings,
+    QdrantSettings,
+    get_ingestion_settings,
+    get_qdrant_settings,
+    get_retrieval_settings,
+)
+from app.services.answer_cache import answer_collection_name
+from app.services.context import service as context_service
+from app.services.vector import DOCUMENT_ID_PAYLOAD_KEY, SPARSE_VECTOR_NAME, USER_ID_PAYLOAD_KEY
 
 logger = get_logger(__name__)
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
+    worker_shutdown = threading.Event()
+    worker_thread: threading.Thread | None = None
     try:
         s3_settings = get_s3_settings()
         qdrant_settings = get_qdrant_settings()
@@ -23,12 +60,40 @@ async def lifespan(_: FastAPI):
 
         if qdrant_settings != None:
             logger.info(f"🔍 Initializing Qdrant...")
-            setup_qdrant(get_qdrant_client(), qdrant_settings)
+            setup_qdrant(
+                get_qdrant_client(),
+                qdrant_settings,
+                get_embedding_dimension(),
+                get_retrieval_settings().HYBRID_SEARCH_ENABLED,
+            )
             logger.info(f"✅ Qdrant initialized successfully!")
 
+        # May download the tokenizer, so it runs off the event loop
+        await asyncio.to_thread(context_service.load_tokenizer)
+
+        if get_ingestion_settings().INGESTION_INLINE_WORKER:
+            if s3_settings is None or qdrant_settings is None:
+                logger.warning("⚠️ Inline ingestion worker needs S3 and Qdrant, not started.")
+            else:
+                # Imported here, the worker module is not needed otherwise
+                from app.worker import work
+
+                worker_thread = threading.Thread(
+                    target=work, args=(worker_shutdown,), name="ingestion", daemon=True
+                )
+                worker_thread.start()
+
         yield
     finally:
         logger.info("🧹 Cleaning up...")
+        if worker_thread is not None:
+            worker_shutdown.set()
+            await asyncio.to_thread(worker_thread.join)
+        if get_async_qdrant_client.cache_info().currsize:
+            await get_async_qdrant_client().close()
+        if get_qdrant_client.cache_info().currsize:
+            # Releases the lock on the storage of local mode
+            get_qdrant_client().close()
 
 
 def setup_s3_buckets(client: Minio, settings: S3Settings):
@@ -39,11 +104,151 @@ def setup_s3_buckets(client: Minio, settings: S3Settings):
             logger.info(f"🗂️ Created S3 bucket: {bucket_name}")
 
 
-def setup_qdrant(client:  QdrantClient, settings: QdrantSettings):
+def setup_qdrant(
+    client: QdrantClient, settings: QdrantSettings, vector_size: int, hybrid: bool = False
+):
     if not client.collection_exists(settings.QDRANT_COLLECTION_NAME):
         client.create_collection(
             collection_name=settings.QDRANT_COLLECTION_NAME,
-            vectors_config=VectorParams(size=768, distance=Distance.COSINE),
+            vectors_config=VectorParams(
+                size=vector_size,
+                distance=Distance.COSINE,
+                on_disk=settings.QDRANT_ON_DISK_VECTORS,
+            ),
+            hnsw_config=hnsw_config(settings),
+            quantization_config=quantization_config(settings),
+            on_disk_payload=settings.QDRANT_ON_DISK_PAYLOAD,
+            # BM25 vectors only hold term frequencies, Qdrant applies the IDF
+            sparse_vectors_config=(
+                {SPARSE_VECTOR_NAME: SparseVectorParams(modifier=Modifier.IDF)}
+                if hybrid
+                else None
+            ),
         )
         logger.info(f"🗂️ Created Qdrant collection: {settings.QDRANT_COLLECTION_NAME}")
-    
+    else:
+        vectors_config = client.get_collection(settings.QDRANT_COLLECTION_NAME).config.params.vectors
+        if isinstance(vectors_config, VectorParams) and vectors_config.size != vector_size:
+            # Vectors of different models are not comparable, the collection must be rebuilt
+            raise RuntimeError(
+                f"Qdrant collection {settings.QDRANT_COLLECTION_NAME} stores vectors of size "
+                f"{vectors_config.size}, but the embedding backend produces {vector_size}. "
+                "Recreate the collection and re-ingest the documents to switch backends."
+            )
+        sparse_vectors_config = (
+            client.get_collection(settings.QDRANT_COLLECTION_NAME).config.params.sparse_vectors
+            or {}
+        )
+        if hybrid and SPARSE_VECTOR_NAME not in sparse_vectors_config:
+            # Sparse vectors cannot be added to an existing collection
+            raise RuntimeError(
+                f"Qdrant collection {settings.QDRANT_COLLECTION_NAME} has no "
+                f"'{SPARSE_VECTOR_NAME}' sparse vector required by HYBRID_SEARCH_ENABLED. "
+                "Recreate the collection and re-ingest the documents to enable hybrid search."
+            )
+        migrate_collection(client, settings)
+
+    # Retrieval always filters by user and often by document, so both are indexed
+    payload_schema = client.get_collection(settings.QDRANT_COLLECTION_NAME).payload_schema
+    tenant_indexes = {
+        USER_ID_PAYLOAD_KEY: KeywordIndexParams(type=KeywordIndexType.KEYWORD, is_tenant=True),
+        DOCUMENT_ID_PAYLOAD_KEY: KeywordIndexParams(type=KeywordIndexType.KEYWORD),
+    }
+    for field_name, field_schema in tenant_indexes.items():
+        if field_name not in payload_schema:
+            _ = client.create_payload_index(
+                collection_name=settings.QDRANT_COLLECTION_NAME,
+                field_name=field_name,
+                field_schema=field_schema,
+            )
+            logger.info(f"🗂️ Created Qdrant payload index: {field_name}")
+
+    answers_collection_name = answer_collection_name(settings.QDRANT_COLLECTION_NAME)
+    if not client.collection_exists(answers_collection_name):
+        client.create_collection(
+            collection_name=answers_collection_name,
+            vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
+        )
+        for field_name, field_schema in (
+            ("user_id", PayloadSchemaType.KEYWORD),
+            ("corpus_version", PayloadSchemaType.KEYWORD),
+            ("created_at", PayloadSchemaType.FLOAT),
+        ):
+            _ = client.create_payload_index(
+                collection_name=answers_collection_name,
+                field_name=field_name,
+                field_schema=field_schema,
+            )
+        logger.info(f"🗂️ Created Qdrant collection: {answers_collection_name}")
+
+
+def hnsw_config(settings: QdrantSettings) -> HnswConfigDiff:
+    return HnswConfigDiff(m=settings.QDRANT_HNSW_M, ef_construct=settings.QDRANT_HNSW_EF_CONSTRUCT)
+
+
+def quantization_config(settings: QdrantSettings) -> QuantizationConfig | None:
+    if settings.QDRANT_QUANTIZATION == "scalar":
+        return ScalarQuantization(
+            scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8,
+                quantile=0.99,
+                always_ram=settings.QDRANT_QUANTIZATION_ALWAYS_RAM,
+            )
+        )
+    if settings.QDRANT_QUANTIZATION == "binary":
+        return BinaryQuantization(
+            binary=BinaryQuantizationConfig(always_ram=settings.QDRANT_QUANTIZATION_ALWAYS_RAM)
+        )
+    return None
+
+
+def migrate_collection(client: QdrantClient, settings: QdrantSettings):
+    """Applies changed storage, HNSW and quantization settings to an existing collection.
+
+    Qdrant rebuilds the affected segments in the background while the
+    collection keeps serving searches.
+    """
+    config = client.get_collection(settings.QDRANT_COLLECTION_NAME).config
+    changed: list[str] = []
+
+    new_hnsw_config = None
+    if (config.hnsw_config.m, config.hnsw_config.ef_construct) != (
+        settings.QDRANT_HNSW_M,
+        settings.QDRANT_HNSW_EF_CONSTRUCT,
+    ):
+        new_hnsw_config = hnsw_config(settings)
+        changed.append("HNSW")
+
+    new_quantization_config = None
+    wanted_quantization = quantization_config(settings)
+    if config.quantization_config != wanted_quantization:
+        new_quantization_config = wanted_quantization or Disabled.DISABLED
+        changed.append("quantization")
+
+    new_vectors_config = None
+    vectors_config = config.params.vectors
+    if (
+        isinstance(vectors_config, VectorParams)
+        and bool(vectors_config.on_disk) != settings.QDRANT_ON_DISK_VECTORS
+    ):
+        new_vectors_config = {"": VectorParamsDiff(on_disk=settings.QDRANT_ON_DISK_VECTORS)}
+        changed.append("on-disk vectors")
+
+    new_collection_params = None
+    if bool(config.params.on_disk_payload) != settings.QDRANT_ON_DISK_PAYLOAD:
+        new_collection_params = CollectionParamsDiff(
+            on_disk_payload=settings.QDRANT_ON_DISK_PAYLOAD
+        )
+        changed.append("on-disk payload")
+
+    if changed:
+        _ = client.update_collection(
+            collection_name=settings.QDRANT_COLLECTION_NAME,
+            hnsw_config=new_hnsw_config,
+            quantization_config=new_quantization_config,
+            vectors_config=new_vectors_config,
+            collection_params=new_collection_params,
+        )
+        logger.info(
+            f"🛠️ Updated Qdrant collection {settings.QDRANT_COLLECTION_NAME}: {', '.join(changed)}"
+        )
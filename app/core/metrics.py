@@ -0,0 +1,104 @@
+from collections.abc import Mapping
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+    start_http_server,
+)
+
+# Up to the GENERATE_TIMEOUT_SECONDS of a whole generation
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Around the usual ANSWER_CACHE_SIMILARITY_THRESHOLD values
+SIMILARITY_BUCKETS = (0.5, 0.7, 0.8, 0.85, 0.9, 0.95, 0.98, 0.99, 1.0)
+
+RAG_STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds",
+    "Duration of each stage of answering a query",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+INGESTION_STAGE_SECONDS = Histogram(
+    "ingestion_stage_duration_seconds",
+    "Duration of each ingestion stage, per page for parse and split and per batch for embed and upsert",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens",
+    "Tokens sent to and generated by the LLM",
+    ["kind"],
+)
+INGESTED_CHUNKS = Counter(
+    "ingested_chunks",
+    "Chunks of ingested documents, by whether they were new, unchanged or removed",
+    ["status"],
+)
+QUERY_EMBEDDING_CACHE_LOOKUPS = Counter(
+    "query_embedding_cache_lookups",
+    "Query embedding lookups, by whether they hit the local or the shared cache or missed",
+    ["result"],
+)
+QUERY_EMBEDDING_CACHE_SAVED_SECONDS = Counter(
+    "query_embedding_cache_saved_seconds",
+    "Embedding time saved by query embedding cache hits, estimated from the average miss",
+)
+ANSWER_CACHE_LOOKUPS = Counter(
+    "answer_cache_lookups",
+    "Answer cache lookups, by whether a similar enough answer was found",
+    ["result"],
+)
+ANSWER_CACHE_SIMILARITY = Histogram(
+    "answer_cache_best_similarity",
+    "Similarity of the closest cached answer found by each answer cache lookup",
+    buckets=SIMILARITY_BUCKETS,
+)
+SINGLE_FLIGHT_REQUESTS = Counter(
+    "single_flight_requests",
+    "Generate and stream requests, by whether they started a generation or joined one in flight",
+    ["kind", "result"],
+)
+ERRORS = Counter(
+    "errors",
+    "Errors by component and exception type",
+    ["component", "type"],
+)
+
+
+def record_error(component: str, error: BaseException) -> None:
+    ERRORS.labels(component=component, type=type(error).__name__).inc()
+
+
+def record_token_usage(usage: Mapping[str, int] | None) -> None:
+    if not usage:
+        return
+    LLM_TOKENS.labels(kind="prompt").inc(usage.get("input_tokens", 0))
+    LLM_TOKENS.labels(kind="completion").inc(usage.get("output_tokens", 0))
+
+
+def get_metrics_registry() -> CollectorRegistry:
+    """Returns the registry to expose.
+
+    When PROMETHEUS_MULTIPROC_DIR is set, every process writes its metrics to
+    that directory, and the metrics of all of them are aggregated.
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    _ = multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Returns the metrics in the Prometheus text format, with its content type."""
+    return generate_latest(get_metrics_registry()), CONTENT_TYPE_LATEST
+
+
+def serve_metrics(port: int) -> None:
+    """Serves the metrics on `port` from a background thread, for processes without the API."""
+    _ = start_http_server(port, registry=get_metrics_registry())
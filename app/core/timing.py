@@ -0,0 +1,31 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+import time
+
+from app.core.metrics import RAG_STAGE_SECONDS
+
+
+class StageTimer:
+    """Collects the wall time of the named stages of a request.
+
+    Every stage is also observed in the rag_stage_duration_seconds histogram.
+    """
+
+    def __init__(self) -> None:
+        self.durations: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.durations[name] = self.durations.get(name, 0.0) + duration
+            RAG_STAGE_SECONDS.labels(stage=name).observe(duration)
+
+    def server_timing(self) -> str:
+        """Formats the durations as a Server-Timing header value, in milliseconds."""
+        return ", ".join(
+            f"{name};dur={duration * 1000:.1f}" for name, duration in self.durations.items()
+        )
@@ -0,0 +1,51 @@
+# app/db/migrations.py
+from sqlalchemy import Engine, inspect
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.types import SchemaType
+
+from app.core.logger import get_logger
+from app.db.database import Base
+
+logger = get_logger(__name__)
+
+
+def add_missing_columns_and_indexes(engine: Engine) -> None:
+    """Brings tables created by an older version up to date with the models.
+
+    `Base.metadata.create_all` only creates missing tables, so columns and
+    indexes added to existing models are added here. New columns must be
+    nullable or have a server default, since existing rows get no value.
+    """
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if isinstance(column.type, SchemaType):
+                    # Postgres enums are standalone types that must exist first
+                    column.type.create(bind=connection, checkfirst=True)
+                column_type = column.type.compile(dialect=engine.dialect)
+                definition = f'ALTER TABLE "{table.name}" ADD COLUMN IF NOT EXISTS "{column.name}" {column_type}'
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    default_sql = (
+                        default
+                        if isinstance(default, str)
+                        else default.compile(dialect=engine.dialect)
+                    )
+                    definition += f" DEFAULT {default_sql}"
+                if not column.nullable and column.server_default is not None:
+                    definition += " NOT NULL"
+                _ = connection.exec_driver_sql(definition)
+                logger.info(f"🛠️ Added column {table.name}.{column.name}")
+
+            existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    _ = connection.execute(CreateIndex(index, if_not_exists=True))
+                    logger.info(f"🛠️ Created index {index.name}")
@@ -1,15 +1,20 @@
-from typing import Annotated
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Annotated, Any, cast
 from fastapi import Depends, HTTPException, status
 from jwt import InvalidTokenError
 from minio import Minio
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from functools import lru_cache
+from langchain_core.embeddings import Embeddings
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_qdrant import QdrantVectorStore
+from langchain_qdrant import FastEmbedSparse, QdrantVectorStore, RetrievalMode
 from sqlalchemy.orm import Session
 from app.core.config import (
     get_core_settings,
+    get_embedding_settings,
     get_qdrant_settings,
+    get_retrieval_settings,
     get_s3_settings,
 )
 from app.core.logger import get_logger 
@@ -17,9 +22,16 @@ from app.db.database import get_db
 from app.exceptions.user import UserNotFoundException
 from app.models.user import User
 from app.services.auth import service as auth_service
+from app.services.embedding_cache import CachedEmbeddings
+from app.services.embedding_cache import service as embedding_cache_service
+from app.services.query_embedding_cache import service as query_embedding_cache_service
+from app.services.vector import SPARSE_VECTOR_NAME
 
 logger = get_logger(__name__)
 
+GOOGLE_EMBEDDING_MODEL = "models/text-embedding-004"
+GOOGLE_EMBEDDING_DIMENSION = 768
+
 
 @lru_cache
 def get_s3_client() -> Minio:
@@ -36,39 +48,169 @@ def get_s3_client() -> Minio:
         secure=settings.S3_SECURE,
     )
     
+class _ThreadedAsyncQdrantClient:
+    """Async facade over a synchronous QdrantClient."""
+
+    def __init__(self, client: QdrantClient) -> None:
+        self._client = client
+
+    def __getattr__(self, name: str) -> Callable[..., Awaitable[Any]]:
+        method = getattr(self._client, name)
+
+        async def call(*args: Any, **kwargs: Any) -> Any:
+            return await asyncio.to_thread(method, *args, **kwargs)
+
+        return call
+
+    async def close(self) -> None:
+        # The wrapped client belongs to get_qdrant_client
+        pass
+
+
 @lru_cache
 def get_qdrant_client() ->  QdrantClient:
+    """Returns the process' Qdrant client, shared by every vector store.
+
+    With QDRANT_PATH, Qdrant runs in-process (local mode), whose storage can
+    only be opened by one client at a time.
+    """
     settings = get_qdrant_settings()
 
     if not settings:
         logger.warning("⚠️ Qdrant is disabled due to missing configuration.")
         raise RuntimeError("Qdrant is disabled.")
 
+    if settings.QDRANT_PATH == ":memory:":
+        logger.info("🧪 Running Qdrant in memory")
+        return QdrantClient(location=":memory:")
+    if settings.QDRANT_PATH is not None:
+        logger.info(f"💾 Running Qdrant locally on {settings.QDRANT_PATH}")
+        return QdrantClient(path=settings.QDRANT_PATH)
+
     return QdrantClient(
         host=settings.QDRANT_HOST,
         port=settings.QDRANT_PORT,
+        timeout=settings.QDRANT_TIMEOUT_SECONDS,
+    )
+
+
+@lru_cache
+def get_async_qdrant_client() -> AsyncQdrantClient:
+    """Returns the client used by request handlers that must not block the event loop."""
+    settings = get_qdrant_settings()
+
+    if not settings:
+        logger.warning("⚠️ Qdrant is disabled due to missing configuration.")
+        raise RuntimeError("Qdrant is disabled.")
+
+    if settings.QDRANT_PATH is not None:
+        # A second local client could not share the storage, so the async
+        # calls run on the process' client in worker threads
+        return cast(AsyncQdrantClient, _ThreadedAsyncQdrantClient(get_qdrant_client()))
+
+    return AsyncQdrantClient(
+        host=settings.QDRANT_HOST,
+        port=settings.QDRANT_PORT,
+        timeout=settings.QDRANT_TIMEOUT_SECONDS,
     )
     
+@lru_cache
+def get_embeddings() -> Embeddings:
+    """Returns the embedding backend selected by EMBEDDING_BACKEND.
+
+    Cached, so a local model is loaded once per process and shared by every
+    request and ingestion thread.
+    """
+    embedding_settings = get_embedding_settings()
+
+    if embedding_settings.EMBEDDING_BACKEND == "fastembed":
+        from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
+
+        logger.info(f"🧠 Loading fastembed model {embedding_settings.FASTEMBED_MODEL}")
+        return FastEmbedEmbeddings(
+            model_name=embedding_settings.FASTEMBED_MODEL,
+            threads=embedding_settings.FASTEMBED_THREADS,
+            cache_dir=embedding_settings.FASTEMBED_CACHE_DIR,
+            batch_size=embedding_settings.EMBEDDING_BATCH_SIZE,
+        )
+
+    gooogle_api_key = get_core_settings().GOOGLE_API_KEY
+    if not gooogle_api_key:
+        logger.warning("⚠️ Google API Key is disabled due to missing configuration.")
+        raise RuntimeError("Google API Key is disabled for Google Generative AI Embeddings.")
+
+    return GoogleGenerativeAIEmbeddings(model=GOOGLE_EMBEDDING_MODEL, google_api_key=gooogle_api_key)
+
+
+def get_embedding_model_name() -> str:
+    embedding_settings = get_embedding_settings()
+    if embedding_settings.EMBEDDING_BACKEND == "fastembed":
+        return f"fastembed/{embedding_settings.FASTEMBED_MODEL}"
+    return GOOGLE_EMBEDDING_MODEL
+
+
+@lru_cache
+def get_embedding_dimension() -> int:
+    embedding_settings = get_embedding_settings()
+    if embedding_settings.EMBEDDING_BACKEND == "google":
+        return GOOGLE_EMBEDDING_DIMENSION
+
+    from fastembed import TextEmbedding
+
+    for model in TextEmbedding.list_supported_models():
+        if model["model"] == embedding_settings.FASTEMBED_MODEL:
+            return int(model["dim"])
+    # Custom models are not listed, so the dimension is measured instead
+    return len(get_embeddings().embed_query("dimension"))
+
+
+@lru_cache
+def get_sparse_embeddings() -> FastEmbedSparse:
+    """Returns the local sparse (BM25) model used for hybrid search, loaded once per process."""
+    embedding_settings = get_embedding_settings()
+    model_name = get_retrieval_settings().SPARSE_EMBEDDING_MODEL
+    logger.info(f"🧠 Loading sparse embedding model {model_name}")
+    return FastEmbedSparse(
+        model_name=model_name,
+        threads=embedding_settings.FASTEMBED_THREADS,
+        cache_dir=embedding_settings.FASTEMBED_CACHE_DIR,
+    )
+
+
 @lru_cache
 def get_qdrant_vector_store() -> QdrantVectorStore:
     settings = get_qdrant_settings()
-    gooogle_api_key = get_core_settings().GOOGLE_API_KEY
     
     if not settings:
         logger.warning("⚠️ Qdrant Vector Store is disabled due to missing configuration.")
         raise RuntimeError("Qdrant Vector Store is disabled.")
-    
-    if not gooogle_api_key:
-        logger.warning("⚠️ Google API Key is disabled due to missing configuration.")
-        raise RuntimeError("Google API Key is disabled for Google Generative AI Embeddings.")
 
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004", google_api_key=gooogle_api_key)
+    embedding_settings = get_embedding_settings()
+    embeddings = get_embeddings()
+    if embedding_settings.EMBEDDING_CACHE_ENABLED or embedding_settings.QUERY_CACHE_ENABLED:
+        embeddings = CachedEmbeddings(
+            embeddings,
+            get_embedding_model_name(),
+            embedding_cache_service if embedding_settings.EMBEDDING_CACHE_ENABLED else None,
+            query_embedding_cache_service if embedding_settings.QUERY_CACHE_ENABLED else None,
+        )
     
-    vector_store = QdrantVectorStore.from_existing_collection(
-        embedding=embeddings,
+    if get_retrieval_settings().HYBRID_SEARCH_ENABLED:
+        # Chunks get a BM25 sparse vector next to the dense one, see VectorService
+        vector_store = QdrantVectorStore(
+            client=get_qdrant_client(),
+            collection_name=settings.QDRANT_COLLECTION_NAME,
+            embedding=embeddings,
+            sparse_embedding=get_sparse_embeddings(),
+            retrieval_mode=RetrievalMode.HYBRID,
+            sparse_vector_name=SPARSE_VECTOR_NAME,
+        )
+        return vector_store
+
+    vector_store = QdrantVectorStore(
+        client=get_qdrant_client(),
         collection_name=settings.QDRANT_COLLECTION_NAME,
-        host=settings.QDRANT_HOST,
-        port=settings.QDRANT_PORT,
+        embedding=embeddings,
     )
     return vector_store
     
@@ -0,0 +1,4 @@
+class EmbeddingRateLimitedException(Exception):
+    """Raised when a batch is still rate limited after every retry."""
+
+    pass
@@ -0,0 +1,2 @@
+class IngestionJobNotFoundException(Exception):
+    pass
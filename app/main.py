@@ -1,25 +1,19 @@
 # app/main.py
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.lifespan import lifespan
+from app.core.metrics import render_metrics
 from app.db.database import Base, engine
+from app.db.migrations import add_missing_columns_and_indexes
 from app.api import auth, user, document, chat, messages, llm
 
-import importlib
-import pkgutil
-import app.models
-import app.models.associations
+from app.models import import_all_models
 
-for module_info in pkgutil.iter_modules(app.models.__path__, app.models.__name__ + "."):
-    _ = importlib.import_module(module_info.name)
-
-for module_info in pkgutil.iter_modules(
-    app.models.associations.__path__, app.models.associations.__name__ + "."
-):
-    _ = importlib.import_module(module_info.name)
+import_all_models()
 
 Base.metadata.create_all(bind=engine)
+add_missing_columns_and_indexes(engine)
 
 app = FastAPI(
     title="NotebookLMini API",
@@ -61,6 +55,13 @@ def health_check():
             "POSTGRES_HOST": "✅" if os.getenv("POSTGRES_HOST") else "❌",
             "GOOGLE_API_KEY": "✅" if os.getenv("GOOGLE_API_KEY") else "❌",
             "S3_HOST": "✅" if os.getenv("S3_HOST") else "❌",
-            "QDRANT_HOST": "✅" if os.getenv("QDRANT_HOST") else "❌"
+            "QDRANT_HOST": "✅" if os.getenv("QDRANT_HOST") or os.getenv("QDRANT_PATH") else "❌"
         }
-    }
\ No newline at end of file
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus metrics, aggregated across worker processes when PROMETHEUS_MULTIPROC_DIR is set"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
@@ -0,0 +1,11 @@
+import importlib
+import pkgutil
+
+
+def import_all_models() -> None:
+    """Imports every model module so SQLAlchemy can resolve string relationships."""
+    import app.models.associations
+
+    for package in (app.models, app.models.associations):
+        for module_info in pkgutil.iter_modules(package.__path__, package.__name__ + "."):
+            _ = importlib.import_module(module_info.name)
@@ -29,11 +29,16 @@ class Chat(Base):
         nullable=False
     )
 
+    # Rolling summary of the messages up to the message `summarized_until_id`,
+    # see LLMService
+    summary: Mapped[str | None] = mapped_column(nullable=True)
+    summarized_until_id: Mapped[UUID | None] = mapped_column(nullable=True)
+
     user_id: Mapped[UUID] = mapped_column(ForeignKey("user.id"), nullable=False)
     chat_documents: Mapped[list["ChatDocument"]] = relationship(back_populates="chat")
 
     user: Mapped["User"] = relationship(back_populates="chats")
-    messages: Mapped[list["Message"]] = relationship(back_populates="chat", cascade="all,delete-orphan", passive_deletes=True)
+    messages: Mapped[list["Message"]] = relationship(back_populates="chat", cascade="all,delete-orphan", passive_deletes=True, order_by="[Message.created_at, Message.id]")
     documents: AssociationProxy[list["Document"]] = association_proxy(
         "chat_documents", "document"
     )
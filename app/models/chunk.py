@@ -1,6 +1,6 @@
 # pyright: reportImportCycles=false
 from typing import TYPE_CHECKING
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from app.db.database import Base
 
@@ -10,7 +10,14 @@ if TYPE_CHECKING:
 
 class Chunk(Base):
     __tablename__: str = "chunk"
+    __table_args__ = (Index("ix_chunk_document_id_ordinal", "document_id", "ordinal"),)
 
     id: Mapped[str] = mapped_column(primary_key=True)
-    document_id: Mapped[str] = mapped_column(ForeignKey("document.id", ondelete="CASCADE"), nullable=False)
+    document_id: Mapped[str] = mapped_column(ForeignKey("document.id", ondelete="CASCADE"), index=True, nullable=False)
+    content_hash: Mapped[str | None] = mapped_column(nullable=True)
+    # Position in the document; unknown for chunks stored before they were recorded
+    ordinal: Mapped[int | None] = mapped_column(nullable=True)
+    page: Mapped[int | None] = mapped_column(nullable=True)
+    start: Mapped[int | None] = mapped_column(nullable=True)
+    end: Mapped[int | None] = mapped_column(nullable=True)
     document: Mapped["Document"] = relationship(back_populates="chunks")
@@ -11,6 +11,7 @@ from app.db.database import Base
 if TYPE_CHECKING:
     from app.models.user import User
     from app.models.chunk import Chunk
+    from app.models.ingestion_job import IngestionJob
 
 
 class FileType(enum.Enum):
@@ -29,11 +30,14 @@ class Document(Base):
     file_type: Mapped[FileType] = mapped_column(Enum(FileType), nullable=False)
     size: Mapped[int] = mapped_column(nullable=False)
     s3_location: Mapped[str] = mapped_column(nullable=False)
+    content_hash: Mapped[str | None] = mapped_column(index=True, nullable=True)
+    version: Mapped[int] = mapped_column(default=1, server_default="1", nullable=False)
     created_at: Mapped[datetime] = mapped_column(
         server_default=func.now(), nullable=False
     )
 
-    user_id: Mapped[UUID] = mapped_column(ForeignKey("user.id"))
+    user_id: Mapped[UUID] = mapped_column(ForeignKey("user.id"), index=True)
 
     user: Mapped["User"] = relationship(back_populates="documents")
     chunks: Mapped[list["Chunk"]] = relationship(back_populates="document", cascade="all,delete-orphan", passive_deletes=True)
+    ingestion_jobs: Mapped[list["IngestionJob"]] = relationship(back_populates="document", cascade="all,delete-orphan", passive_deletes=True)
@@ -0,0 +1,16 @@
+from datetime import datetime
+
+from sqlalchemy import LargeBinary, func
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db.database import Base
+
+
+class EmbeddingCacheEntry(Base):
+    __tablename__: str = "embedding_cache"
+
+    model: Mapped[str] = mapped_column(primary_key=True)
+    content_hash: Mapped[str] = mapped_column(primary_key=True)
+    vector: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    last_used_at: Mapped[datetime] = mapped_column(
+        server_default=func.now(), index=True, nullable=False
+    )
@@ -0,0 +1,58 @@
+# pyright: reportImportCycles=false
+from datetime import datetime
+import enum
+from typing import TYPE_CHECKING
+from uuid import UUID
+
+from sqlalchemy import DateTime, Enum, ForeignKey, func
+from sqlalchemy.orm import Mapped, mapped_column, relationship
+from app.db.database import Base
+
+if TYPE_CHECKING:
+    from app.models.document import Document
+
+
+class JobStatus(enum.Enum):
+    PENDING = 0
+    RUNNING = 1
+    COMPLETED = 2
+    FAILED = 3
+
+
+class JobStage(enum.Enum):
+    QUEUED = 0
+    DOWNLOADING = 1
+    PARSING = 2
+    EMBEDDING = 3
+    STORING = 4
+    DONE = 5
+
+
+class IngestionJob(Base):
+    __tablename__: str = "ingestion_job"
+
+    id: Mapped[UUID] = mapped_column(primary_key=True)
+    status: Mapped[JobStatus] = mapped_column(
+        Enum(JobStatus), index=True, default=JobStatus.PENDING, nullable=False
+    )
+    stage: Mapped[JobStage] = mapped_column(
+        Enum(JobStage), default=JobStage.QUEUED, nullable=False
+    )
+    progress: Mapped[float] = mapped_column(default=0.0, nullable=False)
+    attempts: Mapped[int] = mapped_column(default=0, nullable=False)
+    error: Mapped[str | None] = mapped_column(nullable=True)
+    locked_at: Mapped[datetime | None] = mapped_column(DateTime, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        server_default=func.now(), nullable=False
+    )
+    updated_at: Mapped[datetime] = mapped_column(
+        server_default=func.now(), onupdate=func.now(), nullable=False
+    )
+
+    # Jobs of documents uploaded together share a batch and are embedded together
+    batch_id: Mapped[UUID | None] = mapped_column(index=True, nullable=True)
+
+    document_id: Mapped[UUID] = mapped_column(
+        ForeignKey("document.id", ondelete="CASCADE"), index=True, nullable=False
+    )
+    document: Mapped["Document"] = relationship(back_populates="ingestion_jobs")
@@ -1,6 +1,7 @@
+from datetime import datetime
 from uuid import UUID
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from app.db.database import Base
 from app.models.chat import Chat
@@ -8,10 +9,14 @@ from app.models.chat import Chat
 
 class Message(Base):
     __tablename__: str = "message"
+    __table_args__ = (Index("ix_message_chat_id_created_at", "chat_id", "created_at"),)
 
     id: Mapped[UUID] = mapped_column(primary_key=True)
     content: Mapped[str] = mapped_column(nullable=False)
     from_user: Mapped[bool] = mapped_column(nullable=False)
+    created_at: Mapped[datetime] = mapped_column(
+        server_default=func.now(), nullable=False
+    )
 
     chat_id: Mapped[UUID] = mapped_column(ForeignKey("chat.id", ondelete="CASCADE"), nullable=False)
 
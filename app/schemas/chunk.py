@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+
+
+class CreateChunk(BaseModel):
+    id: str
+    content_hash: str
+    ordinal: int | None = None
+    page: int | None = None
+    start: int | None = None
+    end: int | None = None
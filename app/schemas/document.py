@@ -24,6 +24,15 @@ class GetDocumentDetail(GetDocument):
 
 class CreateDocument(BaseDocument):
     user_id: UUID
+    content_hash: str | None = None
+
+
+class UpdateDocument(BaseModel):
+    name: str
+    file_type: FileType
+    size: int | None = None
+    s3_location: str
+    content_hash: str
 
 
 from app.schemas.user import GetUser
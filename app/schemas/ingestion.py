@@ -0,0 +1,36 @@
+from datetime import datetime
+from uuid import UUID
+from pydantic import BaseModel
+
+from app.models.ingestion_job import JobStage, JobStatus
+
+
+class GetIngestionJob(BaseModel):
+    id: UUID
+    document_id: UUID
+    status: JobStatus
+    stage: JobStage
+    progress: float
+    attempts: int
+    error: str | None = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class EnqueuedDocument(BaseModel):
+    document_id: UUID
+    job_id: UUID
+    deduplicated: bool = False
+
+
+class BulkUploadResult(BaseModel):
+    filename: str
+    document_id: UUID | None = None
+    job_id: UUID | None = None
+    deduplicated: bool = False
+    error: str | None = None
+
+
+class BulkUploadResponse(BaseModel):
+    batch_id: UUID
+    results: list[BulkUploadResult]
@@ -0,0 +1,17 @@
+from uuid import UUID
+from pydantic import BaseModel
+
+
+class BatchGenerateRequest(BaseModel):
+    queries: list[str]
+    chat_id: UUID | None = None
+
+
+class BatchGenerateResult(BaseModel):
+    query: str
+    response: str | None = None
+    error: str | None = None
+
+
+class BatchGenerateResponse(BaseModel):
+    results: list[BatchGenerateResult]
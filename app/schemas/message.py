@@ -1,4 +1,5 @@
 # pyright: reportImportCycles=false
+from datetime import datetime
 from uuid import UUID
 from pydantic import BaseModel
 
@@ -11,6 +12,12 @@ class BaseMessage(BaseModel):
 class GetMessage(BaseMessage):
     id: UUID
     from_user: bool
+    created_at: datetime
+
+
+class GetMessageExchange(BaseModel):
+    user_message: GetMessage
+    assistant_message: GetMessage | None = None
 
 
 class GetMessageDetail(GetMessage):
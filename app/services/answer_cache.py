@@ -0,0 +1,183 @@
+import time
+from typing import final
+from uuid import UUID
+import uuid
+
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http import models
+
+from app.core.config import RetrievalSettings, get_retrieval_settings
+from app.core.logger import get_logger
+from app.core.metrics import ANSWER_CACHE_LOOKUPS, ANSWER_CACHE_SIMILARITY
+from app.services.query_embedding_cache import normalize_query
+
+logger = get_logger(__name__)
+
+
+def answer_collection_name(collection_name: str) -> str:
+    return f"{collection_name}_answers"
+
+
+@final
+class AnswerCacheService:
+    """Semantic cache of generated answers, stored in its own Qdrant collection.
+
+    Entries are scoped to a user and a corpus version, so an answer is only
+    reused while the documents it was generated from are unchanged.
+    """
+
+    retrieval_settings: RetrievalSettings
+
+    def __init__(self, retrieval_settings: RetrievalSettings) -> None:
+        self.retrieval_settings = retrieval_settings
+
+    def lookup_batch(
+        self,
+        client: QdrantClient,
+        collection_name: str,
+        query_vectors: list[list[float]],
+        user_id: UUID,
+        corpus_version: str,
+    ) -> list[str | None]:
+        """Returns the cached answer of each query vector, or None, in a single request."""
+        scope = self._scope_filter(user_id, corpus_version)
+        responses = client.query_batch_points(
+            collection_name=answer_collection_name(collection_name),
+            requests=[
+                models.QueryRequest(query=query_vector, filter=scope, limit=1, with_payload=True)
+                for query_vector in query_vectors
+            ],
+        )
+        return [self._record_lookup(response.points) for response in responses]
+
+    def store(
+        self,
+        client: QdrantClient,
+        collection_name: str,
+        query: str,
+        query_vector: list[float],
+        answer: str,
+        user_id: UUID,
+        corpus_version: str,
+    ) -> None:
+        self.store_batch(
+            client, collection_name, [(query, query_vector, answer)], user_id, corpus_version
+        )
+
+    def store_batch(
+        self,
+        client: QdrantClient,
+        collection_name: str,
+        entries: list[tuple[str, list[float], str]],
+        user_id: UUID,
+        corpus_version: str,
+    ) -> None:
+        """Stores the (query, query vector, answer) `entries` in a single upsert."""
+        if not entries:
+            return
+        _ = client.upsert(
+            collection_name=answer_collection_name(collection_name),
+            points=[
+                self._entry(query, query_vector, answer, user_id, corpus_version)
+                for query, query_vector, answer in entries
+            ],
+        )
+        _ = client.delete(
+            collection_name=answer_collection_name(collection_name),
+            points_selector=self._expired_selector(user_id),
+            wait=False,
+        )
+
+    async def astore(
+        self,
+        client: AsyncQdrantClient,
+        collection_name: str,
+        query: str,
+        query_vector: list[float],
+        answer: str,
+        user_id: UUID,
+        corpus_version: str,
+    ) -> None:
+        _ = await client.upsert(
+            collection_name=answer_collection_name(collection_name),
+            points=[self._entry(query, query_vector, answer, user_id, corpus_version)],
+        )
+        _ = await client.delete(
+            collection_name=answer_collection_name(collection_name),
+            points_selector=self._expired_selector(user_id),
+            wait=False,
+        )
+
+    def _record_lookup(self, points: list[models.ScoredPoint]) -> str | None:
+        if points:
+            ANSWER_CACHE_SIMILARITY.observe(points[0].score)
+        if (
+            points
+            and points[0].score >= self.retrieval_settings.ANSWER_CACHE_SIMILARITY_THRESHOLD
+            and points[0].payload
+        ):
+            ANSWER_CACHE_LOOKUPS.labels(result="hit").inc()
+            return points[0].payload["answer"]
+        ANSWER_CACHE_LOOKUPS.labels(result="miss").inc()
+        return None
+
+    def _entry(
+        self,
+        query: str,
+        query_vector: list[float],
+        answer: str,
+        user_id: UUID,
+        corpus_version: str,
+    ) -> models.PointStruct:
+        point_id = uuid.uuid5(user_id, f"{corpus_version}:{normalize_query(query)}")
+        return models.PointStruct(
+            id=str(point_id),
+            vector=query_vector,
+            payload={
+                "query": query,
+                "answer": answer,
+                "user_id": str(user_id),
+                "corpus_version": corpus_version,
+                "created_at": time.time(),
+            },
+        )
+
+    def _expired_selector(self, user_id: UUID) -> models.FilterSelector:
+        # Entries of older corpus versions are never matched again and simply
+        # expire, so the user's expired entries are dropped on every store
+        return models.FilterSelector(
+            filter=models.Filter(
+                must=[
+                    models.FieldCondition(
+                        key="user_id", match=models.MatchValue(value=str(user_id))
+                    ),
+                    models.FieldCondition(
+                        key="created_at",
+                        range=models.Range(
+                            lt=time.time() - self.retrieval_settings.ANSWER_CACHE_TTL_SECONDS
+                        ),
+                    ),
+                ]
+            )
+        )
+
+    def _scope_filter(self, user_id: UUID, corpus_version: str) -> models.Filter:
+        return models.Filter(
+            must=[
+                models.FieldCondition(
+                    key="user_id", match=models.MatchValue(value=str(user_id))
+                ),
+                models.FieldCondition(
+                    key="corpus_version", match=models.MatchValue(value=corpus_version)
+                ),
+                models.FieldCondition(
+                    key="created_at",
+                    range=models.Range(
+                        gte=time.time() - self.retrieval_settings.ANSWER_CACHE_TTL_SECONDS
+                    ),
+                ),
+            ]
+        )
+
+
+service = AnswerCacheService(retrieval_settings=get_retrieval_settings())
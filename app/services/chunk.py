@@ -1,10 +1,12 @@
 from typing import final
 from uuid import UUID
 
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, delete, select, update
+from sqlalchemy.orm import Session, aliased
 
 from app.core.logger import get_logger
 from app.models.chunk import Chunk
+from app.schemas.chunk import CreateChunk
 
 
 logger = get_logger(__name__)
@@ -13,12 +15,73 @@ logger = get_logger(__name__)
 @final
 class ChunkService:
 
-    def create_chunks_into_document(
-        self, db: Session, chunk_ids: list[str], document_id: UUID
+    def get_chunk_ids_from_document(self, db: Session, document_id: UUID) -> set[str]:
+        statement = select(Chunk.id).filter_by(document_id=document_id)
+        return set(db.execute(statement).scalars())
+
+    def sync_chunks_of_document(
+        self,
+        db: Session,
+        document_id: UUID,
+        added_chunks: list[CreateChunk],
+        removed_chunk_ids: set[str],
+        kept_chunks: list[CreateChunk] | None = None,
     ) -> None:
-        chunks = [Chunk(id=id, document_id=document_id) for id in chunk_ids]
-        db.add_all(chunks)
-        db.commit()
+        """Adds and removes chunks of a document without committing.
+
+        `kept_chunks` were already stored, but may have moved within the
+        document, so their positions are updated. The caller commits, so the
+        chunks of several documents and the completion of their jobs are
+        stored in a single transaction.
+        """
+        if removed_chunk_ids:
+            _ = db.execute(delete(Chunk).where(Chunk.id.in_(removed_chunk_ids)))
+        if kept_chunks:
+            _ = db.execute(
+                update(Chunk),
+                [
+                    chunk.model_dump(include={"id", "ordinal", "page", "start", "end"})
+                    for chunk in kept_chunks
+                ],
+            )
+        db.add_all(
+            [
+                Chunk(
+                    id=chunk.id,
+                    document_id=document_id,
+                    content_hash=chunk.content_hash,
+                    ordinal=chunk.ordinal,
+                    page=chunk.page,
+                    start=chunk.start,
+                    end=chunk.end,
+                )
+                for chunk in added_chunks
+            ]
+        )
+
+    def get_neighbour_chunks(
+        self, db: Session, chunk_ids: list[str], window: int
+    ) -> list[tuple[str, Chunk]]:
+        """Returns the chunks up to `window` positions around each of `chunk_ids`.
+
+        Every neighbour is paired with the id of the chunk it surrounds, and
+        the chunks themselves are included, so their positions are known too.
+        A single query over the (document_id, ordinal) index serves all of them.
+        """
+        hit = aliased(Chunk)
+        statement = (
+            select(hit.id, Chunk)
+            .join(
+                Chunk,
+                and_(
+                    Chunk.document_id == hit.document_id,
+                    Chunk.ordinal.between(hit.ordinal - window, hit.ordinal + window),
+                ),
+            )
+            .where(hit.id.in_(chunk_ids))
+            .order_by(Chunk.document_id, Chunk.ordinal)
+        )
+        return [(chunk_id, chunk) for chunk_id, chunk in db.execute(statement)]
 
 
 service = ChunkService()
@@ -0,0 +1,281 @@
+from dataclasses import dataclass, field
+import threading
+from typing import TYPE_CHECKING, Any, final
+
+from langchain_core.documents.base import Document as LangChainDocument
+import numpy as np
+
+from app.core.config import RetrievalSettings, get_retrieval_settings
+from app.core.logger import get_logger
+
+if TYPE_CHECKING:
+    from tokenizers import Tokenizer
+
+logger = get_logger(__name__)
+
+# Shorter common prefixes and suffixes are too likely to be coincidences
+MIN_MERGE_OVERLAP = 8
+# Above the splitter's 50 characters of overlap, which may grow to a separator
+MAX_MERGE_OVERLAP = 200
+# Characters per token assumed when no tokenizer can be loaded
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class _Passage:
+    document_id: str | None
+    source: str | None
+    page: int | None
+    text: str
+    relevance: float
+    chunk_ids: list[Any] = field(default_factory=list)
+    vectors: list[np.ndarray] = field(default_factory=list)
+    tokens: int = 0
+    first_ordinal: int | None = None
+    last_ordinal: int | None = None
+
+    def vector(self) -> np.ndarray | None:
+        if not self.vectors:
+            return None
+        mean = np.mean(self.vectors, axis=0)
+        norm = np.linalg.norm(mean)
+        return mean / norm if norm else mean
+
+
+@dataclass
+class BuiltContext:
+    text: str
+    sources: list[dict[str, Any]]
+    tokens: int
+
+
+def _overlap(first: str, second: str) -> int:
+    # Length of the longest suffix of `first` that is a prefix of `second`
+    longest = min(len(first), len(second) - 1, MAX_MERGE_OVERLAP)
+    for length in range(longest, MIN_MERGE_OVERLAP - 1, -1):
+        if first.endswith(second[:length]):
+            return length
+    return 0
+
+
+def _normalized(vector: list[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else array
+
+
+@final
+class ContextService:
+    """Packs retrieved chunks into the prompt context within CONTEXT_MAX_TOKENS.
+
+    Consecutive or overlapping chunks of the same document are merged into one
+    passage, and passages are picked by maximal marginal relevance
+    (CONTEXT_MMR_LAMBDA) so near duplicates do not take the place of new
+    information. Tokens are counted with the local CONTEXT_TOKENIZER.
+    """
+
+    retrieval_settings: RetrievalSettings
+
+    def __init__(self, retrieval_settings: RetrievalSettings) -> None:
+        self.retrieval_settings = retrieval_settings
+        self._tokenizer: "Tokenizer | None" = None
+        self._tokenizer_loaded = False
+        self._tokenizer_lock = threading.Lock()
+
+    def load_tokenizer(self) -> None:
+        """Loads CONTEXT_TOKENIZER ahead of the first context, which would otherwise wait for it."""
+        _ = self._get_tokenizer()
+
+    def _get_tokenizer(self) -> "Tokenizer | None":
+        with self._tokenizer_lock:
+            if not self._tokenizer_loaded:
+                from tokenizers import Tokenizer
+
+                try:
+                    self._tokenizer = Tokenizer.from_pretrained(
+                        self.retrieval_settings.CONTEXT_TOKENIZER
+                    )
+                except Exception as e:
+                    logger.warning(
+                        f"⚠️ Could not load tokenizer {self.retrieval_settings.CONTEXT_TOKENIZER}, "
+                        f"estimating {CHARS_PER_TOKEN} characters per token: {e}"
+                    )
+                self._tokenizer_loaded = True
+            return self._tokenizer
+
+    def count_tokens(self, texts: list[str]) -> list[int]:
+        tokenizer = self._get_tokenizer()
+        if tokenizer is None:
+            return [-(-len(text) // CHARS_PER_TOKEN) for text in texts]
+        return [
+            len(encoding.ids)
+            for encoding in tokenizer.encode_batch(texts, add_special_tokens=False)
+        ]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokenizer = self._get_tokenizer()
+        if tokenizer is None:
+            return text[: max_tokens * CHARS_PER_TOKEN]
+        offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+        if len(offsets) <= max_tokens:
+            return text
+        return text[: offsets[max_tokens - 1][1]]
+
+    def build(
+        self, query_vector: list[float] | None, documents: list[LangChainDocument]
+    ) -> BuiltContext:
+        """Returns the context for `documents`, given in relevance order.
+
+        Every passage is labelled with its number, and `sources` describes
+        the passage behind each label. Chunks only count as similar to each
+        other when their vectors were retrieved (the "_vector" metadata).
+        """
+        settings = self.retrieval_settings
+        passages = self._merge(documents)
+        if not passages:
+            return BuiltContext(text="", sources=[], tokens=0)
+        for passage, tokens in zip(
+            passages, self.count_tokens([passage.text for passage in passages])
+        ):
+            passage.tokens = tokens
+
+        query = _normalized(query_vector) if query_vector is not None else None
+        vectors = [passage.vector() for passage in passages]
+        for passage, vector in zip(passages, vectors):
+            if query is not None and vector is not None:
+                passage.relevance = float(query @ vector)
+
+        selected: list[int] = []
+        remaining = list(range(len(passages)))
+        budget = settings.CONTEXT_MAX_TOKENS
+        while remaining:
+            best = max(remaining, key=lambda index: self._mmr(index, selected, passages, vectors))
+            remaining.remove(best)
+            passage = passages[best]
+            if passage.tokens > budget:
+                if selected:
+                    continue
+                # The most relevant passage alone exceeds the budget, so it is cut
+                passage.text = self.truncate(passage.text, budget)
+                passage.tokens = budget
+            selected.append(best)
+            budget -= passage.tokens
+
+        blocks: list[str] = []
+        sources: list[dict[str, Any]] = []
+        for label, index in enumerate(selected, start=1):
+            passage = passages[index]
+            location = passage.source or "documento"
+            if passage.page is not None:
+                # Pages are numbered from 0 in the metadata
+                location += f", p. {passage.page + 1}"
+            blocks.append(f"[{label}] ({location})\n{passage.text}")
+            sources.append(
+                {
+                    "label": label,
+                    "document_id": passage.document_id,
+                    "source": passage.source,
+                    "page": passage.page,
+                    "chunk_ids": passage.chunk_ids,
+                }
+            )
+        return BuiltContext(
+            text="\n\n".join(blocks),
+            sources=sources,
+            tokens=settings.CONTEXT_MAX_TOKENS - budget,
+        )
+
+    def _mmr(
+        self,
+        index: int,
+        selected: list[int],
+        passages: list[_Passage],
+        vectors: list[np.ndarray | None],
+    ) -> float:
+        vector = vectors[index]
+        redundancy = max(
+            (
+                float(vector @ other)
+                for other in (vectors[chosen] for chosen in selected)
+                if vector is not None and other is not None
+            ),
+            default=0.0,
+        )
+        weight = self.retrieval_settings.CONTEXT_MMR_LAMBDA
+        return weight * passages[index].relevance - (1 - weight) * redundancy
+
+    def _merge(self, documents: list[LangChainDocument]) -> list[_Passage]:
+        passages: list[_Passage] = []
+        for rank, document in enumerate(documents):
+            metadata = document.metadata
+            vector = metadata.get("_vector")
+            chunk = _Passage(
+                document_id=metadata.get("document_id"),
+                source=metadata.get("source"),
+                page=metadata.get("page"),
+                text=document.page_content,
+                # Retrieval order stands in for relevance when vectors are missing
+                relevance=1 - rank / len(documents),
+                chunk_ids=[metadata.get("_id")],
+                vectors=[_normalized(vector)] if vector is not None else [],
+                first_ordinal=metadata.get("ordinal"),
+                last_ordinal=metadata.get("ordinal"),
+            )
+            if chunk.text in (passage.text for passage in passages):
+                continue
+            passages.append(chunk)
+
+        # Chunks with a known position are merged when they follow each other
+        positioned = sorted(
+            (passage for passage in passages if passage.first_ordinal is not None),
+            key=lambda passage: (passage.document_id or "", passage.first_ordinal),
+        )
+        runs: list[_Passage] = []
+        for passage in positioned:
+            previous = runs[-1] if runs else None
+            if (
+                previous is None
+                or previous.document_id != passage.document_id
+                or passage.first_ordinal > previous.last_ordinal + 1
+            ):
+                runs.append(passage)
+                continue
+            if passage.last_ordinal > previous.last_ordinal:
+                overlap = _overlap(previous.text, passage.text)
+                previous.text += passage.text[overlap:] if overlap else "\n" + passage.text
+                previous.last_ordinal = passage.last_ordinal
+            self._absorb(previous, passage)
+        passages = runs + [passage for passage in passages if passage.first_ordinal is None]
+
+        # Otherwise overlapping text gives adjacent chunks away. Merging may make
+        # a passage overlap another one, so it repeats until stable
+        merged = True
+        while merged:
+            merged = False
+            for first in passages:
+                for second in passages:
+                    if first is second or first.document_id != second.document_id:
+                        continue
+                    if first.first_ordinal is not None and second.first_ordinal is not None:
+                        continue
+                    if second.text not in first.text:
+                        overlap = _overlap(first.text, second.text)
+                        if not overlap:
+                            continue
+                        first.text += second.text[overlap:]
+                    self._absorb(first, second)
+                    passages.remove(second)
+                    merged = True
+                    break
+                if merged:
+                    break
+        return passages
+
+    def _absorb(self, passage: _Passage, other: _Passage) -> None:
+        passage.relevance = max(passage.relevance, other.relevance)
+        passage.chunk_ids.extend(other.chunk_ids)
+        passage.vectors.extend(other.vectors)
+        passage.page = passage.page if passage.page is not None else other.page
+
+
+service = ContextService(retrieval_settings=get_retrieval_settings())
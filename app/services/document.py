@@ -1,14 +1,16 @@
-from typing import final
+import hashlib
+from typing import BinaryIO, final
 from uuid import UUID
 
-from sqlalchemy import delete, insert, select
+from sqlalchemy import delete, insert, select, update
 from sqlalchemy.orm import Session
 from app.core.logger import get_logger
 from app.exceptions.document import DocumentNotFoundException
 from app.exceptions.user import UserNotFoundException
 from app.models.document import Document, FileType
+from app.models.ingestion_job import IngestionJob
 from app.models.user import User
-from app.schemas.document import CreateDocument
+from app.schemas.document import CreateDocument, UpdateDocument
 from app.services.vector import FileExtension
 
 logger = get_logger(__name__)
@@ -27,6 +29,51 @@ class DocumentService:
             size=create_document.size,
             s3_location=create_document.s3_location,
             user_id=create_document.user_id,
+            content_hash=create_document.content_hash,
+        )
+        _ = db.execute(statement)
+        db.commit()
+
+    def create_documents_for_user(
+        self, db: Session, create_documents: list[CreateDocument]
+    ) -> None:
+        """Inserts several documents at once without committing.
+
+        The caller commits, so the documents and their ingestion jobs are
+        stored in a single transaction.
+        """
+        if not create_documents:
+            return
+        statement = insert(Document).values(
+            [
+                {
+                    "id": create_document.id,
+                    "name": create_document.name,
+                    "file_type": create_document.file_type,
+                    "size": create_document.size,
+                    "s3_location": create_document.s3_location,
+                    "user_id": create_document.user_id,
+                    "content_hash": create_document.content_hash,
+                }
+                for create_document in create_documents
+            ]
+        )
+        _ = db.execute(statement)
+
+    def update_document(
+        self, db: Session, document_id: UUID, update_document: UpdateDocument
+    ) -> None:
+        statement = (
+            update(Document)
+            .where(Document.id == document_id)
+            .values(
+                name=update_document.name,
+                file_type=update_document.file_type,
+                size=update_document.size,
+                s3_location=update_document.s3_location,
+                content_hash=update_document.content_hash,
+                version=Document.version + 1,
+            )
         )
         _ = db.execute(statement)
         db.commit()
@@ -47,6 +94,36 @@ class DocumentService:
             )
         return document
 
+    def get_corpus_version(
+        self, db: Session, user_id: UUID, document_ids: list[UUID] | None = None
+    ) -> str:
+        """Fingerprints the documents searched for a user, optionally restricted to `document_ids`.
+
+        It changes whenever a document is added, removed or replaced, and
+        whenever one of its ingestion jobs changes status.
+        """
+        statement = (
+            select(Document.id, Document.version, IngestionJob.id, IngestionJob.status)
+            .outerjoin(IngestionJob, IngestionJob.document_id == Document.id)
+            .where(Document.user_id == user_id)
+        )
+        if document_ids:
+            statement = statement.where(Document.id.in_(document_ids))
+        digest = hashlib.sha256()
+        for document_id, version, job_id, job_status in sorted(
+            db.execute(statement).all(), key=lambda row: (str(row[0]), str(row[2]))
+        ):
+            digest.update(f"{document_id}:{version}:{job_id}:{job_status}\n".encode())
+        return digest.hexdigest()
+
+    def compute_content_hash(self, file: BinaryIO) -> str:
+        digest = hashlib.sha256()
+        _ = file.seek(0)
+        while block := file.read(1024 * 1024):
+            digest.update(block)
+        _ = file.seek(0)
+        return digest.hexdigest()
+
     def drop_document(self, db: Session, document_id: UUID) -> None:
         document = db.query(Document).filter(Document.id == document_id).first()
         if document:
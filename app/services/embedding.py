@@ -0,0 +1,225 @@
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+import random
+import threading
+import time
+from typing import final
+
+from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+from langchain_core.documents.base import Document as LangChainDocument
+from langchain_core.embeddings import Embeddings
+from langchain_qdrant import QdrantVectorStore, RetrievalMode
+from langchain_qdrant.sparse_embeddings import SparseVector
+from qdrant_client.http import models
+
+from app.core.config import EmbeddingSettings, get_embedding_settings
+from app.core.logger import get_logger
+from app.core.metrics import INGESTION_STAGE_SECONDS
+from app.exceptions.embedding import EmbeddingRateLimitedException
+
+logger = get_logger(__name__)
+
+RATE_LIMIT_MARKERS = (
+    "429",
+    "resource_exhausted",
+    "resource has been exhausted",
+    "quota exceeded",
+    "rate limit",
+)
+
+
+def _is_rate_limited(error: BaseException) -> bool:
+    # LangChain wraps the Google API error, so the whole cause chain is inspected
+    current: BaseException | None = error
+    while current is not None:
+        if isinstance(current, (ResourceExhausted, TooManyRequests)):
+            return True
+        if any(marker in str(current).lower() for marker in RATE_LIMIT_MARKERS):
+            return True
+        current = current.__cause__ or current.__context__
+    return False
+
+
+def _batched(
+    items: Iterable[tuple[str, LangChainDocument]], size: int
+) -> Iterator[list[tuple[str, LangChainDocument]]]:
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class _AdaptiveLimiter:
+    """Additive-increase/multiplicative-decrease cap on concurrent embedding calls.
+
+    A rate limited call halves the allowed concurrency and pauses every caller
+    for its backoff delay, while each successful call grows it back by 1/limit.
+    """
+
+    def __init__(self, max_concurrency: int) -> None:
+        self._max_concurrency = float(max_concurrency)
+        self._limit = float(max_concurrency)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait <= 0 and self._in_flight < int(self._limit):
+                    self._in_flight += 1
+                    return
+                _ = self._condition.wait(timeout=wait if wait > 0 else None)
+
+    def release(self, backoff: float | None = None) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            if backoff is None:
+                self._limit = min(self._max_concurrency, self._limit + 1 / self._limit)
+            else:
+                self._limit = max(1.0, self._limit / 2)
+                self._paused_until = max(self._paused_until, time.monotonic() + backoff)
+            self._condition.notify_all()
+
+
+@final
+class EmbeddingService:
+
+    embedding_settings: EmbeddingSettings
+
+    def __init__(self, embedding_settings: EmbeddingSettings) -> None:
+        self.embedding_settings = embedding_settings
+
+    def embed_and_upsert(
+        self,
+        chunks: Iterable[tuple[str, LangChainDocument]],
+        vector_store: QdrantVectorStore,
+        progress_callback: Callable[[int], None] | None = None,
+    ) -> list[str]:
+        """Embeds chunks in concurrent batches and upserts each batch as soon as it is embedded.
+
+        `chunks` are (point id, chunk) pairs. At most twice
+        EMBEDDING_MAX_CONCURRENCY batches are pending at once, so `chunks` may
+        be a lazy iterable and is only consumed as fast as batches are stored.
+        `progress_callback` receives the number of chunks stored so far and is
+        always called from the calling thread.
+        """
+        settings = self.embedding_settings
+        limiter = _AdaptiveLimiter(settings.EMBEDDING_MAX_CONCURRENCY)
+        pending: deque[Future[Future[list[str]]]] = deque()
+        stored_ids: list[str] = []
+
+        def collect_oldest() -> None:
+            stored_ids.extend(pending.popleft().result().result())
+            if progress_callback:
+                progress_callback(len(stored_ids))
+
+        embed_pool = ThreadPoolExecutor(
+            max_workers=settings.EMBEDDING_MAX_CONCURRENCY, thread_name_prefix="embed"
+        )
+        upsert_pool = ThreadPoolExecutor(
+            max_workers=settings.QDRANT_UPSERT_CONCURRENCY, thread_name_prefix="upsert"
+        )
+        try:
+            for batch in _batched(chunks, settings.EMBEDDING_BATCH_SIZE):
+                if len(pending) >= 2 * settings.EMBEDDING_MAX_CONCURRENCY:
+                    collect_oldest()
+                pending.append(
+                    embed_pool.submit(
+                        self._embed_batch, batch, vector_store, limiter, upsert_pool
+                    )
+                )
+            while pending:
+                collect_oldest()
+        finally:
+            embed_pool.shutdown(cancel_futures=True)
+            upsert_pool.shutdown(cancel_futures=True)
+        return stored_ids
+
+    def _embed_batch(
+        self,
+        batch: list[tuple[str, LangChainDocument]],
+        vector_store: QdrantVectorStore,
+        limiter: _AdaptiveLimiter,
+        upsert_pool: ThreadPoolExecutor,
+    ) -> Future[list[str]]:
+        texts = [chunk.page_content for _, chunk in batch]
+        vectors = self._embed_with_backoff(texts, vector_store.embeddings, limiter)
+        sparse_vectors = None
+        if vector_store.retrieval_mode == RetrievalMode.HYBRID:
+            # The BM25 model runs locally, so it needs no rate limiting
+            sparse_vectors = vector_store.sparse_embeddings.embed_documents(texts)
+        return upsert_pool.submit(
+            self._upsert_batch, batch, vectors, sparse_vectors, vector_store
+        )
+
+    def _embed_with_backoff(
+        self, texts: list[str], embeddings: Embeddings, limiter: _AdaptiveLimiter
+    ) -> list[list[float]]:
+        settings = self.embedding_settings
+        attempt = 0
+        while True:
+            limiter.acquire()
+            try:
+                with INGESTION_STAGE_SECONDS.labels(stage="embed").time():
+                    vectors = embeddings.embed_documents(texts)
+            except Exception as e:
+                if not _is_rate_limited(e):
+                    limiter.release()
+                    raise
+                if attempt == settings.EMBEDDING_MAX_RETRIES:
+                    limiter.release()
+                    raise EmbeddingRateLimitedException(
+                        f"Embedding batch of {len(texts)} chunks still rate limited "
+                        f"after {attempt} retries"
+                    ) from e
+                backoff = min(
+                    settings.EMBEDDING_MAX_BACKOFF_SECONDS,
+                    settings.EMBEDDING_BACKOFF_SECONDS * 2**attempt,
+                ) * random.uniform(0.5, 1.0)
+                limiter.release(backoff=backoff)
+                attempt += 1
+                logger.warning(
+                    f"⏳ Embedding batch rate limited, retrying in {backoff:.1f}s "
+                    f"(retry {attempt}/{settings.EMBEDDING_MAX_RETRIES})"
+                )
+                continue
+            limiter.release()
+            return vectors
+
+    def _upsert_batch(
+        self,
+        batch: list[tuple[str, LangChainDocument]],
+        vectors: list[list[float]],
+        sparse_vectors: list[SparseVector] | None,
+        vector_store: QdrantVectorStore,
+    ) -> list[str]:
+        point_vectors: list[dict[str, models.Vector]] = [
+            {vector_store.vector_name: vector} for vector in vectors
+        ]
+        if sparse_vectors is not None:
+            for point_vector, sparse_vector in zip(point_vectors, sparse_vectors):
+                point_vector[vector_store.sparse_vector_name] = models.SparseVector(
+                    indices=sparse_vector.indices, values=sparse_vector.values
+                )
+        points = [
+            models.PointStruct(
+                id=chunk_id,
+                vector=point_vector,
+                payload={
+                    vector_store.content_payload_key: chunk.page_content,
+                    vector_store.metadata_payload_key: chunk.metadata,
+                },
+            )
+            for (chunk_id, chunk), point_vector in zip(batch, point_vectors)
+        ]
+        with INGESTION_STAGE_SECONDS.labels(stage="upsert").time():
+            _ = vector_store.client.upsert(
+                collection_name=vector_store.collection_name, points=points, wait=True
+            )
+        return [chunk_id for chunk_id, _ in batch]
+
+
+service = EmbeddingService(embedding_settings=get_embedding_settings())
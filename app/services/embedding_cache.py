@@ -0,0 +1,199 @@
+from array import array
+import hashlib
+import threading
+from typing import TYPE_CHECKING, final
+
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from sqlalchemy import delete, func, select, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from app.core.config import EmbeddingSettings, get_embedding_settings
+from app.core.logger import get_logger
+from app.db.database import SessionLocal
+from app.models.embedding_cache import EmbeddingCacheEntry
+
+if TYPE_CHECKING:
+    from app.services.query_embedding_cache import QueryEmbeddingCache
+
+logger = get_logger(__name__)
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def embed_queries(embeddings: Embeddings, texts: list[str]) -> list[list[float]]:
+    """Embeds several queries with a single call to the backend when it supports it."""
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings.embed_queries(texts)
+    if len(texts) == 1:
+        return [embeddings.embed_query(texts[0])]
+    if isinstance(embeddings, GoogleGenerativeAIEmbeddings):
+        # Query embeddings use their own task type, which embed_documents accepts
+        return embeddings.embed_documents(texts, task_type="RETRIEVAL_QUERY")
+
+    from langchain_community.embeddings import FastEmbedEmbeddings
+
+    if isinstance(embeddings, FastEmbedEmbeddings):
+        return [vector.tolist() for vector in embeddings.model.query_embed(texts)]
+    return [embeddings.embed_query(text) for text in texts]
+
+
+@final
+class EmbeddingCacheService:
+    """Persistent cache of document embeddings keyed by (model, sha256 of the text)."""
+
+    embedding_settings: EmbeddingSettings
+
+    def __init__(self, embedding_settings: EmbeddingSettings) -> None:
+        self.embedding_settings = embedding_settings
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, int | float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / total if total else 0.0,
+            }
+
+    def embed_documents(
+        self, embeddings: Embeddings, model: str, texts: list[str]
+    ) -> list[list[float]]:
+        hashes = [content_hash(text) for text in texts]
+        vectors = self.lookup(model, set(hashes))
+
+        missing = {
+            text_hash: text
+            for text_hash, text in zip(hashes, texts)
+            if text_hash not in vectors
+        }
+        with self._lock:
+            self.hits += len(texts) - sum(1 for h in hashes if h in missing)
+            self.misses += len(missing)
+
+        if missing:
+            computed = dict(
+                zip(missing.keys(), embeddings.embed_documents(list(missing.values())))
+            )
+            self.store(model, computed)
+            vectors.update(computed)
+        return [vectors[text_hash] for text_hash in hashes]
+
+    def lookup(self, model: str, hashes: set[str]) -> dict[str, list[float]]:
+        with SessionLocal() as db:
+            return self._lookup(db, model, hashes)
+
+    def store(self, model: str, vectors: dict[str, list[float]]) -> None:
+        with SessionLocal() as db:
+            self._store(db, model, vectors)
+
+    def _lookup(
+        self, db: Session, model: str, hashes: set[str]
+    ) -> dict[str, list[float]]:
+        statement = select(
+            EmbeddingCacheEntry.content_hash, EmbeddingCacheEntry.vector
+        ).where(
+            EmbeddingCacheEntry.model == model,
+            EmbeddingCacheEntry.content_hash.in_(hashes),
+        )
+        found = {
+            text_hash: array("f", vector).tolist()
+            for text_hash, vector in db.execute(statement)
+        }
+        if found:
+            # Recency drives eviction, so hits are touched
+            _ = db.execute(
+                update(EmbeddingCacheEntry)
+                .where(
+                    EmbeddingCacheEntry.model == model,
+                    EmbeddingCacheEntry.content_hash.in_(found.keys()),
+                )
+                .values(last_used_at=func.now())
+            )
+            db.commit()
+        return found
+
+    def _store(self, db: Session, model: str, vectors: dict[str, list[float]]) -> None:
+        statement = (
+            insert(EmbeddingCacheEntry)
+            .values(
+                [
+                    {
+                        "model": model,
+                        "content_hash": text_hash,
+                        "vector": array("f", vector).tobytes(),
+                    }
+                    for text_hash, vector in vectors.items()
+                ]
+            )
+            .on_conflict_do_nothing()
+        )
+        _ = db.execute(statement)
+        db.commit()
+
+    def prune(self, db: Session) -> int:
+        """Evicts the least recently used entries above EMBEDDING_CACHE_MAX_ENTRIES."""
+        count = db.execute(select(func.count()).select_from(EmbeddingCacheEntry)).scalar_one()
+        excess = count - self.embedding_settings.EMBEDDING_CACHE_MAX_ENTRIES
+        if excess <= 0:
+            return 0
+        oldest = (
+            select(EmbeddingCacheEntry.model, EmbeddingCacheEntry.content_hash)
+            .order_by(EmbeddingCacheEntry.last_used_at)
+            .limit(excess)
+        )
+        _ = db.execute(
+            delete(EmbeddingCacheEntry).where(
+                tuple_(EmbeddingCacheEntry.model, EmbeddingCacheEntry.content_hash).in_(
+                    oldest
+                )
+            )
+        )
+        db.commit()
+        logger.info(f"🧹 Evicted {excess} entries from the embedding cache")
+        return excess
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends texts never embedded before to `embeddings`."""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        cache: EmbeddingCacheService | None,
+        query_cache: "QueryEmbeddingCache | None" = None,
+    ) -> None:
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+        self.query_cache = query_cache
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self.cache is None:
+            return self.embeddings.embed_documents(texts)
+        return self.cache.embed_documents(self.embeddings, self.model, texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        if self.query_cache is None:
+            return self.embeddings.embed_query(text)
+        return self.query_cache.embed_query(self.embeddings, self.model, text)
+
+    async def aembed_query(self, text: str) -> list[float]:
+        if self.query_cache is None:
+            return await self.embeddings.aembed_query(text)
+        return await self.query_cache.aembed_query(self.embeddings, self.model, text)
+
+    def embed_queries(self, texts: list[str]) -> list[list[float]]:
+        if self.query_cache is None:
+            return embed_queries(self.embeddings, texts)
+        return self.query_cache.embed_queries(self.embeddings, self.model, texts)
+
+
+service = EmbeddingCacheService(embedding_settings=get_embedding_settings())
@@ -0,0 +1,396 @@
+from collections.abc import Iterator
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from datetime import timedelta
+from itertools import chain
+import os
+from typing import Any, BinaryIO, final
+from uuid import UUID
+import uuid
+
+from langchain_core.documents.base import Document as LangChainDocument
+from langchain_qdrant import QdrantVectorStore
+from minio import Minio
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+
+from app.core.config import IngestionSettings, S3Settings, get_ingestion_settings
+from app.core.logger import get_logger
+from app.core.metrics import INGESTED_CHUNKS, record_error
+from app.exceptions.ingestion import IngestionJobNotFoundException
+from app.models.document import Document
+from app.models.ingestion_job import IngestionJob, JobStage, JobStatus
+from app.schemas.chunk import CreateChunk
+from app.services.chunk import service as chunk_service
+from app.services.embedding_cache import service as embedding_cache_service
+from app.services.s3 import service as s3_service
+from app.services.vector import service as vector_service
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class _JobIngestion:
+    """State of one document while the jobs of a batch are streamed together."""
+
+    job: IngestionJob
+    spool: BinaryIO
+    file_extension: str
+    existing_chunk_ids: set[str]
+    chunks: list[CreateChunk] = field(default_factory=list)
+    # Metadata of the chunks that are already stored, which may have moved
+    kept_metadata: dict[str, dict[str, Any]] = field(default_factory=dict)
+    pages_read: int = 0
+    page_count: int = 1
+    error: Exception | None = None
+
+
+@final
+class IngestionService:
+
+    ingestion_settings: IngestionSettings
+
+    def __init__(self, ingestion_settings: IngestionSettings) -> None:
+        self.ingestion_settings = ingestion_settings
+
+    def enqueue_document(self, db: Session, document_id: UUID) -> IngestionJob:
+        return self.enqueue_documents(db, [document_id])[0]
+
+    def enqueue_documents(
+        self, db: Session, document_ids: list[UUID], batch_id: UUID | None = None
+    ) -> list[IngestionJob]:
+        jobs = [
+            IngestionJob(
+                id=uuid.uuid4(),
+                document_id=document_id,
+                batch_id=batch_id,
+                status=JobStatus.PENDING,
+                stage=JobStage.QUEUED,
+                progress=0.0,
+                attempts=0,
+            )
+            for document_id in document_ids
+        ]
+        db.add_all(jobs)
+        db.commit()
+        return jobs
+
+    def get_latest_job_for_document(
+        self, db: Session, document_id: UUID
+    ) -> IngestionJob:
+        statement = (
+            select(IngestionJob)
+            .filter_by(document_id=document_id)
+            .order_by(IngestionJob.created_at.desc())
+            .limit(1)
+        )
+        job = db.execute(statement).scalar_one_or_none()
+        if not job:
+            raise IngestionJobNotFoundException(
+                f"No ingestion job found for document with id {document_id}"
+            )
+        return job
+
+    def find_duplicate_job(
+        self, db: Session, user_id: UUID, content_hash: str
+    ) -> IngestionJob | None:
+        """Returns the job of an identical file already uploaded by the user, unless it failed."""
+        statement = (
+            select(IngestionJob)
+            .join(Document)
+            .where(
+                Document.user_id == user_id,
+                Document.content_hash == content_hash,
+                IngestionJob.status != JobStatus.FAILED,
+            )
+            .order_by(IngestionJob.created_at.desc())
+            .limit(1)
+        )
+        return db.execute(statement).scalar_one_or_none()
+
+    def has_active_job(self, db: Session, document_id: UUID) -> bool:
+        statement = select(IngestionJob.id).where(
+            IngestionJob.document_id == document_id,
+            IngestionJob.status.in_([JobStatus.PENDING, JobStatus.RUNNING]),
+        )
+        return db.execute(statement.limit(1)).first() is not None
+
+    def claim_next_job(self, db: Session) -> IngestionJob | None:
+        """Locks the oldest runnable job so concurrent workers never pick the same one.
+
+        Jobs left RUNNING by a crashed worker become claimable again once their
+        lock is older than INGESTION_LOCK_TIMEOUT_SECONDS.
+        """
+        lock_timeout = timedelta(
+            seconds=self.ingestion_settings.INGESTION_LOCK_TIMEOUT_SECONDS
+        )
+        statement = (
+            select(IngestionJob)
+            .where(
+                or_(
+                    IngestionJob.status == JobStatus.PENDING,
+                    and_(
+                        IngestionJob.status == JobStatus.RUNNING,
+                        IngestionJob.locked_at < func.now() - lock_timeout,
+                    ),
+                )
+            )
+            .order_by(IngestionJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        job = db.execute(statement).scalar_one_or_none()
+        if not job:
+            db.rollback()
+            return None
+        job.status = JobStatus.RUNNING
+        job.locked_at = func.now()
+        job.attempts += 1
+        db.commit()
+        return job
+
+    def claim_batch_jobs(self, db: Session, batch_id: UUID) -> list[IngestionJob]:
+        """Locks up to INGESTION_BATCH_MAX_JOBS - 1 more pending jobs of a bulk upload.
+
+        Jobs locked by other workers are skipped, so several workers can share
+        a large batch.
+        """
+        statement = (
+            select(IngestionJob)
+            .where(
+                IngestionJob.batch_id == batch_id,
+                IngestionJob.status == JobStatus.PENDING,
+            )
+            .order_by(IngestionJob.created_at)
+            .limit(self.ingestion_settings.INGESTION_BATCH_MAX_JOBS - 1)
+            .with_for_update(skip_locked=True)
+        )
+        jobs = list(db.execute(statement).scalars())
+        for job in jobs:
+            job.status = JobStatus.RUNNING
+            job.locked_at = func.now()
+            job.attempts += 1
+        db.commit()
+        return jobs
+
+    def update_progress(
+        self, db: Session, job: IngestionJob, stage: JobStage, progress: float
+    ) -> None:
+        self.update_jobs_progress(db, [job], stage, progress)
+
+    def update_jobs_progress(
+        self, db: Session, jobs: list[IngestionJob], stage: JobStage, progress: float
+    ) -> None:
+        for job in jobs:
+            job.stage = stage
+            job.progress = progress
+            job.locked_at = func.now()
+        db.commit()
+
+    def fail_job(self, db: Session, job: IngestionJob, error: str) -> None:
+        job.error = error
+        job.locked_at = None
+        if job.attempts < self.ingestion_settings.INGESTION_MAX_ATTEMPTS:
+            job.status = JobStatus.PENDING
+            job.stage = JobStage.QUEUED
+            job.progress = 0.0
+        else:
+            job.status = JobStatus.FAILED
+        db.commit()
+
+    def process_job(
+        self,
+        db: Session,
+        job: IngestionJob,
+        s3_client: Minio,
+        s3_settings: S3Settings,
+        vector_store: QdrantVectorStore,
+    ) -> None:
+        self.process_jobs(db, [job], s3_client, s3_settings, vector_store)
+
+    def process_jobs(
+        self,
+        db: Session,
+        jobs: list[IngestionJob],
+        s3_client: Minio,
+        s3_settings: S3Settings,
+        vector_store: QdrantVectorStore,
+    ) -> None:
+        """Ingests several claimed jobs, sharing embedding batches between them.
+
+        Documents are streamed page by page into the embedding batches, so the
+        first vectors are stored while the rest of a document is still being
+        parsed. A document that cannot be downloaded or parsed only fails its
+        own job, while the chunks of every other document are stored together.
+        """
+        self.update_jobs_progress(db, jobs, JobStage.DOWNLOADING, 0.0)
+        with ExitStack() as spools:
+            ingestions: list[_JobIngestion] = []
+            for job in jobs:
+                file_extension = os.path.splitext(job.document.name)[1]
+                try:
+                    spool = spools.enter_context(
+                        s3_service.download_document_from_s3(
+                            job.document.s3_location,
+                            s3_client,
+                            s3_settings,
+                            suffix=file_extension,
+                        )
+                    )
+                except Exception as e:
+                    logger.exception(f"❌ Ingestion job {job.id} failed")
+                    record_error("ingestion", e)
+                    db.rollback()
+                    self.fail_job(db, job, str(e))
+                    continue
+                ingestions.append(
+                    _JobIngestion(
+                        job=job,
+                        spool=spool,
+                        file_extension=file_extension,
+                        existing_chunk_ids=chunk_service.get_chunk_ids_from_document(
+                            db, job.document_id
+                        ),
+                    )
+                )
+            if not ingestions:
+                return
+
+            self.update_jobs_progress(
+                db, [ingestion.job for ingestion in ingestions], JobStage.PARSING, 0.1
+            )
+
+            def report_embedding_progress(_: int) -> None:
+                for ingestion in ingestions:
+                    ingestion.job.stage = JobStage.EMBEDDING
+                    ingestion.job.progress = (
+                        0.1 + 0.8 * ingestion.pages_read / max(ingestion.page_count, 1)
+                    )
+                    ingestion.job.locked_at = func.now()
+                db.commit()
+
+            try:
+                _ = vector_service.store_chunks(
+                    chain.from_iterable(
+                        self._iter_new_chunks(ingestion) for ingestion in ingestions
+                    ),
+                    vector_store,
+                    progress_callback=report_embedding_progress,
+                )
+            except Exception:
+                # Batches upserted before the failure have no chunk rows, but
+                # tenant filtered retrieval would still find them
+                for ingestion in ingestions:
+                    self._drop_stored_chunks(ingestion, vector_store)
+                raise
+
+        succeeded = [ingestion for ingestion in ingestions if ingestion.error is None]
+        self.update_jobs_progress(
+            db, [ingestion.job for ingestion in succeeded], JobStage.STORING, 0.9
+        )
+        for ingestion in succeeded:
+            job = ingestion.job
+            chunk_ids = {chunk.id for chunk in ingestion.chunks}
+            # Chunks that vanished from a replaced document are dropped only once
+            # the new version is stored, so the document stays searchable meanwhile
+            removed_chunk_ids = ingestion.existing_chunk_ids - chunk_ids
+            if removed_chunk_ids:
+                vector_service.drop_chunks_from_document_id(
+                    list(removed_chunk_ids), vector_store
+                )
+            if ingestion.kept_metadata:
+                vector_service.refresh_chunk_metadata(ingestion.kept_metadata, vector_store)
+            added_chunks = [
+                chunk
+                for chunk in ingestion.chunks
+                if chunk.id not in ingestion.existing_chunk_ids
+            ]
+            kept_chunks = [
+                chunk for chunk in ingestion.chunks if chunk.id in ingestion.existing_chunk_ids
+            ]
+            chunk_service.sync_chunks_of_document(
+                db, job.document_id, added_chunks, removed_chunk_ids, kept_chunks
+            )
+            INGESTED_CHUNKS.labels(status="new").inc(len(added_chunks))
+            INGESTED_CHUNKS.labels(status="unchanged").inc(len(kept_chunks))
+            INGESTED_CHUNKS.labels(status="removed").inc(len(removed_chunk_ids))
+            job.status = JobStatus.COMPLETED
+            job.stage = JobStage.DONE
+            job.progress = 1.0
+            job.error = None
+            job.locked_at = None
+            logger.info(
+                f"✅ Ingested document {job.document_id}: {len(chunk_ids)} chunks, "
+                f"{len(added_chunks)} new, {len(removed_chunk_ids)} removed"
+            )
+        # Completion is committed together with the chunks, so a crash can never
+        # leave a finished job without its chunks or vice versa
+        db.commit()
+
+        for ingestion in ingestions:
+            if ingestion.error is None:
+                continue
+            # Points stored before the parse error are not tracked in the database
+            self._drop_stored_chunks(ingestion, vector_store)
+            self.fail_job(db, ingestion.job, str(ingestion.error))
+
+        logger.info(f"📊 Embedding cache: {embedding_cache_service.stats()}")
+        _ = embedding_cache_service.prune(db)
+
+    def backfill_tenant_payload(self, db: Session, vector_store: QdrantVectorStore) -> None:
+        """Tags the points of documents ingested before chunks carried their owner.
+
+        Retrieval filters on the owner, so untagged points would never be found.
+        """
+        if not vector_service.count_untagged_points(vector_store):
+            return
+        logger.info("🏷️ Tagging stored chunks with their user and document...")
+        statement = select(Document.id, Document.user_id)
+        for document_id, user_id in db.execute(statement).all():
+            chunk_ids = chunk_service.get_chunk_ids_from_document(db, document_id)
+            if chunk_ids:
+                vector_service.tag_document_points(
+                    list(chunk_ids), user_id, document_id, vector_store
+                )
+
+    def _drop_stored_chunks(
+        self, ingestion: _JobIngestion, vector_store: QdrantVectorStore
+    ) -> None:
+        # Every new chunk read so far may have been upserted
+        stored_chunk_ids = [
+            chunk.id
+            for chunk in ingestion.chunks
+            if chunk.id not in ingestion.existing_chunk_ids
+        ]
+        if stored_chunk_ids:
+            vector_service.drop_chunks_from_document_id(stored_chunk_ids, vector_store)
+
+    def _iter_new_chunks(
+        self, ingestion: _JobIngestion
+    ) -> Iterator[tuple[CreateChunk, LangChainDocument]]:
+        def count_pages(pages_read: int, page_count: int) -> None:
+            ingestion.pages_read = pages_read
+            ingestion.page_count = page_count
+
+        job = ingestion.job
+        try:
+            for created, chunk in vector_service.iter_chunks(
+                ingestion.spool,
+                ingestion.file_extension,
+                job.document_id,
+                job.document.user_id,
+                job.document.name,
+                page_callback=count_pages,
+            ):
+                ingestion.chunks.append(created)
+                if created.id in ingestion.existing_chunk_ids:
+                    ingestion.kept_metadata[created.id] = chunk.metadata
+                else:
+                    yield created, chunk
+        except Exception as e:
+            logger.exception(f"❌ Ingestion job {job.id} failed")
+            record_error("ingestion", e)
+            ingestion.error = e
+
+
+service = IngestionService(ingestion_settings=get_ingestion_settings())
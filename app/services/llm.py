@@ -1,19 +1,53 @@
-from typing import final
-from app.services.vector import VectorService
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import dataclass
+from typing import Any, cast, final
+from uuid import UUID
+from app.services.vector import service as vector_service
 from langchain_google_genai import ChatGoogleGenerativeAI
-from app.core.config import get_core_settings
+from qdrant_client import AsyncQdrantClient
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.messages.ai import UsageMetadata
+from app.core.config import get_core_settings, get_retrieval_settings
+from app.core.metrics import record_error, record_token_usage
+from app.core.timing import StageTimer
+from app.models.message import Message
+from app.services.answer_cache import service as answer_cache_service
+from app.services.context import BuiltContext, service as context_service
+from app.services.embedding_cache import embed_queries
+from app.services.rerank import service as rerank_service
+
+
+@dataclass
+class _Prepared:
+    """What the LLM needs to answer a query, or its answer from the cache."""
+
+    query_vector: list[float]
+    cached_answer: str | None = None
+    context: BuiltContext | None = None
+
+    @property
+    def context_text(self) -> str:
+        return self.context.text if self.context is not None else ""
+
+
+def _stage(timer: StageTimer | None, name: str) -> AbstractContextManager[object]:
+    return timer.stage(name) if timer is not None else nullcontext()
 
 
 @final
 class LLMService:
     def __init__(self):
-        self.vector_service = VectorService()
+        self.vector_service = vector_service
         self.core_settings = get_core_settings()
+        self.retrieval_settings = get_retrieval_settings()
 
         try:
             self.llm = ChatGoogleGenerativeAI(
                 model="gemini-2.0-flash-lite",
                 max_retries=2,
+                timeout=self.retrieval_settings.LLM_TIMEOUT_SECONDS,
                 api_key=self.core_settings.GOOGLE_API_KEY,
             )
             print(
@@ -23,26 +57,366 @@ class LLMService:
             print(f"❌ Failed to initialize Google LLM: {str(e)}")
             raise
 
-    def generate_response(self, user_query: str, vector_store):
-        documents = self.vector_service.retrieve_documents(
-            user_query, vector_store)
-        context = "\n\n".join([doc.page_content for doc in documents])
+    def generate_response(
+        self,
+        user_query: str,
+        vector_store,
+        user_id: UUID,
+        document_ids: list[UUID] | None = None,
+        corpus_version: str | None = None,
+        use_cache: bool = True,
+        timer: StageTimer | None = None,
+        conversation: str | None = None,
+    ):
+        """Answers `user_query` from the user's documents.
 
-        prompt = f"""
-        Usa esta información de referencia para responder la pregunta:
+        When `corpus_version` is given, answers are reused for semantically
+        equivalent queries against the same corpus version. `use_cache=False`
+        skips the lookup but still stores the fresh answer. The duration of
+        every stage is recorded in `timer`. Answers given within a
+        `conversation` (see `format_conversation`) are never cached.
+        """
+        timer = timer or StageTimer()
+        corpus_version = self._cache_scope(corpus_version, conversation)
+        prepared = self._prepare(
+            [user_query], vector_store, user_id, document_ids, corpus_version, use_cache, timer
+        )[0]
+        if prepared.cached_answer is not None:
+            return AIMessage(content=prepared.cached_answer)
+        prompt = self._build_prompt(user_query, prepared.context_text, conversation)
 
-        {context}
+        try:
+            with timer.stage("generate"):
+                response = self.llm.invoke(prompt)
+        except Exception as e:
+            print(f"❌ Error generating response: {str(e)}")
+            record_error("llm", e)
+            return "Error al generar la respuesta."
 
-        Pregunta: {user_query}
+        record_token_usage(response.usage_metadata)
+        if corpus_version is not None:
+            answer_cache_service.store(
+                vector_store.client,
+                vector_store.collection_name,
+                user_query,
+                prepared.query_vector,
+                response.text(),
+                user_id,
+                corpus_version,
+            )
+        return response
 
-        Respuesta:
+    async def agenerate_response(
+        self,
+        user_query: str,
+        vector_store,
+        client: AsyncQdrantClient,
+        user_id: UUID,
+        document_ids: list[UUID] | None = None,
+        corpus_version: str | None = None,
+        use_cache: bool = True,
+        timer: StageTimer | None = None,
+        conversation: str | None = None,
+    ):
+        """Async `generate_response`, awaiting the LLM instead of blocking.
+
+        Everything before the LLM call runs in a worker thread, and the answer
+        is cached through `client`. Cancelling the task cancels the LLM call.
         """
+        timer = timer or StageTimer()
+        corpus_version = self._cache_scope(corpus_version, conversation)
+        prepared = (
+            await asyncio.to_thread(
+                self._prepare,
+                [user_query],
+                vector_store,
+                user_id,
+                document_ids,
+                corpus_version,
+                use_cache,
+                timer,
+            )
+        )[0]
+        if prepared.cached_answer is not None:
+            return AIMessage(content=prepared.cached_answer)
+        prompt = self._build_prompt(user_query, prepared.context_text, conversation)
 
         try:
-            return self.llm.invoke(prompt)
+            with timer.stage("generate"):
+                response = await self.llm.ainvoke(prompt)
         except Exception as e:
             print(f"❌ Error generating response: {str(e)}")
+            record_error("llm", e)
             return "Error al generar la respuesta."
 
+        record_token_usage(response.usage_metadata)
+        if corpus_version is not None:
+            await answer_cache_service.astore(
+                client,
+                vector_store.collection_name,
+                user_query,
+                prepared.query_vector,
+                response.text(),
+                user_id,
+                corpus_version,
+            )
+        return response
+
+    async def astream_response(
+        self,
+        user_query: str,
+        vector_store,
+        client: AsyncQdrantClient,
+        user_id: UUID,
+        document_ids: list[UUID] | None = None,
+        corpus_version: str | None = None,
+        use_cache: bool = True,
+        timer: StageTimer | None = None,
+        conversation: str | None = None,
+    ) -> AsyncIterator[tuple[str, Any]]:
+        """Streaming `agenerate_response`, yielding (event, data) pairs.
+
+        A "sources" event with the retrieved chunks comes first, then one
+        "token" event per chunk streamed by the LLM, then a "done" event with
+        the full answer, the token usage and the stage durations. A failure
+        at any stage ends the stream with an "error" event instead.
+        """
+        timer = timer or StageTimer()
+        corpus_version = self._cache_scope(corpus_version, conversation)
+        try:
+            prepared = (
+                await asyncio.to_thread(
+                    self._prepare,
+                    [user_query],
+                    vector_store,
+                    user_id,
+                    document_ids,
+                    corpus_version,
+                    use_cache,
+                    timer,
+                )
+            )[0]
+        except Exception as e:
+            # The response has already started, so the failure is reported in the stream
+            print(f"❌ Error retrieving the context: {str(e)}")
+            record_error("retrieval", e)
+            yield "error", {"detail": "Error al generar la respuesta."}
+            return
+        if prepared.cached_answer is not None:
+            yield "sources", []
+            yield "token", {"text": prepared.cached_answer}
+            yield "done", self._done_event(prepared.cached_answer, None, timer, cached=True)
+            return
+        yield "sources", prepared.context.sources if prepared.context is not None else []
+
+        prompt = self._build_prompt(user_query, prepared.context_text, conversation)
+        response: AIMessageChunk | None = None
+        try:
+            with timer.stage("generate"):
+                async for chunk in self.llm.astream(prompt):
+                    response = chunk if response is None else response + chunk
+                    if chunk.text():
+                        yield "token", {"text": chunk.text()}
+        except Exception as e:
+            print(f"❌ Error generating response: {str(e)}")
+            record_error("llm", e)
+            yield "error", {"detail": "Error al generar la respuesta."}
+            return
+
+        answer = response.text() if response is not None else ""
+        record_token_usage(response.usage_metadata if response is not None else None)
+        if corpus_version is not None:
+            try:
+                await answer_cache_service.astore(
+                    client,
+                    vector_store.collection_name,
+                    user_query,
+                    prepared.query_vector,
+                    answer,
+                    user_id,
+                    corpus_version,
+                )
+            except Exception as e:
+                # The answer was already streamed, it is only left out of the cache
+                print(f"⚠️ Could not cache the answer: {str(e)}")
+                record_error("answer_cache", e)
+        yield "done", self._done_event(
+            answer, response.usage_metadata if response is not None else None, timer
+        )
+
+    def generate_batch(
+        self,
+        user_queries: list[str],
+        vector_store,
+        user_id: UUID,
+        document_ids: list[UUID] | None = None,
+        corpus_version: str | None = None,
+        use_cache: bool = True,
+    ) -> list[str | Exception]:
+        """Answers several queries, returning an answer or the error of each one in order.
+
+        Every stage before the LLM handles all the queries at once (see
+        `_prepare`), and at most LLM_BATCH_CONCURRENCY answers are generated
+        at once.
+        """
+        corpus_version = self._cache_scope(corpus_version, None)
+        prepared = self._prepare(
+            user_queries, vector_store, user_id, document_ids, corpus_version, use_cache
+        )
+        results: list[str | Exception | None] = [item.cached_answer for item in prepared]
+        pending = [index for index, result in enumerate(results) if result is None]
+        if not pending:
+            return cast(list[str | Exception], results)
+
+        responses = self.llm.batch(
+            [
+                self._build_prompt(user_queries[index], prepared[index].context_text)
+                for index in pending
+            ],
+            config={"max_concurrency": self.retrieval_settings.LLM_BATCH_CONCURRENCY},
+            return_exceptions=True,
+        )
+        entries: list[tuple[str, list[float], str]] = []
+        for index, response in zip(pending, responses):
+            if isinstance(response, Exception):
+                print(f"❌ Error generating response: {str(response)}")
+                record_error("llm", response)
+                results[index] = response
+                continue
+            results[index] = response.text()
+            record_token_usage(response.usage_metadata)
+            entries.append((user_queries[index], prepared[index].query_vector, response.text()))
+        if corpus_version is not None:
+            answer_cache_service.store_batch(
+                vector_store.client, vector_store.collection_name, entries, user_id, corpus_version
+            )
+        return cast(list[str | Exception], results)
+
+    def _cache_scope(self, corpus_version: str | None, conversation: str | None) -> str | None:
+        """Returns the corpus version to cache answers under, or None to skip the answer cache."""
+        if not self.retrieval_settings.ANSWER_CACHE_ENABLED or conversation:
+            return None
+        return corpus_version
+
+    def _prepare(
+        self,
+        user_queries: list[str],
+        vector_store,
+        user_id: UUID,
+        document_ids: list[UUID] | None,
+        corpus_version: str | None,
+        use_cache: bool,
+        timer: StageTimer | None = None,
+    ) -> list[_Prepared]:
+        """Runs every stage before the LLM call for `user_queries`.
+
+        Each stage handles all the queries at once: one embedding call, one
+        answer cache request, one Qdrant search and one neighbour lookup.
+        Queries answered from the cache, looked up when `corpus_version` is
+        given and `use_cache` is set, are not retrieved. The stages are
+        recorded in `timer` when one is given.
+        """
+        settings = self.retrieval_settings
+        with _stage(timer, "embed"):
+            query_vectors = embed_queries(vector_store.embeddings, user_queries)
+        prepared = [_Prepared(query_vector=query_vector) for query_vector in query_vectors]
+        if corpus_version is not None and use_cache:
+            with _stage(timer, "answer_cache"):
+                cached_answers = answer_cache_service.lookup_batch(
+                    vector_store.client,
+                    vector_store.collection_name,
+                    query_vectors,
+                    user_id,
+                    corpus_version,
+                )
+            for item, cached_answer in zip(prepared, cached_answers):
+                item.cached_answer = cached_answer
+        pending = [index for index, item in enumerate(prepared) if item.cached_answer is None]
+        if not pending:
+            return prepared
+
+        k = settings.RETRIEVAL_K
+        rerank = settings.RERANK_ENABLED
+        with _stage(timer, "retrieve"):
+            retrieved = self.vector_service.retrieve_documents_batch(
+                [user_queries[index] for index in pending],
+                [query_vectors[index] for index in pending],
+                vector_store,
+                user_id,
+                document_ids,
+                k=max(k, settings.RERANK_CANDIDATES) if rerank else k,
+            )
+        if rerank:
+            with _stage(timer, "rerank"):
+                retrieved = [
+                    rerank_service.rerank(user_queries[index], documents, k)
+                    for index, documents in zip(pending, retrieved)
+                ]
+        with _stage(timer, "neighbours"):
+            retrieved = self.vector_service.expand_neighbours(retrieved, vector_store)
+        with _stage(timer, "context"):
+            for index, documents in zip(pending, retrieved):
+                prepared[index].context = context_service.build(query_vectors[index], documents)
+        return prepared
+
+    def format_conversation(self, summary: str | None, messages: list[Message]) -> str:
+        """Renders the summary of the older turns followed by the recent messages."""
+        lines: list[str] = []
+        if summary:
+            lines.append(f"Resumen de la conversación anterior: {summary}")
+        lines.extend(
+            f"{'Usuario' if message.from_user else 'Asistente'}: {message.content}"
+            for message in messages
+        )
+        return "\n".join(lines)
+
+    def summarize_conversation(self, summary: str | None, messages: list[Message]) -> str:
+        """Folds `messages` into the rolling `summary`, so its size stays bounded."""
+        prompt = f"""
+        Actualiza el resumen de una conversación con los mensajes nuevos. Conserva
+        los datos, nombres y preguntas que puedan ser necesarios más adelante, en
+        un máximo de {self.retrieval_settings.CHAT_SUMMARY_MAX_WORDS} palabras.
+
+        Resumen actual: {summary or "(vacío)"}
+
+        Mensajes nuevos:
+        {self.format_conversation(None, messages)}
+
+        Resumen actualizado:
+        """
+        response = self.llm.invoke(prompt)
+        record_token_usage(response.usage_metadata)
+        return response.text().strip()
+
+    def _done_event(
+        self,
+        answer: str,
+        usage: UsageMetadata | None,
+        timer: StageTimer,
+        cached: bool = False,
+    ) -> dict[str, Any]:
+        return {
+            "answer": answer,
+            "cached": cached,
+            "usage": dict(usage) if usage else None,
+            "timings": {name: duration * 1000 for name, duration in timer.durations.items()},
+        }
+
+    def _build_prompt(
+        self, user_query: str, context: str, conversation: str | None = None
+    ) -> str:
+        history = f"Conversación hasta ahora:\n{conversation}\n" if conversation else ""
+        return f"""
+        Usa esta información de referencia para responder la pregunta. Cita los
+        fragmentos que uses con su número entre corchetes, por ejemplo [1].
+
+        {context}
+
+        {history}
+        Pregunta: {user_query}
+
+        Respuesta:
+        """
+
 
 service = LLMService()
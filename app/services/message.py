@@ -2,7 +2,7 @@ from typing import final
 from uuid import UUID
 import uuid
 
-from sqlalchemy import select
+from sqlalchemy import select, tuple_
 from sqlalchemy.orm import Session
 
 
@@ -37,6 +37,26 @@ class MessageService:
             )
         return message
 
+    def get_messages_after(
+        self, db: Session, chat_id: UUID, after_id: UUID | None
+    ) -> list[Message]:
+        """Returns the chat's messages after the message `after_id` (all when None), oldest first.
+
+        Messages stored before they had a creation time all share the time the
+        column was added, so the id breaks ties and the order is always total.
+        """
+        statement = (
+            select(Message)
+            .filter_by(chat_id=chat_id)
+            .order_by(Message.created_at, Message.id)
+        )
+        after = db.get(Message, after_id) if after_id is not None else None
+        if after is not None:
+            statement = statement.where(
+                tuple_(Message.created_at, Message.id) > tuple_(after.created_at, after.id)
+            )
+        return list(db.execute(statement).scalars())
+
     def create_message(
         self, db: Session, create_message: CreateMessage, chat_id: UUID
     ) -> Message:
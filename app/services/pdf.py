@@ -0,0 +1,102 @@
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+import multiprocessing
+import threading
+from typing import final
+
+import pymupdf
+
+from app.core.config import IngestionSettings, get_ingestion_settings
+from app.core.logger import get_logger
+
+logger = get_logger(__name__)
+
+PdfSource = str | bytes
+
+
+def _open_pdf(source: PdfSource) -> pymupdf.Document:
+    if isinstance(source, str):
+        return pymupdf.open(source)
+    return pymupdf.open(stream=source, filetype="pdf")
+
+
+def _extract_page_range(source: PdfSource, start: int, stop: int) -> list[str]:
+    # Runs inside the pool workers, so it has to stay a module level function
+    with _open_pdf(source) as pdf:
+        return [pdf[number].get_text().strip() for number in range(start, stop)]
+
+
+@final
+class PdfService:
+
+    ingestion_settings: IngestionSettings
+
+    def __init__(self, ingestion_settings: IngestionSettings) -> None:
+        self.ingestion_settings = ingestion_settings
+        self._executor: ProcessPoolExecutor | None = None
+        self._executor_lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._executor_lock:
+            if self._executor is None:
+                # Spawned workers do not inherit the parent's DB connections or threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.ingestion_settings.PDF_PARSE_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                logger.info(
+                    f"🧮 Started PDF parse pool with {self.ingestion_settings.PDF_PARSE_WORKERS} processes"
+                )
+            return self._executor
+
+    def open(self, source: PdfSource) -> pymupdf.Document:
+        return _open_pdf(source)
+
+    def extract_page_texts(self, source: PdfSource, page_count: int) -> list[str]:
+        """Returns the text of every page, in page order."""
+        return list(self.iter_page_texts(source, page_count))
+
+    def iter_page_texts(self, source: PdfSource, page_count: int) -> Iterator[str]:
+        """Yields the text of every page, in page order, as soon as it is extracted.
+
+        Documents with at least PDF_PARALLEL_MIN_PAGES pages are split into
+        ranges of PDF_PAGES_PER_TASK pages and extracted in the process pool,
+        with at most twice PDF_PARSE_WORKERS ranges extracted ahead of the
+        consumer. `source` should be a file path whenever possible, since raw
+        bytes are pickled into every task.
+        """
+        settings = self.ingestion_settings
+        if settings.PDF_PARSE_WORKERS <= 1 or page_count < settings.PDF_PARALLEL_MIN_PAGES:
+            with _open_pdf(source) as pdf:
+                for number in range(page_count):
+                    yield pdf[number].get_text().strip()
+            return
+
+        step = settings.PDF_PAGES_PER_TASK
+        executor = self._get_executor()
+        pending: deque[Future[list[str]]] = deque()
+        try:
+            for start in range(0, page_count, step):
+                if len(pending) >= 2 * settings.PDF_PARSE_WORKERS:
+                    yield from pending.popleft().result()
+                pending.append(
+                    executor.submit(
+                        _extract_page_range, source, start, min(start + step, page_count)
+                    )
+                )
+            # Futures are consumed in submission order, which keeps the pages ordered
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                _ = future.cancel()
+
+    def shutdown(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown()
+                self._executor = None
+
+
+service = PdfService(ingestion_settings=get_ingestion_settings())
@@ -0,0 +1,151 @@
+import asyncio
+from collections import OrderedDict
+import threading
+import time
+from typing import final
+import unicodedata
+
+from langchain_core.embeddings import Embeddings
+
+from app.core.config import EmbeddingSettings, get_embedding_settings
+from app.core.logger import get_logger
+from app.core.metrics import QUERY_EMBEDDING_CACHE_LOOKUPS, QUERY_EMBEDDING_CACHE_SAVED_SECONDS
+from app.services.embedding_cache import EmbeddingCacheService, content_hash, embed_queries
+from app.services.embedding_cache import service as embedding_cache_service
+
+logger = get_logger(__name__)
+
+
+def normalize_query(text: str) -> str:
+    # Queries differing only in case, spacing or unicode form share an entry
+    return " ".join(unicodedata.normalize("NFKC", text).lower().split())
+
+
+def _shared_model(model: str) -> str:
+    # Query and document embeddings may differ for the same text, so
+    # shared query entries live under their own model name
+    return f"{model}#query"
+
+
+@final
+class QueryEmbeddingCache:
+    """In-process LRU cache of query embeddings with a TTL.
+
+    With QUERY_CACHE_SHARED, local misses are looked up in the persistent
+    embedding cache table, so workers share each other's query embeddings.
+    """
+
+    embedding_settings: EmbeddingSettings
+
+    def __init__(
+        self, embedding_settings: EmbeddingSettings, shared_cache: EmbeddingCacheService
+    ) -> None:
+        self.embedding_settings = embedding_settings
+        self.shared_cache = shared_cache
+        self._entries: OrderedDict[tuple[str, str], tuple[float, list[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+        # Per process, only to estimate the time saved by a hit
+        self._misses = 0
+        self._miss_seconds = 0.0
+
+    def embed_query(self, embeddings: Embeddings, model: str, text: str) -> list[float]:
+        return self.embed_queries(embeddings, model, [text])[0]
+
+    def embed_queries(
+        self, embeddings: Embeddings, model: str, texts: list[str]
+    ) -> list[list[float]]:
+        """Returns the embedding of every text, embedding all the misses in a single call."""
+        queries = [normalize_query(text) for text in texts]
+        now = time.monotonic()
+        vectors = self._lookup_local(model, queries, now)
+        missing = list(dict.fromkeys(query for query in queries if query not in vectors))
+        if not missing:
+            return [vectors[query] for query in queries]
+
+        shared = self._lookup_shared(model, missing)
+        to_embed = [query for query in missing if query not in shared]
+        start = time.perf_counter()
+        computed = dict(zip(to_embed, embed_queries(embeddings, to_embed) if to_embed else []))
+        self._remember(model, shared, computed, time.perf_counter() - start, now)
+        vectors.update(shared)
+        vectors.update(computed)
+        return [vectors[query] for query in queries]
+
+    async def aembed_query(self, embeddings: Embeddings, model: str, text: str) -> list[float]:
+        """Async `embed_query`: only a miss of both tiers awaits the embedding backend."""
+        query = normalize_query(text)
+        now = time.monotonic()
+        vector = self._lookup_local(model, [query], now).get(query)
+        if vector is not None:
+            return vector
+
+        shared = await asyncio.to_thread(self._lookup_shared, model, [query])
+        computed: dict[str, list[float]] = {}
+        start = time.perf_counter()
+        if query not in shared:
+            computed[query] = await embeddings.aembed_query(query)
+        elapsed = time.perf_counter() - start
+        await asyncio.to_thread(self._remember, model, shared, computed, elapsed, now)
+        return shared.get(query) or computed[query]
+
+    def _lookup_local(
+        self, model: str, queries: list[str], now: float
+    ) -> dict[str, list[float]]:
+        vectors: dict[str, list[float]] = {}
+        with self._lock:
+            for query in queries:
+                entry = self._entries.get((model, query))
+                if entry and entry[0] > now and query not in vectors:
+                    self._entries.move_to_end((model, query))
+                    vectors[query] = entry[1]
+            saved_seconds = len(vectors) * self._average_miss_seconds()
+        QUERY_EMBEDDING_CACHE_LOOKUPS.labels(result="hit").inc(len(vectors))
+        QUERY_EMBEDDING_CACHE_SAVED_SECONDS.inc(saved_seconds)
+        return vectors
+
+    def _lookup_shared(self, model: str, queries: list[str]) -> dict[str, list[float]]:
+        if not self.embedding_settings.QUERY_CACHE_SHARED:
+            return {}
+        found = self.shared_cache.lookup(
+            _shared_model(model), {content_hash(query) for query in queries}
+        )
+        return {
+            query: found[content_hash(query)]
+            for query in queries
+            if content_hash(query) in found
+        }
+
+    def _remember(
+        self,
+        model: str,
+        shared: dict[str, list[float]],
+        computed: dict[str, list[float]],
+        elapsed: float,
+        now: float,
+    ) -> None:
+        settings = self.embedding_settings
+        if computed and settings.QUERY_CACHE_SHARED:
+            self.shared_cache.store(
+                _shared_model(model),
+                {content_hash(query): vector for query, vector in computed.items()},
+            )
+        with self._lock:
+            saved_seconds = len(shared) * self._average_miss_seconds()
+            self._misses += len(computed)
+            self._miss_seconds += elapsed
+            for query, vector in (shared | computed).items():
+                self._entries[(model, query)] = (now + settings.QUERY_CACHE_TTL_SECONDS, vector)
+                self._entries.move_to_end((model, query))
+            while len(self._entries) > settings.QUERY_CACHE_MAX_ENTRIES:
+                _ = self._entries.popitem(last=False)
+        QUERY_EMBEDDING_CACHE_LOOKUPS.labels(result="shared_hit").inc(len(shared))
+        QUERY_EMBEDDING_CACHE_LOOKUPS.labels(result="miss").inc(len(computed))
+        QUERY_EMBEDDING_CACHE_SAVED_SECONDS.inc(saved_seconds)
+
+    def _average_miss_seconds(self) -> float:
+        return self._miss_seconds / self._misses if self._misses else 0.0
+
+
+service = QueryEmbeddingCache(
+    embedding_settings=get_embedding_settings(), shared_cache=embedding_cache_service
+)
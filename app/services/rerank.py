@@ -0,0 +1,111 @@
+import threading
+import time
+from typing import TYPE_CHECKING, final
+
+from langchain_core.documents.base import Document as LangChainDocument
+
+from app.core.config import (
+    EmbeddingSettings,
+    RetrievalSettings,
+    get_embedding_settings,
+    get_retrieval_settings,
+)
+from app.core.logger import get_logger
+
+if TYPE_CHECKING:
+    from fastembed.rerank.cross_encoder import TextCrossEncoder
+
+logger = get_logger(__name__)
+
+
+@final
+class RerankService:
+    """Reorders retrieved chunks with a cross-encoder run in-process with ONNX Runtime.
+
+    Pairs are scored in batches of RERANK_BATCH_SIZE. The measured cost per
+    pair decides how many candidates fit in RERANK_LATENCY_BUDGET_SECONDS, and
+    reranking is abandoned for the retrieval order if the budget runs out.
+    """
+
+    retrieval_settings: RetrievalSettings
+    embedding_settings: EmbeddingSettings
+
+    def __init__(
+        self, retrieval_settings: RetrievalSettings, embedding_settings: EmbeddingSettings
+    ) -> None:
+        self.retrieval_settings = retrieval_settings
+        self.embedding_settings = embedding_settings
+        self._model: "TextCrossEncoder | None" = None
+        self._model_lock = threading.Lock()
+        self._seconds_per_pair: float | None = None
+
+    def _get_model(self) -> "TextCrossEncoder":
+        with self._model_lock:
+            if self._model is None:
+                from fastembed.rerank.cross_encoder import TextCrossEncoder
+
+                logger.info(f"🧠 Loading rerank model {self.retrieval_settings.RERANK_MODEL}")
+                self._model = TextCrossEncoder(
+                    model_name=self.retrieval_settings.RERANK_MODEL,
+                    threads=self.embedding_settings.FASTEMBED_THREADS,
+                    cache_dir=self.embedding_settings.FASTEMBED_CACHE_DIR,
+                )
+            return self._model
+
+    def rerank(
+        self, query: str, documents: list[LangChainDocument], k: int
+    ) -> list[LangChainDocument]:
+        """Returns the `k` documents the cross-encoder scores highest.
+
+        `documents` must be in retrieval order, which is kept for the
+        candidates that do not fit in the latency budget.
+        """
+        settings = self.retrieval_settings
+        if len(documents) <= 1:
+            return documents[:k]
+        model = self._get_model()
+        budget = settings.RERANK_LATENCY_BUDGET_SECONDS
+        candidates = documents
+        if self._seconds_per_pair:
+            affordable = int(budget / self._seconds_per_pair)
+            if affordable < min(k, len(documents)):
+                logger.warning("⏱️ Rerank skipped, not even k candidates fit in the latency budget")
+                return documents[:k]
+            candidates = documents[:affordable]
+
+        start = time.perf_counter()
+        scores: list[float] = []
+        for batch_start in range(0, len(candidates), settings.RERANK_BATCH_SIZE):
+            batch = candidates[batch_start : batch_start + settings.RERANK_BATCH_SIZE]
+            scores.extend(
+                model.rerank(
+                    query,
+                    [document.page_content for document in batch],
+                    batch_size=settings.RERANK_BATCH_SIZE,
+                )
+            )
+            if time.perf_counter() - start > budget and len(scores) < len(candidates):
+                self._record_cost(time.perf_counter() - start, len(scores))
+                logger.warning(
+                    f"⏱️ Rerank exceeded its latency budget after {len(scores)} candidates, "
+                    "keeping the retrieval order"
+                )
+                return documents[:k]
+        self._record_cost(time.perf_counter() - start, len(scores))
+
+        ranked = sorted(zip(scores, range(len(candidates))), key=lambda pair: -pair[0])
+        return [candidates[index] for _, index in ranked[:k]]
+
+    def _record_cost(self, elapsed: float, pairs: int) -> None:
+        if not pairs:
+            return
+        cost = elapsed / pairs
+        # Smoothed, so a single slow call does not disable reranking for long
+        self._seconds_per_pair = (
+            cost if self._seconds_per_pair is None else 0.8 * self._seconds_per_pair + 0.2 * cost
+        )
+
+
+service = RerankService(
+    retrieval_settings=get_retrieval_settings(), embedding_settings=get_embedding_settings()
+)
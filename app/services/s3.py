@@ -1,37 +1,152 @@
-from io import BytesIO
-from typing import final
+# pyright: reportPrivateUsage=false
+from collections.abc import Generator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+import tempfile
+import threading
+from typing import BinaryIO, final
 from uuid import UUID
 
 from minio import Minio
+from minio.datatypes import Part
 
 from app.core.config import S3Settings
+from app.core.logger import get_logger
 
-DEFAULT_FILE_PART_SIZE = 10 * 1024 * 1024
+logger = get_logger(__name__)
 
 
 @final
 class S3Service:
-    def load_document_into_s3(self, bytes, user_id, filename, content_type, s3_client, s3_settings):
+    def load_document_into_s3(
+        self,
+        data: BinaryIO,
+        length: int,
+        user_id: UUID,
+        filename: str,
+        content_type: str | None,
+        s3_client: Minio,
+        s3_settings: S3Settings,
+    ) -> str:
+        """Streams `data` into the document bucket without buffering it whole.
+
+        Peak memory is bounded by S3_PART_SIZE * S3_PARALLEL_UPLOADS regardless
+        of the file size; `length` may be -1 when the size is unknown.
+        """
+        object_name = f"{user_id}/{filename}"
+        part_size = s3_settings.S3_PART_SIZE
         try:
             print(f"🗂️ Uploading to bucket: {s3_settings.S3_DOCUMENT_BUCKET}")
-            print(f"📁 Object name: {user_id}/{filename}")
+            print(f"📁 Object name: {object_name}")
             print(f"📄 Content type: {content_type}")
-            
-            result = s3_client.put_object(
-                bucket_name=s3_settings.S3_DOCUMENT_BUCKET,
-                object_name=f"{user_id}/{filename}",
-                data=bytes,
-                content_type=content_type or "",
-                length=-1,
-                part_size=DEFAULT_FILE_PART_SIZE,
-            )
-            print(f"✅ Upload successful: {result.object_name}")
-            return result.object_name
-            
+
+            if s3_settings.S3_PARALLEL_UPLOADS > 1 and (length < 0 or length > part_size):
+                self._parallel_multipart_upload(
+                    data, object_name, content_type, s3_client, s3_settings
+                )
+            else:
+                _ = s3_client.put_object(
+                    bucket_name=s3_settings.S3_DOCUMENT_BUCKET,
+                    object_name=object_name,
+                    data=data,
+                    content_type=content_type or "",
+                    length=length,
+                    part_size=part_size,
+                    num_parallel_uploads=1,
+                )
+            print(f"✅ Upload successful: {object_name}")
+            return object_name
+
         except Exception as e:
             print(f"❌ GCS Upload error: {str(e)}")
             raise
 
+    def _parallel_multipart_upload(
+        self,
+        data: BinaryIO,
+        object_name: str,
+        content_type: str | None,
+        s3_client: Minio,
+        s3_settings: S3Settings,
+    ) -> None:
+        # Minio's own parallel put_object queues every part it reads, so a fast
+        # reader can still buffer the whole file. The semaphore caps the number
+        # of parts held in memory at S3_PARALLEL_UPLOADS.
+        bucket_name = s3_settings.S3_DOCUMENT_BUCKET
+        upload_id = s3_client._create_multipart_upload(
+            bucket_name,
+            object_name,
+            {"Content-Type": content_type or "application/octet-stream"},
+        )
+        in_flight = threading.BoundedSemaphore(s3_settings.S3_PARALLEL_UPLOADS)
+        futures: list[tuple[int, Future[str]]] = []
+        try:
+            with ThreadPoolExecutor(
+                max_workers=s3_settings.S3_PARALLEL_UPLOADS
+            ) as executor:
+                part_number = 1
+                while True:
+                    _ = in_flight.acquire()
+                    part_data = self._read_part(data, s3_settings.S3_PART_SIZE)
+                    if not part_data and part_number > 1:
+                        in_flight.release()
+                        break
+                    future = executor.submit(
+                        s3_client._upload_part,
+                        bucket_name,
+                        object_name,
+                        part_data,
+                        None,
+                        upload_id,
+                        part_number,
+                    )
+                    future.add_done_callback(lambda _: in_flight.release())
+                    futures.append((part_number, future))
+                    if len(part_data) < s3_settings.S3_PART_SIZE:
+                        break
+                    part_number += 1
+                parts = [Part(number, future.result()) for number, future in futures]
+            _ = s3_client._complete_multipart_upload(
+                bucket_name, object_name, upload_id, parts
+            )
+        except Exception:
+            s3_client._abort_multipart_upload(bucket_name, object_name, upload_id)
+            raise
+
+    def _read_part(self, data: BinaryIO, part_size: int) -> bytes:
+        # Every part but the last must be exactly part_size, while stream
+        # reads may legitimately return less than requested.
+        buffer = bytearray()
+        while len(buffer) < part_size:
+            read = data.read(part_size - len(buffer))
+            if not read:
+                break
+            buffer.extend(read)
+        return bytes(buffer)
+
+    @contextmanager
+    def download_document_from_s3(
+        self,
+        object_name: str,
+        s3_client: Minio,
+        s3_settings: S3Settings,
+        suffix: str = "",
+    ) -> Generator[BinaryIO, None, None]:
+        """Spools an object to a temporary file on disk, removed on exit."""
+        response = s3_client.get_object(
+            bucket_name=s3_settings.S3_DOCUMENT_BUCKET, object_name=object_name
+        )
+        with tempfile.NamedTemporaryFile(suffix=suffix) as spool:
+            try:
+                for data in response.stream(s3_settings.S3_PART_SIZE):
+                    _ = spool.write(data)
+            finally:
+                response.close()
+                response.release_conn()
+            spool.flush()
+            _ = spool.seek(0)
+            yield spool
+
     def delete_document_from_s3(
         self, object_name: str, s3_client: Minio, s3_settings: S3Settings
     ) -> None:
@@ -0,0 +1,175 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable, Hashable
+from dataclasses import dataclass, field
+from typing import Any, TypeVar, final
+from uuid import UUID
+
+from app.core.config import RetrievalSettings, get_retrieval_settings
+from app.core.logger import get_logger
+from app.core.metrics import SINGLE_FLIGHT_REQUESTS
+from app.core.timing import StageTimer
+from app.services.query_embedding_cache import normalize_query
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class _Call:
+    task: "asyncio.Future[Any]"
+    waiters: int = 0
+
+
+@dataclass
+class _Stream:
+    events: list[tuple[str, Any]] = field(default_factory=list)
+    error: BaseException | None = None
+    finished: bool = False
+    subscribers: int = 0
+    # Replaced on every new event, so each subscriber waits on a fresh one
+    changed: asyncio.Event = field(default_factory=asyncio.Event)
+    task: "asyncio.Future[None] | None" = None
+
+    def notify(self) -> None:
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+@final
+class SingleFlightService:
+    """Coalesces identical concurrent generations into a single computation.
+
+    Requests are keyed by the normalized query and the corpus scope (user,
+    searched documents and corpus version). The first request of a key runs
+    the computation in its own task, and requests arriving while it is in
+    flight await the same result, or replay the events streamed so far and
+    follow the rest of the stream. The computation is only cancelled once
+    every request waiting on it is gone. Coalescing is per process.
+    """
+
+    retrieval_settings: RetrievalSettings
+
+    def __init__(self, retrieval_settings: RetrievalSettings) -> None:
+        self.retrieval_settings = retrieval_settings
+        self._calls: dict[Hashable, _Call] = {}
+        self._streams: dict[Hashable, _Stream] = {}
+
+    def key(
+        self,
+        user_query: str,
+        user_id: UUID,
+        document_ids: list[UUID] | None,
+        corpus_version: str | None,
+        use_cache: bool,
+    ) -> Hashable:
+        # A request skipping the answer cache must not get an answer from it
+        return (
+            normalize_query(user_query),
+            user_id,
+            frozenset(document_ids) if document_ids else None,
+            corpus_version,
+            use_cache,
+        )
+
+    async def run(
+        self,
+        key: Hashable,
+        factory: Callable[[], Awaitable[T]],
+        timer: StageTimer | None = None,
+    ) -> T:
+        """Awaits the in-flight computation of `key`, starting it with `factory` if there is none.
+
+        The stages are only recorded in the `timer` of the request that
+        started the computation; the others record their wait as "coalesced".
+        """
+        if not self.retrieval_settings.SINGLE_FLIGHT_ENABLED:
+            return await factory()
+
+        call = self._calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = _Call(task=asyncio.ensure_future(factory()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(self._calls, key, call))
+        self._count("generate", shared)
+
+        call.waiters += 1
+        try:
+            if not shared or timer is None:
+                return await asyncio.shield(call.task)
+            with timer.stage("coalesced"):
+                return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                # Nobody waits for the result anymore, so later requests start over
+                self._forget(self._calls, key, call)
+                _ = call.task.cancel()
+
+    async def stream(
+        self, key: Hashable, factory: Callable[[], AsyncIterator[tuple[str, Any]]]
+    ) -> AsyncIterator[tuple[str, Any]]:
+        """Yields the events of the in-flight stream of `key`, starting it with `factory` if there is none.
+
+        Every subscriber gets all the events from the first one, and the same
+        event objects, so they must not be modified.
+        """
+        if not self.retrieval_settings.SINGLE_FLIGHT_ENABLED:
+            async for event in factory():
+                yield event
+            return
+
+        stream = self._streams.get(key)
+        shared = stream is not None
+        if stream is None:
+            stream = _Stream()
+            self._streams[key] = stream
+            stream.task = asyncio.ensure_future(self._produce(key, stream, factory()))
+        self._count("stream", shared)
+
+        stream.subscribers += 1
+        try:
+            index = 0
+            while True:
+                while index < len(stream.events):
+                    yield stream.events[index]
+                    index += 1
+                if stream.finished:
+                    break
+                await stream.changed.wait()
+            if stream.error is not None:
+                raise stream.error
+        finally:
+            stream.subscribers -= 1
+            if stream.subscribers == 0 and not stream.finished and stream.task is not None:
+                self._forget(self._streams, key, stream)
+                _ = stream.task.cancel()
+
+    async def _produce(
+        self, key: Hashable, stream: _Stream, events: AsyncIterator[tuple[str, Any]]
+    ) -> None:
+        try:
+            async for event in events:
+                stream.events.append(event)
+                stream.notify()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stream.error = e
+        finally:
+            stream.finished = True
+            self._forget(self._streams, key, stream)
+            stream.notify()
+
+    def _forget(self, flights: dict[Hashable, Any], key: Hashable, flight: object) -> None:
+        if flights.get(key) is flight:
+            del flights[key]
+
+    def _count(self, kind: str, shared: bool) -> None:
+        SINGLE_FLIGHT_REQUESTS.labels(kind=kind, result="collapsed" if shared else "started").inc()
+        if shared:
+            logger.debug(f"🔗 Coalesced a {kind} request with an identical one in flight")
+
+
+service = SingleFlightService(retrieval_settings=get_retrieval_settings())
@@ -1,26 +1,40 @@
-from collections.abc import Generator
-from contextlib import contextmanager
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
+from datetime import datetime
 import enum
-from io import BytesIO
-import tempfile
-from typing import Callable, Sequence, cast, final
+import json
+import os
+import time
+from typing import Any, BinaryIO, cast, final
 from uuid import UUID
 import uuid
 
-from langchain_community.document_loaders import (
-    Docx2txtLoader,
-    PyMuPDFLoader,
-    TextLoader,
-)
-from langchain_qdrant.qdrant import QdrantVectorStore
+import docx2txt
+import pymupdf
+from langchain_qdrant.qdrant import QdrantVectorStore, RetrievalMode
 from langchain_text_splitters import RecursiveCharacterTextSplitter
+from qdrant_client.http import models
 
 from langchain_core.documents.base import Document as LangChainDocument
 
+from app.core.config import RetrievalSettings, get_retrieval_settings
 from app.core.logger import get_logger
+from app.core.metrics import INGESTION_STAGE_SECONDS
+from app.db.database import SessionLocal
+from app.models.chunk import Chunk
+from app.schemas.chunk import CreateChunk
+from app.services.chunk import service as chunk_service
+from app.services.embedding_cache import content_hash
+from app.services.embedding import service as embedding_service
+from app.services.pdf import service as pdf_service
 
 logger = get_logger(__name__)
 
+# Chunk metadata is stored under the "metadata" payload key by LangChain
+USER_ID_PAYLOAD_KEY = "metadata.user_id"
+DOCUMENT_ID_PAYLOAD_KEY = "metadata.document_id"
+SPARSE_VECTOR_NAME = "bm25"
+
 
 @final
 class FileExtension(enum.Enum):
@@ -33,28 +47,11 @@ class FileExtension(enum.Enum):
 @final
 class VectorService:
 
-    def __init__(self) -> None:
-        self._handlers: dict[str, Callable[[BytesIO, str], list[LangChainDocument]]] = {
-            FileExtension.PDF.value: self._load_pdf,
-            FileExtension.DOCX.value: self._load_docx,
-            FileExtension.MD.value: self._load_text,
-            FileExtension.TXT.value: self._load_text,
-        }
-
-    def load_document_into_vector_database(
-        self, document: BytesIO, file_extension: str, vector_store: QdrantVectorStore
-    ) -> list[str]:
-        _ = document.seek(0)
-        handler = self._handlers[file_extension]
-
-        lc_documents: list[LangChainDocument]
-        lc_documents = (
-            handler(document, file_extension)
-            if file_extension in {".md", ".txt"}
-            else handler(document, "")
-        )
+    retrieval_settings: RetrievalSettings
 
-        text_splitter = RecursiveCharacterTextSplitter(
+    def __init__(self, retrieval_settings: RetrievalSettings) -> None:
+        self.retrieval_settings = retrieval_settings
+        self._text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=512,  
             chunk_overlap=50,  
             length_function=len,
@@ -66,45 +63,502 @@ class VectorService:
                 ".",
                 ",",
             ],
+            add_start_index=True,
         )
-        chunks = text_splitter.split_documents(lc_documents)
-        uuids = [str(uuid.uuid4()) for _ in range(len(chunks))]
+        self._handlers: dict[str, Callable[[BinaryIO, str], Iterator[LangChainDocument]]] = {
+            FileExtension.PDF.value: self._load_pdf,
+            FileExtension.DOCX.value: self._load_docx,
+            FileExtension.MD.value: self._load_text,
+            FileExtension.TXT.value: self._load_text,
+        }
+
+    def iter_chunks(
+        self,
+        document: BinaryIO,
+        file_extension: str,
+        document_id: UUID,
+        user_id: UUID,
+        source: str,
+        page_callback: Callable[[int, int], None] | None = None,
+    ) -> Iterator[tuple[CreateChunk, LangChainDocument]]:
+        """Lazily splits a document into chunks with content addressed ids.
 
-        chunk_ids = vector_store.add_documents(documents=chunks, ids=uuids)
-        return chunk_ids
+        Pages are read from the loader one at a time, so memory does not grow
+        with the page count. `page_callback` receives the number of pages read
+        and the total page count.
+
+        Chunk ids are derived from the document id and the chunk text, so an
+        unchanged chunk of a replaced document keeps its id and is neither
+        re-embedded nor re-uploaded, and a retried job overwrites its own
+        points. Every chunk is tagged with its owner and document, which
+        retrieval filters on. Positions (ordinal, page and character span in
+        the text of the pages joined by newlines) are stored in the database;
+        unchanged chunks are not uploaded again when they move, so only their
+        metadata is refreshed (see `refresh_chunk_metadata`).
+        """
+        _ = document.seek(0)
+        handler = self._handlers[file_extension]
+
+        occurrences: Counter[str] = Counter()
+        chunks = self._split_pages(self._timed_pages(handler(document, source)), page_callback)
+        for ordinal, (start, chunk) in enumerate(chunks):
+            chunk_hash = content_hash(chunk.page_content)
+            chunk_id = uuid.uuid5(document_id, f"{chunk_hash}:{occurrences[chunk_hash]}")
+            occurrences[chunk_hash] += 1
+            chunk.metadata["user_id"] = str(user_id)
+            chunk.metadata["document_id"] = str(document_id)
+            created = CreateChunk(
+                id=str(chunk_id),
+                content_hash=chunk_hash,
+                ordinal=ordinal,
+                page=chunk.metadata.get("page"),
+                start=start,
+                end=start + len(chunk.page_content),
+            )
+            yield created, chunk
+
+    def _timed_pages(
+        self, pages: Iterable[LangChainDocument]
+    ) -> Iterator[LangChainDocument]:
+        # Loaders are lazy, so a page is parsed while it is pulled
+        iterator = iter(pages)
+        while True:
+            start = time.perf_counter()
+            try:
+                page = next(iterator)
+            except StopIteration:
+                return
+            INGESTION_STAGE_SECONDS.labels(stage="parse").observe(time.perf_counter() - start)
+            yield page
+
+    def _split_pages(
+        self,
+        pages: Iterable[LangChainDocument],
+        page_callback: Callable[[int, int], None] | None,
+    ) -> Iterator[tuple[int, LangChainDocument]]:
+        # The text after the start of the last chunk is carried over to the next
+        # page, so chunks and their overlap flow across page boundaries. A chunk
+        # keeps the metadata of the page it starts on, and is yielded with its
+        # offset in the whole text.
+        carried = ""
+        consumed = 0
+        carried_pages: list[tuple[int, dict[str, Any]]] = []
+        for page_number, page in enumerate(pages, start=1):
+            # Empty pages are joined too, so offsets match the joined text
+            if page_number > 1:
+                carried += "\n"
+            carried_pages.append((len(carried), page.metadata))
+            carried += page.page_content
+            if page_callback:
+                page_callback(page_number, page.metadata.get("total_pages", 1))
+
+            with INGESTION_STAGE_SECONDS.labels(stage="split").time():
+                chunks = self._text_splitter.split_text(carried)
+            if len(chunks) < 2:
+                continue
+            offset = 0
+            for chunk in chunks[:-1]:
+                offset = carried.find(chunk, offset)
+                yield consumed + offset, self._chunk_document(chunk, offset, carried_pages)
+                offset += 1
+            tail_start = carried.find(chunks[-1], offset)
+            carried = carried[tail_start:]
+            consumed += tail_start
+            carried_pages = [
+                (max(start - tail_start, 0), metadata)
+                for index, (start, metadata) in enumerate(carried_pages)
+                if index + 1 == len(carried_pages) or carried_pages[index + 1][0] > tail_start
+            ]
+        if carried.strip():
+            with INGESTION_STAGE_SECONDS.labels(stage="split").time():
+                chunks = self._text_splitter.split_text(carried)
+            offset = 0
+            for chunk in chunks:
+                offset = carried.find(chunk, offset)
+                yield consumed + offset, self._chunk_document(chunk, offset, carried_pages)
+                offset += 1
+
+    def _chunk_document(
+        self, chunk: str, offset: int, pages: list[tuple[int, dict[str, Any]]]
+    ) -> LangChainDocument:
+        metadata = next(
+            metadata for start, metadata in reversed(pages) if start <= max(offset, 0)
+        )
+        return LangChainDocument(page_content=chunk, metadata=dict(metadata))
+
+    def store_chunks(
+        self,
+        chunks: Iterable[tuple[CreateChunk, LangChainDocument]],
+        vector_store: QdrantVectorStore,
+        progress_callback: Callable[[int], None] | None = None,
+    ) -> list[str]:
+        """Embeds and upserts chunks as they are produced, which may belong to several documents.
+
+        Chunks of different documents share embedding batches, so many small
+        documents cost as many embedding calls as one large document.
+        """
+        return embedding_service.embed_and_upsert(
+            ((created.id, chunk) for created, chunk in chunks),
+            vector_store,
+            progress_callback=progress_callback,
+        )
 
     def drop_chunks_from_document_id(
         self, chunk_ids: list[str], vector_store: QdrantVectorStore
     ):
-        _ = vector_store.delete(ids=cast(list[str | int], chunk_ids))
-
-    @contextmanager
-    def _temp_file(self, document: BytesIO, suffix: str) -> Generator[str, None, None]:
-        with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as tmp:
-            _ = tmp.write(document.read())
-            tmp.flush()
-            _ = document.seek(0)
-            yield tmp.name
-
-    def _load_pdf(self, document: BytesIO, _: str) -> list[LangChainDocument]:
-        with self._temp_file(document, ".pdf") as tmp_name:
-            pdf_loader = PyMuPDFLoader(tmp_name)
-            return pdf_loader.load()
-
-    def _load_docx(self, document: BytesIO, _: str) -> list[LangChainDocument]:
-        with self._temp_file(document, ".docx") as tmp_name:
-            doc_loader = Docx2txtLoader(tmp_name)
-            return doc_loader.load()
-
-    def _load_text(
-        self, document: BytesIO, file_extension: str
+        # Selecting by filter ignores ids that were never stored, which local
+        # mode would otherwise reject
+        _ = vector_store.client.delete(
+            collection_name=vector_store.collection_name,
+            points_selector=models.Filter(
+                must=[models.HasIdCondition(has_id=cast(list[models.ExtendedPointId], chunk_ids))]
+            ),
+        )
+
+    def refresh_chunk_metadata(
+        self, metadata_by_chunk_id: dict[str, dict[str, Any]], vector_store: QdrantVectorStore
+    ) -> None:
+        """Overwrites the stored metadata of already uploaded chunks in a single request.
+
+        Unchanged chunks of a replaced document are not uploaded again, but
+        may now start on another page or come from a renamed file, which the
+        context cites. Chunks with the same metadata are updated together.
+        """
+        groups: dict[str, tuple[dict[str, Any], list[models.ExtendedPointId]]] = {}
+        for chunk_id, metadata in metadata_by_chunk_id.items():
+            key = json.dumps(metadata, sort_keys=True, default=str)
+            groups.setdefault(key, (metadata, []))[1].append(chunk_id)
+        if not groups:
+            return
+        _ = vector_store.client.batch_update_points(
+            collection_name=vector_store.collection_name,
+            update_operations=[
+                # The whole metadata object is replaced: local mode ignores the
+                # nested key of batched operations
+                models.SetPayloadOperation(
+                    set_payload=models.SetPayload(
+                        payload={vector_store.metadata_payload_key: metadata}, points=chunk_ids
+                    )
+                )
+                for metadata, chunk_ids in groups.values()
+            ],
+        )
+
+    def _spool_path(self, document: BinaryIO) -> str | None:
+        # Documents spooled to disk by the ingestion worker can be opened in place
+        spool_path = getattr(document, "name", None)
+        if isinstance(spool_path, str) and os.path.isfile(spool_path):
+            return spool_path
+        return None
+
+    def _pdf_metadata(self, pdf: pymupdf.Document, source: str) -> dict[str, Any]:
+        # Mirrors the metadata emitted by LangChain's PyMuPDFLoader
+        metadata: dict[str, Any] = {
+            "producer": "PyMuPDF",
+            "creator": "PyMuPDF",
+            "creationdate": "",
+            "source": source,
+            "file_path": source,
+            "total_pages": len(pdf),
+        }
+        for key, value in (pdf.metadata or {}).items():
+            if not isinstance(value, (str, int)):
+                continue
+            normalized_key = key.lower()
+            if normalized_key in ("creationdate", "moddate") and isinstance(value, str):
+                try:
+                    metadata[normalized_key] = datetime.strptime(
+                        value.replace("'", ""), "D:%Y%m%d%H%M%S%z"
+                    ).isoformat("T")
+                except ValueError:
+                    metadata[normalized_key] = value
+                metadata[key] = value
+            else:
+                metadata[normalized_key] = value.strip() if isinstance(value, str) else value
+        return metadata
+
+    def _load_pdf(self, document: BinaryIO, source: str) -> Iterator[LangChainDocument]:
+        pdf_source = self._spool_path(document) or document.read()
+        with pdf_service.open(pdf_source) as pdf:
+            metadata = self._pdf_metadata(pdf, source)
+            page_count = len(pdf)
+        page_texts = pdf_service.iter_page_texts(pdf_source, page_count)
+        for page_number, text in enumerate(page_texts):
+            yield LangChainDocument(
+                page_content=text, metadata=metadata | {"page": page_number}
+            )
+
+    def _load_docx(self, document: BinaryIO, source: str) -> Iterator[LangChainDocument]:
+        # A .docx is a zip archive, which docx2txt can read from any file object
+        yield LangChainDocument(
+            page_content=docx2txt.process(document), metadata={"source": source}
+        )
+
+    def _load_text(self, document: BinaryIO, source: str) -> Iterator[LangChainDocument]:
+        raw = document.read()
+        try:
+            text = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            # Legacy Windows encoding, by far the most common non UTF-8 upload
+            text = raw.decode("cp1252", errors="replace")
+        yield LangChainDocument(page_content=text, metadata={"source": source})
+
+    def retrieve_documents(
+        self,
+        user_query: str,
+        vector_store: QdrantVectorStore,
+        user_id: UUID,
+        document_ids: list[UUID] | None = None,
+        query_vector: list[float] | None = None,
+        k: int | None = None,
     ) -> list[LangChainDocument]:
-        with self._temp_file(document, file_extension) as tmp_name:
-            text_loader = TextLoader(tmp_name)
-            return text_loader.load()
+        """Searches only the chunks of `user_id`, restricted to `document_ids` when given.
+
+        `query_vector` avoids embedding `user_query` again when the caller
+        already has its embedding. `k` defaults to RETRIEVAL_K.
+        """
+        k = k or self.retrieval_settings.RETRIEVAL_K
+        request = self._query_request(
+            user_query,
+            query_vector or vector_store.embeddings.embed_query(user_query),
+            vector_store,
+            self.tenant_filter(user_id, document_ids),
+            k,
+        )
+        responses = vector_store.client.query_batch_points(
+            collection_name=vector_store.collection_name, requests=[request]
+        )
+        return [self._document_from_point(point, vector_store) for point in responses[0].points]
+
+    def expand_neighbours(
+        self, documents: list[list[LangChainDocument]], vector_store: QdrantVectorStore
+    ) -> list[list[LangChainDocument]]:
+        """Adds the CONTEXT_NEIGHBOUR_WINDOW chunks before and after every retrieved chunk.
+
+        `documents` holds the chunks retrieved for each query. The neighbours
+        of all of them are looked up in a single database query and fetched
+        from Qdrant in a single request. Each chunk is followed by its
+        neighbours, in document order, and gets its "ordinal" in the metadata.
+        """
+        window = self.retrieval_settings.CONTEXT_NEIGHBOUR_WINDOW
+        hits = [document for retrieved in documents for document in retrieved]
+        if window <= 0 or not hits:
+            return documents
+        with SessionLocal() as db:
+            neighbours = chunk_service.get_neighbour_chunks(
+                db, list({str(document.metadata["_id"]) for document in hits}), window
+            )
+        missing = self._missing_neighbours(hits, neighbours)
+        points = (
+            vector_store.client.retrieve(
+                collection_name=vector_store.collection_name, ids=missing, with_payload=True
+            )
+            if missing
+            else []
+        )
+        return [
+            self._with_neighbours(retrieved, neighbours, points, vector_store)
+            for retrieved in documents
+        ]
+
+    def _missing_neighbours(
+        self, documents: list[LangChainDocument], neighbours: list[tuple[str, Chunk]]
+    ) -> list[models.ExtendedPointId]:
+        retrieved = {str(document.metadata["_id"]) for document in documents}
+        return list(
+            dict.fromkeys(chunk.id for _, chunk in neighbours if chunk.id not in retrieved)
+        )
+
+    def _with_neighbours(
+        self,
+        documents: list[LangChainDocument],
+        neighbours: list[tuple[str, Chunk]],
+        points: list[models.Record],
+        vector_store: QdrantVectorStore,
+    ) -> list[LangChainDocument]:
+        groups: dict[str, list[Chunk]] = {}
+        for chunk_id, chunk in neighbours:
+            groups.setdefault(chunk_id, []).append(chunk)
+        found = {str(document.metadata["_id"]): document for document in documents}
+        found.update(
+            (str(point.id), self._document_from_point(point, vector_store)) for point in points
+        )
+
+        expanded: list[LangChainDocument] = []
+        added: set[str] = set()
+        for document in documents:
+            chunk_id = str(document.metadata["_id"])
+            # Chunks stored before positions were recorded have no neighbours
+            group = groups.get(chunk_id) or []
+            if not group and chunk_id not in added:
+                expanded.append(document)
+                added.add(chunk_id)
+            for chunk in group:
+                neighbour = found.get(chunk.id)
+                if neighbour is None or chunk.id in added:
+                    continue
+                neighbour.metadata["ordinal"] = chunk.ordinal
+                expanded.append(neighbour)
+                added.add(chunk.id)
+        return expanded
+
+    def search_params(self) -> models.SearchParams:
+        # Quantized vectors are oversampled and rescored with the original
+        # vectors; the parameters are ignored by unquantized collections
+        settings = self.retrieval_settings
+        return models.SearchParams(
+            hnsw_ef=settings.QDRANT_HNSW_EF,
+            quantization=models.QuantizationSearchParams(
+                rescore=settings.QDRANT_QUANTIZATION_RESCORE,
+                oversampling=settings.QDRANT_QUANTIZATION_OVERSAMPLING,
+            ),
+        )
+
+    def retrieve_documents_batch(
+        self,
+        user_queries: list[str],
+        query_vectors: list[list[float]],
+        vector_store: QdrantVectorStore,
+        user_id: UUID,
+        document_ids: list[UUID] | None = None,
+        k: int | None = None,
+    ) -> list[list[LangChainDocument]]:
+        """Runs one search per query, all in a single Qdrant request.
+
+        Results are returned in the order of `user_queries`.
+        """
+        if not user_queries:
+            return []
+        k = k or self.retrieval_settings.RETRIEVAL_K
+        tenant_filter = self.tenant_filter(user_id, document_ids)
+        responses = vector_store.client.query_batch_points(
+            collection_name=vector_store.collection_name,
+            requests=[
+                self._query_request(user_query, query_vector, vector_store, tenant_filter, k)
+                for user_query, query_vector in zip(user_queries, query_vectors)
+            ],
+        )
+        return [
+            [self._document_from_point(point, vector_store) for point in response.points]
+            for response in responses
+        ]
+
+    def _query_request(
+        self,
+        user_query: str,
+        query_vector: list[float],
+        vector_store: QdrantVectorStore,
+        query_filter: models.Filter,
+        k: int,
+    ) -> models.QueryRequest:
+        # Vectors are only needed to tell near duplicate chunks apart, see ContextService
+        with_vectors = self.retrieval_settings.CONTEXT_MMR_LAMBDA < 1
+        if vector_store.retrieval_mode == RetrievalMode.HYBRID:
+            # Dense and BM25 candidates are fused with reciprocal rank fusion by
+            # Qdrant itself, so both searches cost a single round trip
+            return models.QueryRequest(
+                prefetch=self._hybrid_prefetch(
+                    user_query, query_vector, vector_store, query_filter, k
+                ),
+                query=models.FusionQuery(fusion=models.Fusion.RRF),
+                limit=k,
+                with_payload=True,
+                with_vector=with_vectors,
+            )
+        return models.QueryRequest(
+            query=query_vector,
+            using=vector_store.vector_name or None,
+            filter=query_filter,
+            params=self.search_params(),
+            limit=k,
+            with_payload=True,
+            with_vector=with_vectors,
+        )
+
+    def _hybrid_prefetch(
+        self,
+        user_query: str,
+        query_vector: list[float],
+        vector_store: QdrantVectorStore,
+        query_filter: models.Filter,
+        k: int,
+    ) -> list[models.Prefetch]:
+        sparse_vector = vector_store.sparse_embeddings.embed_query(user_query)
+        prefetch_limit = max(k, self.retrieval_settings.HYBRID_PREFETCH_LIMIT)
+        return [
+            models.Prefetch(
+                using=vector_store.vector_name,
+                query=query_vector,
+                filter=query_filter,
+                limit=prefetch_limit,
+                params=self.search_params(),
+            ),
+            models.Prefetch(
+                using=vector_store.sparse_vector_name,
+                query=models.SparseVector(
+                    indices=sparse_vector.indices, values=sparse_vector.values
+                ),
+                filter=query_filter,
+                limit=prefetch_limit,
+            ),
+        ]
+
+    def _document_from_point(
+        self, point: models.ScoredPoint | models.Record, vector_store: QdrantVectorStore
+    ) -> LangChainDocument:
+        # Same shape as the documents returned by QdrantVectorStore searches
+        payload = point.payload or {}
+        metadata = dict(payload.get(vector_store.metadata_payload_key) or {})
+        metadata["_id"] = point.id
+        metadata["_collection_name"] = vector_store.collection_name
+        vector = point.vector
+        if isinstance(vector, dict):
+            vector = vector.get(vector_store.vector_name)
+        if isinstance(vector, list):
+            metadata["_vector"] = vector
+        return LangChainDocument(
+            page_content=payload.get(vector_store.content_payload_key, ""),
+            metadata=metadata,
+        )
+
+    def tenant_filter(
+        self, user_id: UUID, document_ids: list[UUID] | None = None
+    ) -> models.Filter:
+        must: list[models.Condition] = [
+            models.FieldCondition(
+                key=USER_ID_PAYLOAD_KEY, match=models.MatchValue(value=str(user_id))
+            )
+        ]
+        if document_ids:
+            must.append(
+                models.FieldCondition(
+                    key=DOCUMENT_ID_PAYLOAD_KEY,
+                    match=models.MatchAny(any=[str(document_id) for document_id in document_ids]),
+                )
+            )
+        return models.Filter(must=must)
+
+    def tag_document_points(
+        self,
+        chunk_ids: list[str],
+        user_id: UUID,
+        document_id: UUID,
+        vector_store: QdrantVectorStore,
+    ) -> None:
+        _ = vector_store.client.set_payload(
+            collection_name=vector_store.collection_name,
+            payload={"user_id": str(user_id), "document_id": str(document_id)},
+            points=cast(list[models.ExtendedPointId], chunk_ids),
+            key=vector_store.metadata_payload_key,
+        )
 
-    def retrieve_documents(self, user_query: str, vector_store: QdrantVectorStore) -> list[LangChainDocument]:
-        results = vector_store.similarity_search(user_query, k=3)  
-        return results
+    def count_untagged_points(self, vector_store: QdrantVectorStore) -> int:
+        return vector_store.client.count(
+            collection_name=vector_store.collection_name,
+            count_filter=models.Filter(
+                must=[models.IsEmptyCondition(is_empty=models.PayloadField(key=USER_ID_PAYLOAD_KEY))]
+            ),
+            exact=False,
+        ).count
 
-service = VectorService()
+service = VectorService(retrieval_settings=get_retrieval_settings())
@@ -0,0 +1,96 @@
+# app/worker.py
+"""Ingestion worker entry point, run with `python -m app.worker`."""
+import signal
+import threading
+
+from app.core.config import get_ingestion_settings, get_s3_settings
+from app.core.logger import get_logger
+from app.core.metrics import record_error, serve_metrics
+from app.db.database import SessionLocal
+from app.dependencies import get_qdrant_vector_store, get_s3_client
+from app.models import import_all_models
+from app.models.ingestion_job import IngestionJob, JobStatus
+from app.services.ingestion import service as ingestion_service
+from app.services.pdf import service as pdf_service
+
+logger = get_logger(__name__)
+
+
+def run_worker() -> None:
+    shutdown = threading.Event()
+
+    def request_shutdown(*_) -> None:
+        logger.info("🛑 Shutdown requested, finishing current job...")
+        shutdown.set()
+
+    _ = signal.signal(signal.SIGTERM, request_shutdown)
+    _ = signal.signal(signal.SIGINT, request_shutdown)
+    # The ingestion metrics are recorded here, not in the API's /metrics
+    metrics_port = get_ingestion_settings().INGESTION_METRICS_PORT
+    if metrics_port is not None:
+        serve_metrics(metrics_port)
+        logger.info(f"📈 Serving ingestion metrics on port {metrics_port}")
+    work(shutdown)
+
+
+def work(shutdown: threading.Event) -> None:
+    """Processes ingestion jobs until `shutdown` is set.
+
+    Runs in the API process itself with INGESTION_INLINE_WORKER, which local
+    mode Qdrant needs since its storage cannot be opened by another process.
+    """
+    import_all_models()
+    ingestion_settings = get_ingestion_settings()
+    s3_settings = get_s3_settings()
+    if s3_settings is None:
+        raise RuntimeError("S3 is disabled, the ingestion worker cannot download documents.")
+
+    s3_client = get_s3_client()
+    vector_store = get_qdrant_vector_store()
+
+    with SessionLocal() as db:
+        ingestion_service.backfill_tenant_payload(db, vector_store)
+
+    logger.info("👷 Ingestion worker started")
+    while not shutdown.is_set():
+        with SessionLocal() as db:
+            job = ingestion_service.claim_next_job(db)
+            if job is None:
+                _ = shutdown.wait(ingestion_settings.INGESTION_POLL_INTERVAL_SECONDS)
+                continue
+
+            jobs = [job]
+            if job.batch_id is not None:
+                jobs += ingestion_service.claim_batch_jobs(db, job.batch_id)
+
+            runnable_jobs: list[IngestionJob] = []
+            for claimed_job in jobs:
+                if claimed_job.attempts > ingestion_settings.INGESTION_MAX_ATTEMPTS:
+                    ingestion_service.fail_job(
+                        db, claimed_job, "Maximum number of attempts exceeded"
+                    )
+                else:
+                    runnable_jobs.append(claimed_job)
+            if not runnable_jobs:
+                continue
+
+            logger.info(
+                f"📥 Processing ingestion jobs {', '.join(str(j.id) for j in runnable_jobs)}"
+            )
+            try:
+                ingestion_service.process_jobs(
+                    db, runnable_jobs, s3_client, s3_settings, vector_store
+                )
+            except Exception as e:
+                logger.exception("❌ Ingestion jobs failed")
+                record_error("ingestion", e)
+                db.rollback()
+                for failed_job in runnable_jobs:
+                    if failed_job.status == JobStatus.RUNNING:
+                        ingestion_service.fail_job(db, failed_job, str(e))
+    pdf_service.shutdown()
+    logger.info("👋 Ingestion worker stopped")
+
+
+if __name__ == "__main__":
+    run_worker()
@@ -0,0 +1,86 @@
+# benchmarks/pdf_parse.py
+"""Compares serial and pooled PDF text extraction on generated documents.
+
+Run from the repository root with the usual environment (.env) available:
+
+    python -m benchmarks.pdf_parse --pages 500 --workers 2 4 8
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import pymupdf
+
+from app.core.config import get_ingestion_settings
+from app.services.pdf import PdfService
+
+WORDS = (
+    "documento capitulo resumen analisis sistema datos modelo consulta "
+    "vector respuesta pregunta informe tabla figura seccion resultado"
+).split()
+
+
+def generate_pdf(path: str, pages: int, seed: int = 0) -> None:
+    rng = random.Random(seed)
+    pdf = pymupdf.open()
+    for _ in range(pages):
+        page = pdf.new_page()
+        text = " ".join(rng.choice(WORDS) for _ in range(600))
+        _ = page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=9)
+    pdf.save(path)
+    pdf.close()
+
+
+def time_parse(service: PdfService, path: str, pages: int, repeats: int) -> list[float]:
+    timings: list[float] = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        texts = service.extract_page_texts(path, pages)
+        timings.append(time.perf_counter() - start)
+        assert len(texts) == pages
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    _ = parser.add_argument("--pages", type=int, nargs="+", default=[100, 500])
+    _ = parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, os.cpu_count() or 1])
+    _ = parser.add_argument("--pages-per-task", type=int, default=32)
+    _ = parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    base_settings = get_ingestion_settings()
+    print(f"{'pages':>6} {'mode':>10} {'median s':>9} {'speedup':>8}")
+    for pages in args.pages:
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+            generate_pdf(tmp.name, pages)
+
+            serial = PdfService(base_settings.model_copy(update={"PDF_PARSE_WORKERS": 1}))
+            serial_median = statistics.median(time_parse(serial, tmp.name, pages, args.repeats))
+            print(f"{pages:>6} {'serial':>10} {serial_median:>9.3f} {1.0:>8.2f}")
+
+            for workers in sorted(set(args.workers)):
+                pooled = PdfService(
+                    base_settings.model_copy(
+                        update={
+                            "PDF_PARSE_WORKERS": workers,
+                            "PDF_PARALLEL_MIN_PAGES": 0,
+                            "PDF_PAGES_PER_TASK": args.pages_per_task,
+                        }
+                    )
+                )
+                # Warm the pool up so process start-up is not part of the measurement
+                _ = pooled.extract_page_texts(tmp.name, pages)
+                pooled_median = statistics.median(time_parse(pooled, tmp.name, pages, args.repeats))
+                pooled.shutdown()
+                print(
+                    f"{pages:>6} {f'{workers} procs':>10} {pooled_median:>9.3f} "
+                    f"{serial_median / pooled_median:>8.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
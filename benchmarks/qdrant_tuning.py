@@ -0,0 +1,187 @@
+# benchmarks/qdrant_tuning.py
+"""Compares recall@k, search latency and memory of Qdrant collection configurations.
+
+Needs a running Qdrant server (local mode ignores HNSW and quantization) and
+the usual environment (.env). Run from the repository root:
+
+    docker run -p 6333:6333 qdrant/qdrant
+    python -m benchmarks.qdrant_tuning --points 200000 --dim 768
+"""
+import argparse
+import re
+import statistics
+import time
+
+import httpx
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+
+from app.core.config import QdrantSettings, get_retrieval_settings
+from app.core.lifespan import hnsw_config, quantization_config
+from app.services.vector import VectorService
+
+# name -> (collection settings, search settings)
+CONFIGURATIONS: dict[str, tuple[dict[str, object], dict[str, object]]] = {
+    "float32": ({}, {}),
+    "float32-ef128": ({}, {"QDRANT_HNSW_EF": 128}),
+    "float32-m32": ({"QDRANT_HNSW_M": 32, "QDRANT_HNSW_EF_CONSTRUCT": 200}, {}),
+    "float32-disk": ({"QDRANT_ON_DISK_VECTORS": True, "QDRANT_ON_DISK_PAYLOAD": True}, {}),
+    "scalar": ({"QDRANT_QUANTIZATION": "scalar", "QDRANT_ON_DISK_VECTORS": True}, {}),
+    "scalar-norescore": (
+        {"QDRANT_QUANTIZATION": "scalar", "QDRANT_ON_DISK_VECTORS": True},
+        {"QDRANT_QUANTIZATION_RESCORE": False},
+    ),
+    "binary": (
+        {"QDRANT_QUANTIZATION": "binary", "QDRANT_ON_DISK_VECTORS": True},
+        {"QDRANT_QUANTIZATION_OVERSAMPLING": 3.0},
+    ),
+}
+
+
+def generate_corpus(
+    points: int, queries: int, dim: int, clusters: int, seed: int = 0
+) -> tuple[np.ndarray, np.ndarray]:
+    # Clustered vectors resemble embeddings far better than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+
+    def sample(count: int) -> np.ndarray:
+        vectors = centers[rng.integers(0, clusters, count)]
+        vectors = vectors + 0.5 * rng.normal(size=(count, dim)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    return sample(points), sample(queries)
+
+
+def exact_neighbours(corpus: np.ndarray, queries: np.ndarray, k: int) -> list[set[int]]:
+    neighbours: list[set[int]] = []
+    for start in range(0, len(queries), 256):
+        scores = queries[start : start + 256] @ corpus.T
+        top = np.argpartition(-scores, k, axis=1)[:, :k]
+        neighbours.extend(set(row.tolist()) for row in top)
+    return neighbours
+
+
+def resident_memory(url: str) -> int | None:
+    try:
+        metrics = httpx.get(f"{url}/metrics", timeout=5).text
+    except httpx.HTTPError:
+        return None
+    match = re.search(r"^memory_resident_bytes (\d+)", metrics, re.MULTILINE)
+    return int(match.group(1)) if match else None
+
+
+def estimated_ram(settings: QdrantSettings, points: int, dim: int) -> int:
+    original = 0 if settings.QDRANT_ON_DISK_VECTORS else points * dim * 4
+    quantized = {"none": 0, "scalar": points * dim, "binary": points * dim // 8}
+    return original + quantized[settings.QDRANT_QUANTIZATION]
+
+
+def wait_until_indexed(client: QdrantClient, collection_name: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        info = client.get_collection(collection_name)
+        if info.status == models.CollectionStatus.GREEN:
+            return
+        time.sleep(1)
+    raise TimeoutError(f"{collection_name} was not indexed within {timeout}s")
+
+
+def run_configuration(
+    client: QdrantClient,
+    url: str,
+    name: str,
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    truth: list[set[int]],
+    k: int,
+    timeout: float,
+) -> None:
+    collection_updates, search_updates = CONFIGURATIONS[name]
+    settings = QdrantSettings(
+        QDRANT_HOST="", QDRANT_PORT=0, QDRANT_COLLECTION_NAME=f"bench_{name}"
+    ).model_copy(update=collection_updates)
+    search_params = VectorService(
+        get_retrieval_settings().model_copy(update=search_updates)
+    ).search_params()
+
+    collection_name = settings.QDRANT_COLLECTION_NAME
+    if client.collection_exists(collection_name):
+        _ = client.delete_collection(collection_name)
+    memory_before = resident_memory(url)
+    _ = client.create_collection(
+        collection_name=collection_name,
+        vectors_config=models.VectorParams(
+            size=corpus.shape[1],
+            distance=models.Distance.COSINE,
+            on_disk=settings.QDRANT_ON_DISK_VECTORS,
+        ),
+        hnsw_config=hnsw_config(settings),
+        quantization_config=quantization_config(settings),
+        on_disk_payload=settings.QDRANT_ON_DISK_PAYLOAD,
+    )
+    try:
+        # Point ids are the corpus indices, which the ground truth refers to
+        client.upload_collection(
+            collection_name, vectors=corpus, ids=list(range(len(corpus))), batch_size=1024
+        )
+        wait_until_indexed(client, collection_name, timeout)
+        memory_after = resident_memory(url)
+
+        latencies: list[float] = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            points = client.query_points(
+                collection_name, query=query.tolist(), limit=k, search_params=search_params
+            ).points
+            latencies.append(time.perf_counter() - start)
+            hits += len(expected & {int(point.id) for point in points})
+
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        measured = (
+            f"{(memory_after - memory_before) / 2**20:>9.1f}"
+            if memory_before is not None and memory_after is not None
+            else f"{'n/a':>9}"
+        )
+        print(
+            f"{name:>18} {hits / (k * len(queries)):>9.4f} "
+            f"{statistics.median(latencies) * 1000:>8.2f} {p99 * 1000:>8.2f} "
+            f"{estimated_ram(settings, len(corpus), corpus.shape[1]) / 2**20:>9.1f} {measured}"
+        )
+    finally:
+        _ = client.delete_collection(collection_name)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    _ = parser.add_argument("--url", default="http://localhost:6333")
+    _ = parser.add_argument("--points", type=int, default=100_000)
+    _ = parser.add_argument("--dim", type=int, default=768)
+    _ = parser.add_argument("--clusters", type=int, default=256)
+    _ = parser.add_argument("--queries", type=int, default=500)
+    _ = parser.add_argument("--k", type=int, default=10)
+    _ = parser.add_argument("--index-timeout", type=float, default=1800)
+    _ = parser.add_argument(
+        "--configs", nargs="+", choices=sorted(CONFIGURATIONS), default=list(CONFIGURATIONS)
+    )
+    args = parser.parse_args()
+
+    corpus, queries = generate_corpus(args.points, args.queries, args.dim, args.clusters)
+    truth = exact_neighbours(corpus, queries, args.k)
+    client = QdrantClient(url=args.url, timeout=120)
+
+    print(
+        f"{'config':>18} {f'recall@{args.k}':>9} {'p50 ms':>8} {'p99 ms':>8} "
+        f"{'est. MiB':>9} {'RSS MiB':>9}"
+    )
+    for name in args.configs:
+        run_configuration(
+            client, args.url, name, corpus, queries, truth, args.k, args.index_timeout
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import unittest
+
+from langchain_core.documents.base import Document as LangChainDocument
+
+from app.core.config import get_retrieval_settings
+from app.services.context import CHARS_PER_TOKEN, ContextService
+
+
+def _chunk(text: str, **metadata) -> LangChainDocument:
+    return LangChainDocument(
+        page_content=text,
+        metadata={"document_id": "d", "source": "t.pdf", "_id": text[:8]} | metadata,
+    )
+
+
+def _words(prefix: str, count: int) -> str:
+    return " ".join(f"{prefix}{index}" for index in range(count))
+
+
+class ContextServiceTest(unittest.TestCase):
+    def context_service(self, max_tokens: int = 600, mmr_lambda: float = 0.7) -> ContextService:
+        settings = get_retrieval_settings().model_copy(
+            update={"CONTEXT_MAX_TOKENS": max_tokens, "CONTEXT_MMR_LAMBDA": mmr_lambda}
+        )
+        service = ContextService(retrieval_settings=settings)
+        # Counts with the characters per token estimate, whatever is installed
+        service._tokenizer_loaded = True
+        return service
+
+    def test_consecutive_chunks_are_merged_without_their_overlap(self):
+        first = _words("uno", 20)
+        second = first[-30:] + " " + _words("dos", 20)
+        context = self.context_service().build(
+            None, [_chunk(second, ordinal=4, page=1), _chunk(first, ordinal=3, page=0)]
+        )
+        self.assertEqual(len(context.sources), 1)
+        self.assertEqual(context.text, f"[1] (t.pdf, p. 1)\n{first} {_words('dos', 20)}")
+        self.assertEqual(context.sources[0]["chunk_ids"], [first[:8], second[:8]])
+
+    def test_distant_chunks_stay_separate(self):
+        context = self.context_service().build(
+            None, [_chunk(_words("uno", 10), ordinal=1), _chunk(_words("dos", 10), ordinal=5)]
+        )
+        self.assertEqual([source["label"] for source in context.sources], [1, 2])
+
+    def test_overlapping_chunks_without_positions_are_merged(self):
+        first = _words("uno", 20)
+        second = first[-30:] + " " + _words("dos", 5)
+        context = self.context_service().build(None, [_chunk(first), _chunk(second)])
+        self.assertEqual(len(context.sources), 1)
+        self.assertTrue(context.text.endswith(f"{first} {_words('dos', 5)}"))
+
+    def test_passages_over_the_budget_are_left_out(self):
+        texts = [_words(prefix, 10) for prefix in ("uno", "dos", "tres")]
+        budget = (len(texts[0]) + len(texts[1])) // CHARS_PER_TOKEN + 2
+        context = self.context_service(max_tokens=budget).build(
+            None, [_chunk(text, ordinal=index * 10) for index, text in enumerate(texts)]
+        )
+        self.assertEqual(len(context.sources), 2)
+        self.assertLessEqual(context.tokens, budget)
+        self.assertNotIn("tres", context.text)
+
+    def test_a_single_passage_over_the_budget_is_truncated(self):
+        context = self.context_service(max_tokens=5).build(None, [_chunk(_words("uno", 50))])
+        self.assertEqual(context.tokens, 5)
+        self.assertEqual(context.text, f"[1] (t.pdf)\n{_words('uno', 50)[: 5 * CHARS_PER_TOKEN]}")
+
+    def test_near_duplicates_give_way_to_new_information(self):
+        documents = [
+            _chunk(_words("uno", 10), _vector=[1.0, 0.0]),
+            _chunk(_words("dos", 10), _vector=[0.99, 0.14]),
+            _chunk(_words("tres", 10), _vector=[0.0, 1.0]),
+        ]
+        budget = 2 * (len(_words("tres", 10)) // CHARS_PER_TOKEN + 1)
+        context = self.context_service(max_tokens=budget).build([1.0, 0.6], documents)
+        self.assertIn("tres", context.text)
+        self.assertEqual(len(context.sources), 2)
+
+    def test_without_diversity_the_most_relevant_passages_are_kept(self):
+        documents = [
+            _chunk(_words("uno", 10), _vector=[1.0, 0.0]),
+            _chunk(_words("dos", 10), _vector=[0.99, 0.14]),
+            _chunk(_words("tres", 10), _vector=[0.0, 1.0]),
+        ]
+        budget = 2 * (len(_words("tres", 10)) // CHARS_PER_TOKEN + 1)
+        context = self.context_service(max_tokens=budget, mmr_lambda=1.0).build(
+            [1.0, 0.6], documents
+        )
+        self.assertNotIn("tres", context.text)
+
+    def test_no_documents_give_an_empty_context(self):
+        context = self.context_service().build(None, [])
+        self.assertEqual((context.text, context.sources, context.tokens), ("", [], 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import threading
+import time
+import unittest
+
+from app.services.embedding import _AdaptiveLimiter
+
+# Long enough for a free slot to be taken, short enough to keep the tests fast
+WAIT_SECONDS = 0.05
+
+
+def _acquire_in_thread(limiter: _AdaptiveLimiter) -> threading.Event:
+    acquired = threading.Event()
+
+    def acquire() -> None:
+        limiter.acquire()
+        acquired.set()
+
+    threading.Thread(target=acquire, daemon=True).start()
+    return acquired
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def test_callers_wait_for_a_free_slot(self):
+        limiter = _AdaptiveLimiter(2)
+        limiter.acquire()
+        limiter.acquire()
+        acquired = _acquire_in_thread(limiter)
+        self.assertFalse(acquired.wait(WAIT_SECONDS))
+        limiter.release()
+        self.assertTrue(acquired.wait(WAIT_SECONDS))
+
+    def test_rate_limits_halve_the_concurrency(self):
+        limiter = _AdaptiveLimiter(4)
+        limiter.acquire()
+        limiter.release(backoff=0)
+        limiter.acquire()
+        limiter.acquire()
+        self.assertFalse(_acquire_in_thread(limiter).wait(WAIT_SECONDS))
+
+    def test_concurrency_never_drops_below_one(self):
+        limiter = _AdaptiveLimiter(2)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(backoff=0)
+        self.assertTrue(_acquire_in_thread(limiter).wait(WAIT_SECONDS))
+
+    def test_rate_limits_pause_every_caller(self):
+        limiter = _AdaptiveLimiter(4)
+        limiter.acquire()
+        limiter.release(backoff=0.2)
+        start = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+    def test_successes_grow_the_concurrency_back(self):
+        limiter = _AdaptiveLimiter(4)
+        limiter.acquire()
+        limiter.release(backoff=0)
+        # Each success adds 1/limit, and the limit never exceeds the maximum
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release()
+        for _ in range(4):
+            self.assertTrue(_acquire_in_thread(limiter).wait(WAIT_SECONDS))
+        self.assertFalse(_acquire_in_thread(limiter).wait(WAIT_SECONDS))
+
+
+if __name__ == "__main__":
+    unittest.main()
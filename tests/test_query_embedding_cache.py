@@ -0,0 +1,124 @@
+from typing import cast
+import unittest
+
+from langchain_core.embeddings import Embeddings
+
+from app.core.config import get_embedding_settings
+from app.services.embedding_cache import EmbeddingCacheService
+from app.services.query_embedding_cache import QueryEmbeddingCache, normalize_query
+
+
+class _CountingEmbeddings(Embeddings):
+    def __init__(self) -> None:
+        self.embedded: list[str] = []
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        self.embedded.extend(texts)
+        return [[float(len(text)), float(sum(map(ord, text)))] for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+
+class _SharedCache:
+    """Stands in for the embedding cache table."""
+
+    def __init__(self) -> None:
+        self.vectors: dict[tuple[str, str], list[float]] = {}
+
+    def lookup(self, model: str, hashes: set[str]) -> dict[str, list[float]]:
+        return {
+            content_hash: self.vectors[(model, content_hash)]
+            for content_hash in hashes
+            if (model, content_hash) in self.vectors
+        }
+
+    def store(self, model: str, vectors: dict[str, list[float]]) -> None:
+        for content_hash, vector in vectors.items():
+            self.vectors[(model, content_hash)] = vector
+
+
+def _query_cache(
+    max_entries: int = 100,
+    ttl_seconds: float = 3600.0,
+    shared_cache: _SharedCache | None = None,
+) -> QueryEmbeddingCache:
+    settings = get_embedding_settings().model_copy(
+        update={
+            "QUERY_CACHE_MAX_ENTRIES": max_entries,
+            "QUERY_CACHE_TTL_SECONDS": ttl_seconds,
+            "QUERY_CACHE_SHARED": shared_cache is not None,
+        }
+    )
+    return QueryEmbeddingCache(
+        embedding_settings=settings,
+        shared_cache=cast(EmbeddingCacheService, shared_cache or _SharedCache()),
+    )
+
+
+class NormalizeQueryTest(unittest.TestCase):
+    def test_case_spacing_and_unicode_form_are_ignored(self):
+        self.assertEqual(normalize_query("  ¿Qué\tES   x? "), normalize_query("¿qué es x?"))
+
+
+class QueryEmbeddingCacheTest(unittest.TestCase):
+    def test_equivalent_queries_are_embedded_once(self):
+        cache = _query_cache()
+        embeddings = _CountingEmbeddings()
+        first = cache.embed_query(embeddings, "m", "Hola Mundo")
+        self.assertEqual(cache.embed_query(embeddings, "m", "  hola   mundo"), first)
+        self.assertEqual(embeddings.embedded, ["hola mundo"])
+
+    def test_models_do_not_share_entries(self):
+        cache = _query_cache()
+        embeddings = _CountingEmbeddings()
+        _ = cache.embed_query(embeddings, "a", "hola")
+        _ = cache.embed_query(embeddings, "b", "hola")
+        self.assertEqual(embeddings.embedded, ["hola", "hola"])
+
+    def test_misses_are_embedded_in_one_call_in_order(self):
+        cache = _query_cache()
+        embeddings = _CountingEmbeddings()
+        _ = cache.embed_query(embeddings, "m", "dos")
+        vectors = cache.embed_queries(embeddings, "m", ["uno", "dos", "tres", "UNO"])
+        self.assertEqual(embeddings.embedded, ["dos", "uno", "tres"])
+        self.assertEqual(vectors, embeddings.embed_documents(["uno", "dos", "tres", "uno"]))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = _query_cache(max_entries=2)
+        embeddings = _CountingEmbeddings()
+        for query in ("uno", "dos", "uno", "tres"):
+            _ = cache.embed_query(embeddings, "m", query)
+        embeddings.embedded.clear()
+        _ = cache.embed_queries(embeddings, "m", ["uno", "tres", "dos"])
+        self.assertEqual(embeddings.embedded, ["dos"])
+
+    def test_expired_entries_are_embedded_again(self):
+        cache = _query_cache(ttl_seconds=0)
+        embeddings = _CountingEmbeddings()
+        _ = cache.embed_query(embeddings, "m", "hola")
+        _ = cache.embed_query(embeddings, "m", "hola")
+        self.assertEqual(embeddings.embedded, ["hola", "hola"])
+
+    def test_misses_are_shared_between_processes(self):
+        shared_cache = _SharedCache()
+        embeddings = _CountingEmbeddings()
+        vector = _query_cache(shared_cache=shared_cache).embed_query(embeddings, "m", "hola")
+        self.assertEqual(
+            _query_cache(shared_cache=shared_cache).embed_query(embeddings, "m", "Hola"), vector
+        )
+        self.assertEqual(embeddings.embedded, ["hola"])
+
+
+class AsyncQueryEmbeddingCacheTest(unittest.IsolatedAsyncioTestCase):
+    async def test_async_lookups_share_the_cache(self):
+        cache = _query_cache()
+        embeddings = _CountingEmbeddings()
+        vector = await cache.aembed_query(embeddings, "m", "hola")
+        self.assertEqual(cache.embed_query(embeddings, "m", "HOLA"), vector)
+        self.assertEqual(await cache.aembed_query(embeddings, "m", "hola "), vector)
+        self.assertEqual(embeddings.embedded, ["hola"])
+
+
+if __name__ == "__main__":
+    unittest.main()
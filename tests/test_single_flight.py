@@ -0,0 +1,162 @@
+import asyncio
+import unittest
+import uuid
+
+from app.core.config import get_retrieval_settings
+from app.services.single_flight import SingleFlightService
+
+
+def _single_flight(enabled: bool = True) -> SingleFlightService:
+    settings = get_retrieval_settings().model_copy(update={"SINGLE_FLIGHT_ENABLED": enabled})
+    return SingleFlightService(retrieval_settings=settings)
+
+
+class KeyTest(unittest.TestCase):
+    def test_equivalent_queries_share_a_key(self):
+        single_flight = _single_flight()
+        user_id = uuid.uuid4()
+        self.assertEqual(
+            single_flight.key("¿Qué es X?", user_id, None, "v1", True),
+            single_flight.key("  ¿qué   es x? ", user_id, None, "v1", True),
+        )
+
+    def test_scope_and_cache_use_are_part_of_the_key(self):
+        single_flight = _single_flight()
+        user_id = uuid.uuid4()
+        key = single_flight.key("q", user_id, None, "v1", True)
+        self.assertNotEqual(key, single_flight.key("q", uuid.uuid4(), None, "v1", True))
+        self.assertNotEqual(key, single_flight.key("q", user_id, [uuid.uuid4()], "v1", True))
+        self.assertNotEqual(key, single_flight.key("q", user_id, None, "v2", True))
+        self.assertNotEqual(key, single_flight.key("q", user_id, None, "v1", False))
+
+
+class RunTest(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_computation(self):
+        single_flight = _single_flight()
+        calls = 0
+
+        async def compute() -> str:
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*(single_flight.run("key", compute) for _ in range(10)))
+        self.assertEqual(results, ["answer"] * 10)
+        self.assertEqual(calls, 1)
+
+        # Finished computations are not reused
+        _ = await single_flight.run("key", compute)
+        self.assertEqual(calls, 2)
+
+    async def test_disabled_runs_every_call(self):
+        single_flight = _single_flight(enabled=False)
+        calls = 0
+
+        async def compute() -> int:
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        _ = await asyncio.gather(*(single_flight.run("key", compute) for _ in range(3)))
+        self.assertEqual(calls, 3)
+
+    async def test_errors_reach_every_waiter(self):
+        single_flight = _single_flight()
+
+        async def fail() -> None:
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(
+            *(single_flight.run("key", fail) for _ in range(3)), return_exceptions=True
+        )
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    async def test_cancelling_one_waiter_keeps_the_computation(self):
+        single_flight = _single_flight()
+        finished = asyncio.Event()
+
+        async def compute() -> str:
+            await finished.wait()
+            return "answer"
+
+        first = asyncio.ensure_future(single_flight.run("key", compute))
+        second = asyncio.ensure_future(single_flight.run("key", compute))
+        await asyncio.sleep(0)
+        _ = first.cancel()
+        await asyncio.sleep(0)
+        finished.set()
+        self.assertEqual(await second, "answer")
+
+    async def test_cancelling_every_waiter_cancels_the_computation(self):
+        single_flight = _single_flight()
+        cancelled = asyncio.Event()
+
+        async def compute() -> None:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.ensure_future(single_flight.run("key", compute)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            _ = waiter.cancel()
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+
+        # A later call starts over instead of joining the cancelled computation
+        async def answer() -> str:
+            return "answer"
+
+        self.assertEqual(await single_flight.run("key", answer), "answer")
+
+
+class StreamTest(unittest.IsolatedAsyncioTestCase):
+    async def test_late_subscribers_replay_the_stream(self):
+        single_flight = _single_flight()
+        calls = 0
+        halfway = asyncio.Event()
+        resume = asyncio.Event()
+
+        async def events():
+            nonlocal calls
+            calls += 1
+            yield "token", 1
+            halfway.set()
+            await resume.wait()
+            yield "token", 2
+            yield "done", 3
+
+        async def consume() -> list[tuple[str, int]]:
+            return [event async for event in single_flight.stream("key", events)]
+
+        first = asyncio.ensure_future(consume())
+        await halfway.wait()
+        second = asyncio.ensure_future(consume())
+        await asyncio.sleep(0)
+        resume.set()
+        expected = [("token", 1), ("token", 2), ("done", 3)]
+        self.assertEqual(await first, expected)
+        self.assertEqual(await second, expected)
+        self.assertEqual(calls, 1)
+
+    async def test_errors_end_every_subscriber(self):
+        single_flight = _single_flight()
+
+        async def events():
+            yield "token", 1
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def consume() -> list[tuple[str, int]]:
+            return [event async for event in single_flight.stream("key", events)]
+
+        results = await asyncio.gather(consume(), consume(), return_exceptions=True)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import io
+import unittest
+import uuid
+
+from langchain_core.documents.base import Document as LangChainDocument
+
+from app.services.vector import service as vector_service
+
+
+def _paragraphs(page: int, count: int) -> str:
+    return "\n\n".join(
+        " ".join(f"pagina{page} parrafo{paragraph} palabra{word}" for word in range(20))
+        for paragraph in range(count)
+    )
+
+
+def _pages(texts: list[str]) -> list[LangChainDocument]:
+    return [
+        LangChainDocument(page_content=text, metadata={"source": "t.pdf", "page": number})
+        for number, text in enumerate(texts)
+    ]
+
+
+class SplitPagesTest(unittest.TestCase):
+    def split(self, texts: list[str]) -> list[tuple[int, LangChainDocument]]:
+        return list(vector_service._split_pages(_pages(texts), None))
+
+    def assert_offsets_match(self, texts: list[str]) -> None:
+        joined = "\n".join(texts)
+        chunks = self.split(texts)
+        self.assertGreater(len(chunks), 1)
+        for start, chunk in chunks:
+            self.assertEqual(joined[start : start + len(chunk.page_content)], chunk.page_content)
+
+    def test_offsets_index_the_pages_joined_by_newlines(self):
+        self.assert_offsets_match([_paragraphs(page, 6) for page in range(4)])
+
+    def test_offsets_account_for_empty_pages(self):
+        self.assert_offsets_match(["", _paragraphs(1, 6), "", "", _paragraphs(4, 3)])
+
+    def test_chunks_keep_the_metadata_of_the_page_they_start_on(self):
+        texts = [_paragraphs(page, 6) for page in range(3)]
+        starts = [sum(len(text) + 1 for text in texts[:page]) for page in range(3)]
+        for start, chunk in self.split(texts):
+            page = max(page for page, page_start in enumerate(starts) if page_start <= start)
+            self.assertEqual(chunk.metadata["page"], page)
+
+    def test_short_pages_are_carried_into_one_chunk(self):
+        chunks = self.split(["uno", "dos", "tres"])
+        self.assertEqual(
+            [(start, chunk.page_content) for start, chunk in chunks], [(0, "uno\ndos\ntres")]
+        )
+
+
+class IterChunksTest(unittest.TestCase):
+    def test_unchanged_chunks_keep_their_ids(self):
+        document_id = uuid.uuid4()
+        user_id = uuid.uuid4()
+        text = _paragraphs(0, 8)
+
+        def chunk_ids(content: str) -> list[str]:
+            return [
+                created.id
+                for created, _ in vector_service.iter_chunks(
+                    io.BytesIO(content.encode()), ".txt", document_id, user_id, "t.txt"
+                )
+            ]
+
+        first = chunk_ids(text)
+        self.assertEqual(chunk_ids(text), first)
+        self.assertTrue(set(first) & set(chunk_ids(text + "\n\nUn parrafo nuevo al final.")))
+
+
+if __name__ == "__main__":
+    unittest.main()